@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import faiss
+import numpy as np
+from src.storage.ann_index import INDEX_TYPES, build_index, search_index
+from src.storage.vector_store import load_segments
+
+def make_synthetic_vectors(num_vectors: int, dim: int, num_clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dim)).astype(np.float32)
+    assignments = rng.integers(0, num_clusters, size=num_vectors)
+    return centers[assignments] + 0.3 * rng.standard_normal((num_vectors, dim)).astype(np.float32)
+
+def exact_search(vectors: np.ndarray, norms: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    distances = norms - 2.0 * (vectors @ query)
+    top = np.argpartition(distances, k - 1)[:k]
+    return top[np.argsort(distances[top])]
+
+def benchmark_index_type(index_type: str, vectors: np.ndarray, queries: np.ndarray, ground_truth: list, k: int) -> dict:
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    start = time.perf_counter()
+    index = build_index(vectors, index_type, min_size=0)
+    build_seconds = time.perf_counter() - start
+
+    latencies, recalls = [], []
+    for query, expected in zip(queries, ground_truth):
+        start = time.perf_counter()
+        if index is None:
+            found = exact_search(vectors, norms, query, k)
+        else:
+            _, found = search_index(index, query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        recalls.append(len(set(found.tolist()) & expected) / k)
+
+    # flat keeps raw vectors + norms + ids; ANN indexes are measured serialized.
+    index_bytes = vectors.shape[0] * (vectors.shape[1] * 4 + 12) if index is None else len(faiss.serialize_index(index))
+    return {
+        "index_type": index_type,
+        "build_seconds": round(build_seconds, 3),
+        f"recall@{k}": round(float(np.mean(recalls)), 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "mb_per_million_vectors": round(index_bytes / vectors.shape[0] * 1_000_000 / 2**20, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall/latency/memory of the ANN index types against the flat baseline.")
+    parser.add_argument("--space-id", help="Benchmark on the vectors of this shard instead of synthetic data.")
+    parser.add_argument("--num-vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--index-types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    if args.space_id:
+        vectors = np.concatenate([np.asarray(segment.vectors) for segment in load_segments(args.space_id)])
+        rng = np.random.default_rng(1)
+        noise = 0.05 * rng.standard_normal((args.num_queries, vectors.shape[1])).astype(np.float32)
+        queries = vectors[rng.integers(0, len(vectors), size=args.num_queries)] + noise
+    else:
+        vectors = make_synthetic_vectors(args.num_vectors, args.dim)
+        queries = make_synthetic_vectors(args.num_queries, args.dim, seed=1)
+    print(f"Benchmarking {len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    ground_truth = [set(exact_search(vectors, norms, query, args.k).tolist()) for query in queries]
+
+    results = []
+    for index_type in args.index_types:
+        result = benchmark_index_type(index_type, vectors, queries, ground_truth, args.k)
+        results.append(result)
+        print(" | ".join(f"{key}: {value}" for key, value in result.items()))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"num_vectors": len(vectors), "dim": int(vectors.shape[1]), "k": args.k, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from src.storage.vector_store import add_to_shard
+from src.tools.rag_tool import RAGTool
+from src.tools.reranking import Reranker
+
+# N concurrent RAGTool.aanswer calls against a fake LLM with fixed latency should take
+# about as long as one call; N sequential RAGTool.answer calls take N times as long.
+
+class SlowFakeChatModel(FakeListChatModel):
+    """Fake LLM whose every call takes `sleep` seconds, without holding a thread when awaited."""
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.sleep)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.responses[0]))])
+
+def build_fake_rag_tool(work_dir: str, llm_latency: float) -> RAGTool:
+    db_path = os.path.join(work_dir, "metadata.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE PDF_Document (id TEXT PRIMARY KEY, filename TEXT NOT NULL, space_id TEXT NOT NULL)")
+    conn.execute("CREATE TABLE User_Space_Membership (user_id TEXT NOT NULL, space_id TEXT NOT NULL, PRIMARY KEY (user_id, space_id))")
+    conn.execute("INSERT INTO PDF_Document VALUES ('doc_1', 'invoice.pdf', 'sp_test')")
+    conn.execute("INSERT INTO User_Space_Membership VALUES ('user_1', 'sp_test')")
+    conn.commit()
+    conn.close()
+
+    embeddings = DeterministicFakeEmbedding(size=64)
+    vector_store_path = os.path.join(work_dir, "faiss_index")
+    chunks = [
+        Document(page_content=f"File name: invoice.pdf. Nội dung: invoice line {i} total {i * 10}", metadata={"source": "invoice.pdf", "page": 0})
+        for i in range(200)
+    ]
+    add_to_shard("sp_test", chunks, embeddings, vector_store_path, compact_in_background=False)
+
+    return RAGTool(
+        vector_store_path=vector_store_path,
+        db_path=db_path,
+        embeddings=embeddings,
+        llm=SlowFakeChatModel(responses=["fake answer"], sleep=llm_latency),
+        reranker=Reranker(backend="score", fallback_backend="score"),
+    )
+
+async def run_concurrently(rag_tool: RAGTool, questions: list) -> float:
+    start = time.perf_counter()
+    await asyncio.gather(*(rag_tool.aanswer(f"user_1|{question}") for question in questions))
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent async RAG requests overlap instead of queueing.")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Seconds per fake LLM call.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rag_tool = build_fake_rag_tool(work_dir, args.llm_latency)
+        # Distinct questions, so the answer cache never short-circuits a request.
+        questions = [f"what is the total of invoice line {i}?" for i in range(args.concurrency + 1)]
+
+        single_seconds = asyncio.run(run_concurrently(rag_tool, questions[:1]))
+        concurrent_seconds = asyncio.run(run_concurrently(rag_tool, questions[1:]))
+
+    ratio = concurrent_seconds / single_seconds
+    print(f"1 request: {single_seconds:.2f}s, {args.concurrency} concurrent requests: {concurrent_seconds:.2f}s ({ratio:.2f}x)")
+    print(f"Sequential sync requests would take ~{args.concurrency * single_seconds:.2f}s.")
+    if ratio > 2.0:
+        sys.exit(f"Concurrent requests did not overlap ({ratio:.2f}x the time of one).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import datetime
+import tempfile
+import subprocess
+from typing import Callable, Dict, List
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from src.config import *
+from src.storage.database import get_pool
+from src.storage.vector_store import add_to_shard, compact_shard
+from src.processing.chunking import format_chunk_content, split_documents
+from src.processing.ingest_single_file import process_and_ingest_single_pdf
+from src.tools.rag_tool import RAGTool
+from src.tools.reranking import Reranker
+from ingest_data import create_metadata_database, load_documents_from_directory
+
+# Offline benchmarks of the ingestion and retrieval components at 1k / 100k / 1M chunks.
+# Embeddings, reranker and LLM are deterministic local fakes, so no API key is needed and
+# runs are comparable. Each scale gets a synthetic SQLite metadata database and vector
+# store; PDF parsing is measured on a generated PDF corpus capped at --max-pdf-chunks.
+# Results are written as JSON; --baseline compares them with an earlier run.
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+CHUNKS_PER_DOC = 20
+DOCS_PER_SPACE = 100
+SPACES_PER_USER = 10
+NUM_USERS = 100
+INDEX_BATCH_SIZE = 10_000
+
+WORDS = (
+    "invoice total amount shipping customer address item price quantity discount tax "
+    "report quarter revenue marketing campaign budget payment order delivery contract "
+    "supplier balance account summary region product service date number reference"
+).split()
+
+class HashEmbeddings(Embeddings):
+    """Deterministic fake embeddings: the same text always maps to the same unit vector."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+            vectors[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
+
+def synthetic_text(seed: int, num_words: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) if i % 7 else str(rng.randint(100, 99999)) for i in range(num_words))
+
+def doc_filename(doc_index: int) -> str:
+    return f"doc_{doc_index:07d}.pdf"
+
+def space_of(doc_index: int) -> str:
+    return f"sp_{doc_index // DOCS_PER_SPACE:05d}"
+
+def chunk_text(chunk_index: int) -> str:
+    doc_index = chunk_index // CHUNKS_PER_DOC
+    return format_chunk_content(doc_filename(doc_index), synthetic_text(chunk_index, 60))
+
+# --- Synthetic corpus ---
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_text_pdf(path: str, pages: List[List[str]]):
+    """Minimal PDF with one Helvetica text line per entry (ASCII only)."""
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(pages)} >>".encode(),
+        3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    for page_id, lines in zip(page_ids, pages):
+        body = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects[page_id] = f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode()
+        objects[page_id + 1] = f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(out)
+        out += f"{object_id} 0 obj\n".encode() + objects[object_id] + b"\nendobj\n"
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for object_id in sorted(objects):
+        out += f"{offsets[object_id]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+def write_pdf_corpus(directory: str, num_docs: int, first_doc: int = 0) -> List[str]:
+    """PDFs of ~CHUNKS_PER_DOC chunks each: 5 pages of 33 lines of ~80 characters."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for doc_index in range(first_doc, first_doc + num_docs):
+        pages = [
+            [synthetic_text(doc_index * 1000 + page * 100 + line, 12) for line in range(33)]
+            for page in range(5)
+        ]
+        path = os.path.join(directory, doc_filename(doc_index))
+        write_text_pdf(path, pages)
+        paths.append(path)
+    return paths
+
+def build_metadata_database(db_path: str, num_docs: int) -> Dict[str, List[str]]:
+    """Workspaces, spaces, documents and memberships for `num_docs` documents. Returns {user_id: space_ids}."""
+    create_metadata_database(db_path)
+    num_spaces = (num_docs + DOCS_PER_SPACE - 1) // DOCS_PER_SPACE
+    space_ids = [f"sp_{i:05d}" for i in range(num_spaces)]
+    now = datetime.datetime.now().isoformat()
+    rng = random.Random(0)
+    spaces_by_user = {
+        f"user_{u:04d}": rng.sample(space_ids, min(SPACES_PER_USER, num_spaces))
+        for u in range(NUM_USERS)
+    }
+    with get_pool(db_path).connection() as conn:
+        conn.executemany("INSERT INTO User VALUES (?, ?, ?, ?)", [(u, u, f"{u}@example.com", now) for u in spaces_by_user])
+        conn.executemany(
+            "INSERT INTO Workspace VALUES (?, ?, ?, ?)",
+            [(f"ws_{i:04d}", f"Workspace {i}", now, now) for i in range(num_spaces // 10 + 1)]
+        )
+        conn.executemany(
+            "INSERT INTO Space VALUES (?, ?, ?, ?, ?)",
+            [(space_id, space_id, f"ws_{i // 10:04d}", now, now) for i, space_id in enumerate(space_ids)]
+        )
+        conn.executemany(
+            "INSERT INTO PDF_Document (id, filename, space_id, owner_id, size_bytes, uploaded_at) VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"doc_{d:07d}", doc_filename(d), space_of(d), "user_0000", 0, now) for d in range(num_docs))
+        )
+        conn.executemany(
+            "INSERT INTO User_Space_Membership VALUES (?, ?)",
+            [(user_id, space_id) for user_id, spaces in spaces_by_user.items() for space_id in spaces]
+        )
+    return spaces_by_user
+
+# --- Measurements ---
+
+def timed(fn: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def throughput(items: int, seconds: float, unit: str) -> dict:
+    return {unit: items, "seconds": round(seconds, 4), f"{unit}_per_second": round(items / seconds, 1) if seconds > 0 else None}
+
+def latency(samples_seconds: List[float]) -> dict:
+    samples_ms = np.asarray(samples_seconds) * 1000
+    return {
+        "count": len(samples_ms),
+        "p50_ms": round(float(np.percentile(samples_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(samples_ms, 99)), 3),
+        "mean_ms": round(float(samples_ms.mean()), 3),
+    }
+
+def bench_parsing(work_dir: str, num_chunks: int, max_pdf_chunks: int) -> dict:
+    num_docs = max(1, min(num_chunks, max_pdf_chunks) // CHUNKS_PER_DOC)
+    pdf_dir = os.path.join(work_dir, "pdfs")
+    write_pdf_corpus(pdf_dir, num_docs)
+    (docs, errors), load_seconds = timed(load_documents_from_directory, pdf_dir)
+    chunks, split_seconds = timed(split_documents, docs, verbose=False)
+    return {
+        "load_documents_from_directory": {**throughput(len(docs), load_seconds, "pages"), "files": num_docs, "errors": len(errors)},
+        "split_documents": throughput(len(chunks), split_seconds, "chunks"),
+    }
+
+def bench_index_build(vector_store_path: str, num_chunks: int, embeddings: HashEmbeddings) -> dict:
+    embed_seconds = append_seconds = 0.0
+    spaces = set()
+    for batch_start in range(0, num_chunks, INDEX_BATCH_SIZE):
+        batch = range(batch_start, min(num_chunks, batch_start + INDEX_BATCH_SIZE))
+        texts = [chunk_text(i) for i in batch]
+        vectors, seconds = timed(embeddings.embed_array, texts)
+        embed_seconds += seconds
+        by_space = {}
+        for i, text in zip(batch, texts):
+            doc_index = i // CHUNKS_PER_DOC
+            metadata = {"source": doc_filename(doc_index), "doc_id": f"doc_{doc_index:07d}", "page": 0}
+            by_space.setdefault(space_of(doc_index), []).append((i - batch_start, Document(page_content=text, metadata=metadata)))
+        start = time.perf_counter()
+        for space_id, entries in by_space.items():
+            rows = [row for row, _ in entries]
+            add_to_shard(space_id, [doc for _, doc in entries], embeddings, vector_store_path, vectors=vectors[rows], compact_in_background=False)
+        append_seconds += time.perf_counter() - start
+        spaces |= set(by_space)
+
+    start = time.perf_counter()
+    for space_id in spaces:
+        compact_shard(space_id, vector_store_path)
+    compact_seconds = time.perf_counter() - start
+    return {
+        "fake_embedding": throughput(num_chunks, embed_seconds, "chunks"),
+        "index_append": {**throughput(num_chunks, append_seconds, "chunks"), "shards": len(spaces)},
+        "index_compact": {**throughput(num_chunks, compact_seconds, "chunks"), "index_type": VECTOR_INDEX_TYPE},
+    }
+
+def bench_permissions(rag_tool: RAGTool, user_ids: List[str]) -> dict:
+    cold, warm = [], []
+    rag_tool.permissions.clear()
+    for user_id in user_ids:
+        cold.append(timed(rag_tool._get_accessible_doc_sources, user_id)[1])
+    for user_id in user_ids:
+        warm.append(timed(rag_tool._get_accessible_doc_sources, user_id)[1])
+    return {"_get_accessible_doc_sources_cold": latency(cold), "_get_accessible_doc_sources_warm": latency(warm)}
+
+def bench_retrieval(rag_tool: RAGTool, spaces_by_user: Dict[str, List[str]], num_chunks: int, num_queries: int) -> dict:
+    rng = random.Random(1)
+    retrieve, rerank, answer = [], [], []
+    rag_tool.answer_cache = None  # every question goes through the whole pipeline
+    for _ in range(num_queries):
+        user_id = rng.choice(list(spaces_by_user))
+        space_ids = spaces_by_user[user_id]
+        space_index = int(rng.choice(space_ids)[3:])
+        doc_index = min(space_index * DOCS_PER_SPACE + rng.randrange(DOCS_PER_SPACE), (num_chunks - 1) // CHUNKS_PER_DOC)
+        # Eight words of a chunk from one of the user's spaces, so the query has real neighbours.
+        question = " ".join(chunk_text(doc_index * CHUNKS_PER_DOC + rng.randrange(CHUNKS_PER_DOC)).split()[-8:])
+        query_vector = rag_tool.embeddings.embed_query(question)
+
+        candidates, seconds = timed(rag_tool._retrieve, question, space_ids, query_vector)
+        retrieve.append(seconds)
+        rerank.append(timed(rag_tool._rerank, question, candidates)[1])
+        answer.append(timed(rag_tool.answer, f"{user_id}|{question}")[1])
+    return {"retrieve": latency(retrieve), "rerank": latency(rerank), "answer_end_to_end": latency(answer)}
+
+def bench_single_file_ingest(work_dir: str, db_path: str, vector_store_path: str, embeddings: HashEmbeddings, num_docs: int, num_files: int) -> dict:
+    # New documents, so the duplicate check never short-circuits an upload.
+    paths = write_pdf_corpus(os.path.join(work_dir, "uploads"), num_files, first_doc=num_docs)
+    samples, failures = [], 0
+    for doc_index, path in zip(range(num_docs, num_docs + num_files), paths):
+        (ok, _), seconds = timed(
+            process_and_ingest_single_pdf, path, space_of(doc_index % max(num_docs, 1)), "user_0000",
+            db_path=db_path, base_path=vector_store_path, embeddings=embeddings,
+        )
+        samples.append(seconds)
+        failures += not ok
+    return {"process_and_ingest_single_pdf": {**latency(samples), "failures": failures}}
+
+def run_scale(num_chunks: int, args) -> dict:
+    print(f"\n=== {num_chunks} chunks ===")
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        db_path = os.path.join(work_dir, "metadata.db")
+        vector_store_path = os.path.join(work_dir, "faiss_index")
+        embeddings = HashEmbeddings(args.dim)
+        num_docs = (num_chunks + CHUNKS_PER_DOC - 1) // CHUNKS_PER_DOC
+
+        results = {}
+        spaces_by_user, seconds = timed(build_metadata_database, db_path, num_docs)
+        results["metadata_database"] = throughput(num_docs, seconds, "documents")
+        results.update(bench_parsing(work_dir, num_chunks, args.max_pdf_chunks))
+        results.update(bench_index_build(vector_store_path, num_chunks, embeddings))
+
+        rag_tool = RAGTool(
+            vector_store_path=vector_store_path,
+            db_path=db_path,
+            embeddings=embeddings,
+            llm=FakeListChatModel(responses=["fake answer"]),
+            reranker=Reranker(backend="score", fallback_backend="score"),
+        )
+        results.update(bench_permissions(rag_tool, list(spaces_by_user)))
+        results.update(bench_retrieval(rag_tool, spaces_by_user, num_chunks, args.num_queries))
+        results.update(bench_single_file_ingest(work_dir, db_path, vector_store_path, embeddings, num_docs, args.num_uploads))
+        get_pool(db_path).close()
+        get_pool(db_path, read_only=True).close()
+
+    for name, values in results.items():
+        print(f"{name:<36} " + " | ".join(f"{key}: {value}" for key, value in values.items()))
+    return {"num_chunks": num_chunks, "results": results}
+
+def compare_with_baseline(report: dict, baseline_path: str):
+    """Print p50 latency and throughput ratios (current / baseline) for scales in both runs."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {scale["num_chunks"]: scale["results"] for scale in json.load(f)["scales"]}
+    for scale in report["scales"]:
+        previous = baseline.get(scale["num_chunks"])
+        if previous is None:
+            continue
+        print(f"\n=== {scale['num_chunks']} chunks vs baseline ===")
+        for name, values in scale["results"].items():
+            for key, value in values.items():
+                old = previous.get(name, {}).get(key)
+                if (key == "p50_ms" or key.endswith("_per_second")) and value and old:
+                    print(f"{name:<36} {key:<22} {old:>10} -> {value:<10} ({value / old:.2f}x)")
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion and retrieval benchmarks with fake embeddings, reranker and LLM.")
+    parser.add_argument("--scales", nargs="+", default=["1k"], choices=SCALES, help="Corpus sizes in chunks.")
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding dimension.")
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--num-uploads", type=int, default=5, help="PDFs ingested one by one with process_and_ingest_single_pdf.")
+    parser.add_argument("--max-pdf-chunks", type=int, default=20_000, help="Cap on the generated PDF corpus used for parsing / splitting.")
+    parser.add_argument("--work-dir", default=None, help="Where the temporary corpora are built (default: system temp dir).")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against.")
+    args = parser.parse_args()
+
+    report = {
+        "git_commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "dim": args.dim, "num_queries": args.num_queries, "max_pdf_chunks": args.max_pdf_chunks,
+            "vector_index_type": VECTOR_INDEX_TYPE, "hybrid_search": HYBRID_SEARCH,
+            "retrieval_top_k": RETRIEVAL_TOP_K, "chunks_per_doc": CHUNKS_PER_DOC,
+        },
+        "scales": [run_scale(SCALES[scale], args) for scale in args.scales],
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.baseline:
+        compare_with_baseline(report, args.baseline)
+
+if __name__ == "__main__":
+    main()
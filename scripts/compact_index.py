@@ -0,0 +1,20 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config import *
+from src.storage.vector_store import compact_shard
+
+def main():
+    """Merge the append-only segments of every shard into a single segment."""
+    if not os.path.isdir(VECTOR_STORE_PATH):
+        print("Không tìm thấy vector store. Kết thúc.")
+        return
+
+    for space_id in sorted(os.listdir(VECTOR_STORE_PATH)):
+        if os.path.isdir(os.path.join(VECTOR_STORE_PATH, space_id)):
+            compact_shard(space_id)
+
+if __name__ == "__main__":
+    main()
@@ -1,210 +1,213 @@
 import os
 import sys
-from typing import List
+from typing import Dict, List, Tuple
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.documents import Document
-import sqlite3
 from src.config import *
-from src.utils import get_current_hcm_time_iso
-
-def load_documents_from_directory(directory_path: str) -> List[Document]:
-    all_docs = []
-    for filename in os.listdir(directory_path):
-        if filename.endswith(".pdf"):
-            file_path = os.path.join(directory_path, filename)
-            try:
-                loader = PyPDFLoader(file_path)
-                docs_for_file = loader.load()
-                for doc in docs_for_file:
-                    filename = filename.replace(" ", "_") # for sql
-                    doc.metadata["source"] = filename
-                all_docs.extend(docs_for_file)
-            except Exception as e:
-                print(f"Error when read file {filename}: {e}")
-    return all_docs
-
-def split_documents(documents: List[Document]) -> List[Document]:
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len
-    )
-    chunks = text_splitter.split_documents(documents)
-    print(f"Split successfull {len(chunks)} chunks.")
-    for chunk in chunks:
-        source_file = chunk.metadata.get("source", "unknown_source")
-        chunk.page_content = f"File name: {source_file}. Nội dung: {chunk.page_content}"
-    return chunks
-
-def create_and_save_vector_store(chunks: List[Document], save_path: str):    
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model=EMBEDDING_MODEL_NAME,
-        google_api_key=GOOGLE_API_KEY
-    )
+from src.utils import get_current_hcm_time_iso, compute_file_hash
+from src.storage.database import get_pool
+from src.storage.metadata_db import ensure_metadata_indexes, bump_permission_version
+from src.processing.embedding import build_ingestion_embeddings
+from src.processing.pdf_parsing import parse_pdfs_in_parallel
+from src.processing.pipeline import run_ingestion_pipeline
+
+def list_pdf_files(directory_path: str) -> List[str]:
+    return [
+        os.path.join(directory_path, filename)
+        for filename in sorted(os.listdir(directory_path))
+        if filename.endswith(".pdf")
+    ]
+
+def load_documents_from_directory(
+    directory_path: str,
+    max_workers: int = PDF_PARSE_WORKERS,
+    timeout: float = PDF_PARSE_TIMEOUT_SECONDS,
+) -> Tuple[List[Document], Dict[str, str]]:
+    """Parse every PDF in the directory on a process pool.
+
+    Pages come back ordered by filename; per-file errors (including timeouts) are
+    returned as {filename: error} instead of aborting the run.
+    """
+    return parse_pdfs_in_parallel(list_pdf_files(directory_path), max_workers=max_workers, timeout=timeout)
+
+def get_space_ids_by_filename() -> Dict[str, List[str]]:
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT filename, space_id FROM PDF_Document")
+        space_ids_by_filename = {}
+        for filename, space_id in cursor.fetchall():
+            space_ids_by_filename.setdefault(filename, []).append(space_id)
+    return space_ids_by_filename
+
+def update_content_hashes(directory_path: str):
+    """Fill PDF_Document.content_hash for registered files that do not have one yet."""
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        for filename in os.listdir(directory_path):
+            if filename.endswith(".pdf"):
+                content_hash = compute_file_hash(os.path.join(directory_path, filename))
+                cursor.execute(
+                    "UPDATE PDF_Document SET content_hash = ? WHERE filename = ? AND content_hash IS NULL",
+                    (content_hash, filename.replace(" ", "_"))
+                )
+
+def create_metadata_database(db_path: str = SQL_DATABASE_PATH):
+    with get_pool(db_path).connection() as conn:
+        cursor = conn.cursor()
+
+        # Bảng User
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS User (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        ''')
+
+        # Bảng Workspace
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Workspace (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        ''')
     
-    vector_store = FAISS.from_documents(chunks, embeddings)
+        # Bảng Space
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Space (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            workspace_id TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY (workspace_id) REFERENCES Workspace (id)
+        )
+        ''')
+
+        # Bảng PDF_Document
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS PDF_Document (
+            id TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            content_hash TEXT, -- Để kiểm tra sự trùng lặp nếu muốn
+            space_id TEXT NOT NULL,
+            owner_id TEXT NOT NULL,
+            size_bytes INTEGER,
+            uploaded_at TEXT NOT NULL,
+            FOREIGN KEY (space_id) REFERENCES Space (id),
+            FOREIGN KEY (owner_id) REFERENCES User (id)
+        )
+        ''')
     
-    vector_store.save_local(save_path)
-
-def create_metadata_database():
-    conn = sqlite3.connect(SQL_DATABASE_PATH)
-    cursor = conn.cursor()
-
-    # Bảng User
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS User (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL,
-        created_at TEXT NOT NULL
-    )
-    ''')
-
-    # Bảng Workspace
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Workspace (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL
-    )
-    ''')
-    
-    # Bảng Space
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Space (
-        id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        workspace_id TEXT NOT NULL,
-        created_at TEXT NOT NULL,
-        updated_at TEXT NOT NULL,
-        FOREIGN KEY (workspace_id) REFERENCES Workspace (id)
-    )
-    ''')
-
-    # Bảng PDF_Document
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS PDF_Document (
-        id TEXT PRIMARY KEY,
-        filename TEXT NOT NULL,
-        content_hash TEXT, -- Để kiểm tra sự trùng lặp nếu muốn
-        space_id TEXT NOT NULL,
-        owner_id TEXT NOT NULL,
-        size_bytes INTEGER,
-        uploaded_at TEXT NOT NULL,
-        FOREIGN KEY (space_id) REFERENCES Space (id),
-        FOREIGN KEY (owner_id) REFERENCES User (id)
-    )
-    ''')
-    
-    # Bảng liên kết User và Workspace (quan hệ nhiều-nhiều)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS User_Workspace_Membership (
-        user_id TEXT NOT NULL,
-        workspace_id TEXT NOT NULL,
-        PRIMARY KEY (user_id, workspace_id),
-        FOREIGN KEY (user_id) REFERENCES User (id),
-        FOREIGN KEY (workspace_id) REFERENCES Workspace (id)
-    )
-    ''')
-
-    # Bảng liên kết User và Space (Nhiều-nhiều)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS User_Space_Membership (
-        user_id TEXT NOT NULL,
-        space_id TEXT NOT NULL,
-        PRIMARY KEY (user_id, space_id),
-        FOREIGN KEY (user_id) REFERENCES User (id),
-        FOREIGN KEY (space_id) REFERENCES Space (id)
-    )
-    ''')
+        # Bảng liên kết User và Workspace (quan hệ nhiều-nhiều)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS User_Workspace_Membership (
+            user_id TEXT NOT NULL,
+            workspace_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, workspace_id),
+            FOREIGN KEY (user_id) REFERENCES User (id),
+            FOREIGN KEY (workspace_id) REFERENCES Workspace (id)
+        )
+        ''')
+
+        # Bảng liên kết User và Space (Nhiều-nhiều)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS User_Space_Membership (
+            user_id TEXT NOT NULL,
+            space_id TEXT NOT NULL,
+            PRIMARY KEY (user_id, space_id),
+            FOREIGN KEY (user_id) REFERENCES User (id),
+            FOREIGN KEY (space_id) REFERENCES Space (id)
+        )
+        ''')
+
+        # Indexes for the access-control joins (also added to existing databases)
+        ensure_metadata_indexes(conn)
 
-    conn.commit()
-    conn.close()
 
 def insert_sample_data():
-    conn = sqlite3.connect(SQL_DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT COUNT(*) FROM User")
-    if cursor.fetchone()[0] > 0:
-        print("Dữ liệu mẫu đã tồn tại. Bỏ qua.")
-        conn.close()
-        return
-
-    print("Đang chèn dữ liệu mẫu...")
-    now = get_current_hcm_time_iso()
-
-    # Users
-    users = [
-        ('alice_01', 'Alice', 'alice@example.com', now),
-        ('bob_02', 'Bob', 'bob@example.com', now)
-    ]
-    cursor.executemany("INSERT INTO User VALUES (?, ?, ?, ?)", users)
-
-    # Workspaces
-    workspaces = [
-        ('ws_marketing', 'Marketing', now, now),
-        ('ws_accounting', 'Accounting', now, now)
-    ]
-    cursor.executemany("INSERT INTO Workspace VALUES (?, ?, ?, ?)", workspaces)
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT COUNT(*) FROM User")
+        if cursor.fetchone()[0] > 0:
+            print("Dữ liệu mẫu đã tồn tại. Bỏ qua.")
+            return
+
+        print("Đang chèn dữ liệu mẫu...")
+        now = get_current_hcm_time_iso()
+
+        # Users
+        users = [
+            ('alice_01', 'Alice', 'alice@example.com', now),
+            ('bob_02', 'Bob', 'bob@example.com', now)
+        ]
+        cursor.executemany("INSERT INTO User VALUES (?, ?, ?, ?)", users)
+
+        # Workspaces
+        workspaces = [
+            ('ws_marketing', 'Marketing', now, now),
+            ('ws_accounting', 'Accounting', now, now)
+        ]
+        cursor.executemany("INSERT INTO Workspace VALUES (?, ?, ?, ?)", workspaces)
     
-    # Spaces
-    spaces = [
-        ('sp_ads', 'Advertisements', 'ws_marketing', now, now),
-        ('sp_invoices', 'Invoices', 'ws_accounting', now, now),
-        ('sp_reports', 'Financial Reports', 'ws_accounting', now, now)
-    ]
-    cursor.executemany("INSERT INTO Space VALUES (?, ?, ?, ?, ?)", spaces)
+        # Spaces
+        spaces = [
+            ('sp_ads', 'Advertisements', 'ws_marketing', now, now),
+            ('sp_invoices', 'Invoices', 'ws_accounting', now, now),
+            ('sp_reports', 'Financial Reports', 'ws_accounting', now, now)
+        ]
+        cursor.executemany("INSERT INTO Space VALUES (?, ?, ?, ?, ?)", spaces)
     
-    # PDF Documents
-    docs = [
-        ('doc_ad_1', 'invoice-0-4.pdf', None, 'sp_ads', 'alice_01', 1024, now),
-        ('doc_inv_1', 'invoice_Jasper_Cacioppo_18509.pdf', None, 'sp_invoices', 'bob_02', 2048, now)
-    ]
-    cursor.executemany("INSERT INTO PDF_Document VALUES (?, ?, ?, ?, ?, ?, ?)", docs)
-
-    # Memberships
-    memberships = [
-        ('alice_01', 'ws_marketing'),
-        ('bob_02', 'ws_accounting'),
-        ('alice_01', 'ws_accounting') # Alice có quyền truy cập cả 2 workspace
-    ]
-    cursor.executemany("INSERT INTO User_Workspace_Membership VALUES (?, ?)", memberships)
-
-    sp_memberships = [
-        ('alice_01', 'sp_ads'),
-        ('alice_01', 'sp_reports'),
-        ('bob_02', 'sp_invoices')
-    ]
-    cursor.executemany("INSERT INTO User_Space_Membership VALUES (?, ?)", sp_memberships)
-    conn.commit()
-    conn.close()
+        # PDF Documents
+        docs = [
+            ('doc_ad_1', 'invoice-0-4.pdf', None, 'sp_ads', 'alice_01', 1024, now),
+            ('doc_inv_1', 'invoice_Jasper_Cacioppo_18509.pdf', None, 'sp_invoices', 'bob_02', 2048, now)
+        ]
+        cursor.executemany("INSERT INTO PDF_Document VALUES (?, ?, ?, ?, ?, ?, ?)", docs)
+
+        # Memberships
+        memberships = [
+            ('alice_01', 'ws_marketing'),
+            ('bob_02', 'ws_accounting'),
+            ('alice_01', 'ws_accounting') # Alice có quyền truy cập cả 2 workspace
+        ]
+        cursor.executemany("INSERT INTO User_Workspace_Membership VALUES (?, ?)", memberships)
+
+        sp_memberships = [
+            ('alice_01', 'sp_ads'),
+            ('alice_01', 'sp_reports'),
+            ('bob_02', 'sp_invoices')
+        ]
+        cursor.executemany("INSERT INTO User_Space_Membership VALUES (?, ?)", sp_memberships)
+        bump_permission_version(cursor)
     print("Chèn dữ liệu mẫu thành công.")
 
 def main():
     """Hàm chính để thực thi toàn bộ luồng ingestion."""
     print("--- Bắt đầu quá trình nạp dữ liệu ---")
-    
-    # Load documents
-    documents = load_documents_from_directory(RAW_DATA_PATH)
-    if not documents:
-        print("Không tìm thấy file PDF nào. Kết thúc.")
-        return
 
-    # Split documents into chunks
-    chunks = split_documents(documents)
-    
-    # Create and save vector store
-    create_and_save_vector_store(chunks, VECTOR_STORE_PATH)
+    # Metadata first: the vector store is sharded by the space of each document
     create_metadata_database()
     insert_sample_data()
+    update_content_hashes(RAW_DATA_PATH)
+
+    file_paths = list_pdf_files(RAW_DATA_PATH)
+    if not file_paths:
+        print("Không tìm thấy file PDF nào. Kết thúc.")
+        return
+
+    # Parse -> split -> embed -> index as a stream, checkpointing finished files
+    parse_errors = run_ingestion_pipeline(
+        file_paths, get_space_ids_by_filename(), build_ingestion_embeddings()
+    )
+    if parse_errors:
+        print(f"{len(parse_errors)} file(s) could not be parsed: {sorted(parse_errors)}")
     print("--- Hoàn tất quá trình nạp dữ liệu ---")
 
 if __name__ == "__main__":
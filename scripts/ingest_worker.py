@@ -0,0 +1,18 @@
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config import *
+from src.processing.ingest_worker import run_worker
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued PDF uploads (parse, embed, index) in the background.")
+    parser.add_argument("--concurrency", type=int, default=INGEST_WORKER_CONCURRENCY, help="Jobs processed in parallel.")
+    parser.add_argument("--poll-seconds", type=float, default=INGEST_WORKER_POLL_SECONDS)
+    args = parser.parse_args()
+    run_worker(concurrency=args.concurrency, poll_seconds=args.poll_seconds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.config import *
+from src.agent.router import QueryRouter, read_labelled_log
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the fast-path router on logged agent runs.")
+    parser.add_argument("--log-path", default=ROUTER_LOG_PATH)
+    parser.add_argument("--model-path", default=ROUTER_MODEL_PATH)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of examples kept aside for evaluation.")
+    args = parser.parse_args()
+
+    examples = read_labelled_log(args.log_path)
+    if not examples:
+        print(f"No labelled agent runs in {args.log_path}. Use the app for a while first.")
+        return
+
+    # Every n-th example is held out, so evaluation covers the whole time range.
+    step = max(2, round(1 / args.holdout)) if args.holdout > 0 else 0
+    held_out = [example for i, example in enumerate(examples) if step and i % step == 0]
+    training = [example for i, example in enumerate(examples) if not (step and i % step == 0)]
+
+    router = QueryRouter(model_path=args.model_path, log_path=args.log_path)
+    router.train(training)
+    if held_out:
+        routed = [(router.route(question)[0], label) for question, label in held_out]
+        fast = [(route, label) for route, label in routed if route != "agent"]
+        precision = sum(route == label for route, label in fast) / len(fast) if fast else 0.0
+        print(f"Held out {len(held_out)}: {len(fast)} fast-pathed, precision {precision:.1%}.")
+
+    # The saved model uses every example.
+    router.train(examples)
+    print(f"Trained router on {len(examples)} labelled question(s), saved to {args.model_path}.")
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,88 @@ import os
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(project_root)
 
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
 from langchain import hub
 from langchain.agents import create_react_agent, AgentExecutor
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_google_genai import ChatGoogleGenerativeAI
 
-from src.agent.tools import agent_tools
+from src.agent.router import QueryRouter, AGENT_ROUTE, RAG_ROUTE, SQL_ROUTE
+from src.agent.tools import agent_tools, rag_search_tool, text_to_sql_tool, rag_tool_instance, text_to_sql_instance
 from src.config import *
+from src.tracing import observe, span
+
+# Tags the ReAct LLM, so its tokens can be told apart from those of the LLMs inside the tools.
+AGENT_LLM_TAG = "main_agent_llm"
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+class AgentStreamHandler(BaseCallbackHandler):
+    """Turns agent callbacks into stream events on a queue.
+
+    Events are dicts with a "type":
+      tool_start -> {"tool", "input"}       the agent picked a tool
+      tool_end   -> {"tool", "output"}      the tool returned its observation
+      token      -> {"text"}                a piece of the final answer
+    Only text the ReAct LLM writes after "Final Answer:" is emitted as tokens.
+    """
+
+    def __init__(self, events: queue.Queue, tool_names: list[str]):
+        self.events = events
+        self.tool_names = set(tool_names)
+        self._tool_runs = {}
+        self._agent_llm_runs = set()
+        self._llm_text = {}
+        self._emitted = {}
+
+    def _start_llm(self, run_id, tags):
+        if tags and AGENT_LLM_TAG in tags:
+            self._agent_llm_runs.add(run_id)
+            self._llm_text[run_id] = ""
+            self._emitted[run_id] = 0
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self._start_llm(run_id, tags)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        self._start_llm(run_id, tags)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id not in self._agent_llm_runs:
+            return
+        text = self._llm_text[run_id] + token
+        self._llm_text[run_id] = text
+        # The marker can arrive split across tokens, so look for it in the whole text.
+        marker = text.find(FINAL_ANSWER_MARKER)
+        if marker < 0:
+            return
+        start = max(marker + len(FINAL_ANSWER_MARKER), self._emitted[run_id])
+        piece = text[start:]
+        if self._emitted[run_id] == 0:
+            piece = piece.lstrip()
+        if piece:
+            self._emitted[run_id] = len(text)
+            self.events.put({"type": "token", "text": piece})
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name")
+        if name in self.tool_names:
+            self._tool_runs[run_id] = name
+            self.events.put({"type": "tool_start", "tool": name, "input": input_str})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        name = self._tool_runs.pop(run_id, None)
+        if name is not None:
+            self.events.put({"type": "tool_end", "tool": name, "output": str(output)})
+
+_END = object()
+
+# Route of each agent tool, for labelling logged agent runs.
+ROUTES_BY_TOOL_NAME = {rag_search_tool.name: RAG_ROUTE, text_to_sql_tool.name: SQL_ROUTE}
 
 class MainAgent:
     def __init__(self):
@@ -22,17 +98,20 @@ class MainAgent:
 
         prompt = hub.pull("hwchase17/react")
 
-        agent = create_react_agent(self.llm, agent_tools, prompt)
+        agent = create_react_agent(self.llm.with_config(tags=[AGENT_LLM_TAG]), agent_tools, prompt)
 
         self.agent_executor = AgentExecutor(
             agent=agent,
             tools=agent_tools,
             verbose=True,
             handle_parsing_errors=True,
-            max_iterations=5
+            max_iterations=5,
+            return_intermediate_steps=True
         )
+        # Clearly single-tool questions skip the ReAct loop.
+        self.router = QueryRouter() if ROUTER_ENABLED else None
 
-    def run(self, user_question: str, user_id: str) -> str:
+    def _build_input(self, user_question: str, user_id: str) -> dict:
         structured_input = f"""
         Current user is identified by user_id '{user_id}'.
         User's question: '{user_question}'
@@ -41,13 +120,180 @@ class MainAgent:
         For example, for the Metadata Database Search tool, the Action Input should be '{user_id}|{user_question}'.
         For the PDF Content Search tool, the Action Input should be '{user_id}|{user_question}'.
         """
+        return {"input": structured_input}
+
+    def _choose_route(self, user_question: str) -> tuple[str, float]:
+        with span("agent.route") as stage:
+            route, confidence = self._classify(user_question)
+            stage.set("route", route)
+        return route, confidence
+
+    def _classify(self, user_question: str) -> tuple[str, float]:
+        if self.router is None:
+            return AGENT_ROUTE, 0.0
+        route, confidence = self.router.route(user_question)
+        if (route == RAG_ROUTE and rag_tool_instance is None) or (route == SQL_ROUTE and text_to_sql_instance is None):
+            return AGENT_ROUTE, confidence
+        if route != AGENT_ROUTE:
+            print(f"Routing straight to the {route} tool (confidence {confidence:.2f}).")
+        return route, confidence
+
+    def _fast_path(self, route: str, user_question: str, user_id: str) -> str:
+        if route == RAG_ROUTE:
+            return rag_tool_instance.answer(f"{user_id}|{user_question}")
+        return text_to_sql_instance.execute(f"{user_id}|{user_question}")
+
+    async def _afast_path(self, route: str, user_question: str, user_id: str) -> str:
+        if route == RAG_ROUTE:
+            return await rag_tool_instance.aanswer(f"{user_id}|{user_question}")
+        return await text_to_sql_instance.aexecute(f"{user_id}|{user_question}")
+
+    def _agent_label(self, response: dict):
+        """The route the agent took, if it used exactly one kind of tool."""
+        routes = {ROUTES_BY_TOOL_NAME.get(action.tool) for action, _ in response.get("intermediate_steps", [])}
+        return routes.pop() if len(routes) == 1 else None
+
+    def _record_route(self, user_question: str, route: str, confidence: float, start: float, label=None):
+        if self.router is not None:
+            self.router.record(user_question, route, confidence, time.perf_counter() - start, label)
 
-        response = self.agent_executor.invoke({
-            "input": structured_input
-        })
+    def run(self, user_question: str, user_id: str) -> str:
+        with span("agent.run"):
+            return self._run(user_question, user_id)
+
+    def _run(self, user_question: str, user_id: str) -> str:
+        start = time.perf_counter()
+        route, confidence = self._choose_route(user_question)
+        if route != AGENT_ROUTE:
+            output = self._fast_path(route, user_question, user_id)
+            self._record_route(user_question, route, confidence, start)
+            return output
+
+        with span("agent.executor"):
+            response = self.agent_executor.invoke(self._build_input(user_question, user_id))
+        self._record_route(user_question, route, confidence, start, self._agent_label(response))
         
         return response['output']
 
+    def run_batch(self, requests: list[tuple[str, str]], max_concurrency: int = BATCH_MAX_CONCURRENCY) -> list[str]:
+        """Answer many (question, user_id) pairs; answers come back in request order.
+
+        Questions routed to the RAG tool are answered together by RAGTool.answer_batch;
+        the rest run through `run`, at most `max_concurrency` at a time.
+        """
+        start = time.perf_counter()
+        routes = [self._choose_route(user_question) for user_question, _ in requests]
+        rag_indexes = [i for i, (route, _) in enumerate(routes) if route == RAG_ROUTE]
+        other_indexes = [i for i, (route, _) in enumerate(routes) if route != RAG_ROUTE]
+        outputs = [None] * len(requests)
+
+        def _run_one(i):
+            (user_question, user_id), (route, confidence) = requests[i], routes[i]
+            one_start = time.perf_counter()
+            if route != AGENT_ROUTE:
+                output = self._fast_path(route, user_question, user_id)
+                self._record_route(user_question, route, confidence, one_start)
+                return output
+            response = self.agent_executor.invoke(self._build_input(user_question, user_id))
+            self._record_route(user_question, route, confidence, one_start, self._agent_label(response))
+            return response["output"]
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            others = executor.map(_run_one, other_indexes)
+            if rag_indexes:
+                rag_answers = rag_tool_instance.answer_batch([requests[i] for i in rag_indexes], max_concurrency)
+                for i, output in zip(rag_indexes, rag_answers):
+                    outputs[i] = output
+                    self._record_route(requests[i][0], RAG_ROUTE, routes[i][1], start)
+            for i, output in zip(other_indexes, others):
+                outputs[i] = output
+        return outputs
+
+    def stream(self, user_question: str, user_id: str) -> Iterator[dict]:
+        """Run the agent on a background thread, yielding events as they happen.
+
+        Yields tool_start / tool_end / token events (see AgentStreamHandler), then one
+        {"type": "final", "output", "time_to_first_token", "total_seconds"} event with
+        the complete answer. Errors of the agent run are re-raised here.
+        """
+        events = queue.Queue()
+        handler = AgentStreamHandler(events, [tool.name for tool in agent_tools])
+        start = time.perf_counter()
+        route, confidence = self._choose_route(user_question)
+
+        def _run():
+            try:
+                with span("agent.run", streamed=True):
+                    _answer()
+            except BaseException as e:
+                events.put({"type": "error", "error": e})
+            events.put(_END)
+
+        def _answer():
+            if route == RAG_ROUTE:
+                # The RAG answer is the final answer: its tokens are streamed as they are generated.
+                events.put({"type": "tool_start", "tool": rag_search_tool.name, "input": f"{user_id}|{user_question}"})
+                pieces = []
+                for piece in rag_tool_instance.answer_stream(f"{user_id}|{user_question}"):
+                    pieces.append(piece)
+                    events.put({"type": "token", "text": piece})
+                output = "".join(pieces)
+                self._record_route(user_question, route, confidence, start)
+                events.put({"type": "tool_end", "tool": rag_search_tool.name, "output": output})
+                events.put({"type": "final", "output": output})
+            elif route == SQL_ROUTE:
+                # The SQL tool's answer arrives as a single token event.
+                events.put({"type": "tool_start", "tool": text_to_sql_tool.name, "input": f"{user_id}|{user_question}"})
+                output = self._fast_path(route, user_question, user_id)
+                self._record_route(user_question, route, confidence, start)
+                events.put({"type": "tool_end", "tool": text_to_sql_tool.name, "output": output})
+                events.put({"type": "token", "text": output})
+                events.put({"type": "final", "output": output})
+            else:
+                with span("agent.executor"):
+                    response = self.agent_executor.invoke(
+                        self._build_input(user_question, user_id), config={"callbacks": [handler]}
+                    )
+                self._record_route(user_question, route, confidence, start, self._agent_label(response))
+                events.put({"type": "final", "output": response['output']})
+
+        threading.Thread(target=_run, daemon=True).start()
+        time_to_first_token = None
+        while True:
+            event = events.get()
+            if event is _END:
+                return
+            if event["type"] == "error":
+                raise event["error"]
+            if event["type"] == "token" and time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+                observe("agent.time_to_first_token", time_to_first_token)
+                print(f"Time to first token: {time_to_first_token:.2f}s")
+            if event["type"] == "final":
+                event["time_to_first_token"] = time_to_first_token
+                event["total_seconds"] = time.perf_counter() - start
+                print(f"Agent answered in {event['total_seconds']:.2f}s.")
+            yield event
+
+    async def arun(self, user_question: str, user_id: str) -> str:
+        """Async `run`: the agent's LLM calls and both tools are awaited, so one event loop serves many sessions."""
+        with span("agent.run"):
+            return await self._arun(user_question, user_id)
+
+    async def _arun(self, user_question: str, user_id: str) -> str:
+        start = time.perf_counter()
+        route, confidence = self._choose_route(user_question)
+        if route != AGENT_ROUTE:
+            output = await self._afast_path(route, user_question, user_id)
+            self._record_route(user_question, route, confidence, start)
+            return output
+
+        with span("agent.executor"):
+            response = await self.agent_executor.ainvoke(self._build_input(user_question, user_id))
+        self._record_route(user_question, route, confidence, start, self._agent_label(response))
+
+        return response['output']
+
 if __name__ == '__main__':
     main_agent = MainAgent()
     
@@ -0,0 +1,156 @@
+import sys
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from src.config import *
+
+# Fast-path routing in front of the ReAct agent.
+# A naive Bayes classifier over words and word pairs decides whether a question is
+# clearly for the RAG tool or the Text-to-SQL tool. Seed keywords act as pseudo-counts
+# so it works before any training; logged agent runs (the single tool the agent ended
+# up using) are the training data. Anything below the confidence threshold -> "agent".
+
+RAG_ROUTE = "rag"
+SQL_ROUTE = "sql"
+AGENT_ROUTE = "agent"
+ROUTES = (RAG_ROUTE, SQL_ROUTE)
+
+SEED_KEYWORDS = {
+    RAG_ROUTE: [
+        "invoice", "total", "amount", "price", "ship", "shipping", "summarize", "summary", "content",
+        "report", "says", "mention", "recipient", "customer", "item", "address",
+        "hoá đơn", "hóa đơn", "tổng", "phí", "nội dung", "tóm tắt", "giá",
+    ],
+    SQL_ROUTE: [
+        "how many", "count", "list", "list all", "workspace", "workspaces", "space", "spaces",
+        "owner", "owns", "uploaded", "most recently", "latest", "created", "size", "file names",
+        "documents are", "members", "bao nhiêu", "danh sách", "không gian", "tải lên",
+    ],
+}
+SEED_PSEUDO_COUNT = 5.0
+
+def featurize(question: str) -> List[str]:
+    words = re.findall(r"\w+", question.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+class QueryRouter:
+    def __init__(self, model_path: str = ROUTER_MODEL_PATH, log_path: str = ROUTER_LOG_PATH, threshold: float = ROUTER_CONFIDENCE_THRESHOLD):
+        self.model_path = model_path
+        self.log_path = log_path
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self.counts: Dict[str, Counter] = {route: Counter() for route in ROUTES}
+        self.examples: Dict[str, int] = {route: 0 for route in ROUTES}
+        if os.path.exists(model_path):
+            with open(model_path, "r", encoding="utf-8") as f:
+                model = json.load(f)
+            self.counts = {route: Counter(model["counts"].get(route, {})) for route in ROUTES}
+            self.examples = {route: model["examples"].get(route, 0) for route in ROUTES}
+        self._fit()
+        self.metrics = {
+            "routed": Counter(),
+            "seconds": Counter(),
+            "llm_calls_saved": 0,
+        }
+
+    def _fit(self):
+        seeded = {route: Counter(self.counts[route]) for route in ROUTES}
+        for route, keywords in SEED_KEYWORDS.items():
+            for keyword in keywords:
+                for feature in featurize(keyword)[-1:]:  # the keyword itself (last word pair, or the word)
+                    seeded[route][feature] += SEED_PSEUDO_COUNT
+        vocabulary = set().union(*seeded.values())
+        self._vocabulary_size = len(vocabulary) + 1
+        self._totals = {route: sum(seeded[route].values()) for route in ROUTES}
+        self._seeded = seeded
+        total_examples = sum(self.examples.values())
+        self._log_priors = {
+            route: math.log((self.examples[route] + 1) / (total_examples + len(ROUTES)))
+            for route in ROUTES
+        }
+
+    def probabilities(self, question: str) -> Dict[str, float]:
+        features = featurize(question)
+        scores = {}
+        for route in ROUTES:
+            denominator = self._totals[route] + self._vocabulary_size
+            scores[route] = self._log_priors[route] + sum(
+                math.log((self._seeded[route][feature] + 1) / denominator) for feature in features
+            )
+        top = max(scores.values())
+        exp_scores = {route: math.exp(score - top) for route, score in scores.items()}
+        total = sum(exp_scores.values())
+        return {route: value / total for route, value in exp_scores.items()}
+
+    def route(self, question: str) -> Tuple[str, float]:
+        """(route, confidence). The route is AGENT_ROUTE unless one tool is clearly meant."""
+        probabilities = self.probabilities(question)
+        best = max(probabilities, key=probabilities.get)
+        if probabilities[best] < self.threshold:
+            return AGENT_ROUTE, probabilities[best]
+        return best, probabilities[best]
+
+    def record(self, question: str, route: str, confidence: float, seconds: float, label: Optional[str] = None):
+        """Count a routing decision and append it to the traffic log.
+
+        `label` is the tool the full agent actually used (only known for agent runs
+        that called exactly one tool); labelled entries are the training data.
+        """
+        with self._lock:
+            self.metrics["routed"][route] += 1
+            self.metrics["seconds"][route] += seconds
+            if route != AGENT_ROUTE:
+                self.metrics["llm_calls_saved"] += ROUTER_AGENT_LLM_CALLS
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"question": question, "route": route, "confidence": round(confidence, 4), "label": label}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"Could not write router log: {e}")
+
+    def routing_metrics(self) -> dict:
+        with self._lock:
+            routed = dict(self.metrics["routed"])
+            total = sum(routed.values())
+            fast = total - routed.get(AGENT_ROUTE, 0)
+            return {
+                "routed": routed,
+                "fast_path_ratio": fast / total if total else 0.0,
+                "llm_calls_saved": self.metrics["llm_calls_saved"],
+                "avg_seconds": {route: self.metrics["seconds"][route] / count for route, count in routed.items()},
+            }
+
+    def train(self, examples: Iterable[Tuple[str, str]]):
+        """Replace the learned counts with (question, route) examples and save the model."""
+        counts = {route: Counter() for route in ROUTES}
+        num_examples = {route: 0 for route in ROUTES}
+        for question, route in examples:
+            if route in ROUTES:
+                counts[route].update(featurize(question))
+                num_examples[route] += 1
+        with self._lock:
+            self.counts, self.examples = counts, num_examples
+            self._fit()
+        tmp_path = f"{self.model_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"counts": counts, "examples": num_examples}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.model_path)
+
+def read_labelled_log(log_path: str = ROUTER_LOG_PATH) -> List[Tuple[str, str]]:
+    """(question, tool route) pairs from agent runs that used exactly one tool."""
+    if not os.path.exists(log_path):
+        return []
+    examples = []
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry.get("label") in ROUTES:
+                examples.append((entry["question"], entry["label"]))
+    return examples
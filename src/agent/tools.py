@@ -18,6 +18,7 @@ except Exception as e:
 rag_search_tool = Tool(
     name="PDF Content Search",
     func=rag_tool_instance.answer if rag_tool_instance else lambda x: "RAG Tool is not available.",
+    coroutine=rag_tool_instance.aanswer if rag_tool_instance else None,
     description="""
     Useful for answering questions about the content of PDF documents.
     Use this tool when the user asks about specific details, summaries, or information contained within the files.
@@ -29,6 +30,7 @@ rag_search_tool = Tool(
 text_to_sql_tool = Tool(
     name="Metadata Database Search",
     func=text_to_sql_instance.execute if text_to_sql_instance else lambda x: "SQL Tool is not available.",
+    coroutine=text_to_sql_instance.aexecute if text_to_sql_instance else None,
     description="""
     Useful for answering questions about metadata of workspaces, spaces, users, and documents.
     Use this tool for questions about counts, dates, ownership, file names, sizes, and relationships between entities.
@@ -1,13 +1,16 @@
 import streamlit as st
 import sys
 import os
-import sqlite3
 import uuid
 import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src.agent.main_agent import MainAgent
-from src.processing.ingest_single_file import process_and_ingest_single_pdf
+from src.processing.ingest_single_file import delete_document
+from src.storage.database import get_pool
+from src.storage.job_queue import JobQueue, new_job_id, QUEUED, RUNNING, DONE
+from src.storage.metadata_db import ensure_metadata_indexes, bump_permission_version, get_permission_version
+from src.tracing import metrics, start_metrics_server
 from src.utils import get_current_hcm_time_iso
 from src.config import *
 
@@ -21,70 +24,117 @@ def load_agent():
 
 main_agent = load_agent()
 
-@st.cache_data(ttl=30)
-def get_user_assets_tree(user_id: str) -> dict:
-    if not user_id: return {}
+@st.cache_resource
+def migrate_metadata_database():
+    with get_pool().connection() as conn:
+        ensure_metadata_indexes(conn)
+
+migrate_metadata_database()
+
+@st.cache_resource
+def serve_metrics():
+    if TRACING_ENABLED and METRICS_PORT is not None:
+        start_metrics_server(METRICS_PORT)
+
+serve_metrics()
+
+@st.cache_resource
+def load_job_queue():
+    # Uploads are ingested by a separate worker: python scripts/ingest_worker.py
+    return JobQueue()
+
+job_queue = load_job_queue()
+
+JOB_STATUS_ICONS = {QUEUED: "⏳", RUNNING: "⚙️", DONE: "✅"}
+
+def job_progress(job: dict) -> float:
+    """Parsing is the first half of the work, embedding the second."""
+    parsed = job["pages_parsed"] / job["pages_total"] if job["pages_total"] else 0.0
+    embedded = job["chunks_embedded"] / job["chunks_total"] if job["chunks_total"] else 0.0
+    return 1.0 if job["status"] == DONE else 0.5 * parsed + 0.5 * embedded
+
+@st.fragment(run_every=2)
+def show_upload_jobs(user_id: str):
+    jobs = job_queue.list_jobs(user_id, limit=5)
+    if not jobs:
+        st.caption("*No uploads yet*")
+    for job in jobs:
+        icon = JOB_STATUS_ICONS.get(job["status"], "❌")
+        st.markdown(f"{icon} **{job['filename']}** · `{job['id']}`")
+        if job["status"] in (QUEUED, RUNNING):
+            st.progress(
+                job_progress(job),
+                text=f"{job['pages_parsed']}/{job['pages_total'] or '?'} pages parsed, "
+                     f"{job['chunks_embedded']}/{job['chunks_total'] or '?'} chunks embedded"
+            )
+        elif job["message"]:
+            st.caption(job["message"])
+
+def _build_assets_tree(cursor, user_id: str) -> dict:
     assets_tree = {}
+    ws_query = "SELECT T1.id, T1.name FROM Workspace AS T1 JOIN User_Workspace_Membership AS T2 ON T1.id = T2.workspace_id WHERE T2.user_id = ?"
+    cursor.execute(ws_query, (user_id,))
+    workspaces = cursor.fetchall()
+    if not workspaces: return {}
+    for ws_id, ws_name in workspaces: assets_tree[ws_id] = {'name': ws_name, 'spaces': {}}
+    ws_ids = list(assets_tree.keys())
+    sp_query = f"SELECT T1.id, T1.name, T1.workspace_id FROM Space AS T1 JOIN User_Space_Membership AS T2 ON T1.id = T2.space_id WHERE T2.user_id = ? AND T1.workspace_id IN ({','.join('?' for _ in ws_ids)})"
+    cursor.execute(sp_query, [user_id] + ws_ids)
+    spaces = cursor.fetchall()
+    if not spaces: return assets_tree
+    space_map = {}
+    for sp_id, sp_name, ws_id in spaces:
+        if ws_id in assets_tree:
+            assets_tree[ws_id]['spaces'][sp_id] = {'name': sp_name, 'documents': []}
+            space_map[sp_id] = ws_id
+    sp_ids = list(space_map.keys())
+    if not sp_ids: return assets_tree
+    doc_query = f"SELECT id, filename, space_id FROM PDF_Document WHERE space_id IN ({','.join('?' for _ in sp_ids)})"
+    cursor.execute(doc_query, sp_ids)
+    documents = cursor.fetchall()
+    for doc_id, doc_name, sp_id in documents:
+        if sp_id in space_map:
+            ws_id = space_map[sp_id]
+            assets_tree[ws_id]['spaces'][sp_id]['documents'].append({'id': doc_id, 'name': doc_name})
+    return assets_tree
+
+# Keyed by the permission version: any workspace/space/document change is a cache miss.
+@st.cache_data(ttl=3600)
+def get_user_assets_tree(user_id: str, permission_version: int) -> dict:
+    if not user_id: return {}
     try:
-        conn = sqlite3.connect(SQL_DATABASE_PATH)
-        cursor = conn.cursor()
-        ws_query = "SELECT T1.id, T1.name FROM Workspace AS T1 JOIN User_Workspace_Membership AS T2 ON T1.id = T2.workspace_id WHERE T2.user_id = ?"
-        cursor.execute(ws_query, (user_id,))
-        workspaces = cursor.fetchall()
-        if not workspaces: return {}
-        for ws_id, ws_name in workspaces: assets_tree[ws_id] = {'name': ws_name, 'spaces': {}}
-        ws_ids = list(assets_tree.keys())
-        sp_query = f"SELECT T1.id, T1.name, T1.workspace_id FROM Space AS T1 JOIN User_Space_Membership AS T2 ON T1.id = T2.space_id WHERE T2.user_id = ? AND T1.workspace_id IN ({','.join('?' for _ in ws_ids)})"
-        cursor.execute(sp_query, [user_id] + ws_ids)
-        spaces = cursor.fetchall()
-        if not spaces: return assets_tree
-        space_map = {}
-        for sp_id, sp_name, ws_id in spaces:
-            if ws_id in assets_tree:
-                assets_tree[ws_id]['spaces'][sp_id] = {'name': sp_name, 'documents': []}
-                space_map[sp_id] = ws_id
-        sp_ids = list(space_map.keys())
-        if not sp_ids: return assets_tree
-        doc_query = f"SELECT id, filename, space_id FROM PDF_Document WHERE space_id IN ({','.join('?' for _ in sp_ids)})"
-        cursor.execute(doc_query, sp_ids)
-        documents = cursor.fetchall()
-        for doc_id, doc_name, sp_id in documents:
-            if sp_id in space_map:
-                ws_id = space_map[sp_id]
-                assets_tree[ws_id]['spaces'][sp_id]['documents'].append({'id': doc_id, 'name': doc_name})
-        conn.close()
-        return assets_tree
+        with get_db_connection() as conn:
+            return _build_assets_tree(conn.cursor(), user_id)
     except Exception as e:
         st.error(f"Could not fetch user assets tree: {e}")
         return {}
 
-def get_db_connection(): 
-    return sqlite3.connect(SQL_DATABASE_PATH)
+def get_db_connection():
+    """Pooled connection (WAL): `with get_db_connection() as conn:` commits on success."""
+    return get_pool().connection()
 
 def create_workspace(ws_name: str, user_id: str) -> str:
-    conn = get_db_connection()
-    cursor = conn.cursor()
     new_ws_id = f"ws_{uuid.uuid4().hex[:10]}"
     current_time = get_current_hcm_time_iso()
-    cursor.execute("INSERT INTO Workspace (id, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
-                   (new_ws_id, ws_name, current_time, current_time))
-    cursor.execute("INSERT INTO User_Workspace_Membership (user_id, workspace_id) VALUES (?, ?)",
-                   (user_id, new_ws_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO Workspace (id, name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                       (new_ws_id, ws_name, current_time, current_time))
+        cursor.execute("INSERT INTO User_Workspace_Membership (user_id, workspace_id) VALUES (?, ?)",
+                       (user_id, new_ws_id))
+        bump_permission_version(cursor)
     return new_ws_id
 
 def create_space(sp_name: str, workspace_id: str, user_id: str) -> str:
-    conn = get_db_connection()
-    cursor = conn.cursor()
     new_sp_id = f"sp_{uuid.uuid4().hex[:10]}"
     current_time = get_current_hcm_time_iso()
-    cursor.execute("INSERT INTO Space (id, name, workspace_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-                   (new_sp_id, sp_name, workspace_id, current_time, current_time))
-    cursor.execute("INSERT INTO User_Space_Membership (user_id, space_id) VALUES (?, ?)",
-                   (user_id, new_sp_id))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO Space (id, name, workspace_id, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                       (new_sp_id, sp_name, workspace_id, current_time, current_time))
+        cursor.execute("INSERT INTO User_Space_Membership (user_id, space_id) VALUES (?, ?)",
+                       (user_id, new_sp_id))
+        bump_permission_version(cursor)
     return new_sp_id
 
 # --- Quản lý Session State ---
@@ -151,9 +201,10 @@ with st.sidebar:
     # File Explorer
     if st.session_state.current_user:
         with st.expander("🗂️ File Explorer", expanded=True):
-            # Force refresh assets tree mỗi lần render
-            get_user_assets_tree.clear()
-            assets_tree = get_user_assets_tree(st.session_state.current_user)
+            if "delete_result" in st.session_state:
+                ok, message = st.session_state.pop("delete_result")
+                st.toast(message, icon="✅" if ok else "❌")
+            assets_tree = get_user_assets_tree(st.session_state.current_user, get_permission_version())
             if assets_tree:
                 for ws_id, ws_data in assets_tree.items():
                     with st.expander(f"🗂️ **{ws_data['name']}** `({ws_id})`"):
@@ -162,7 +213,13 @@ with st.sidebar:
                                 with st.expander(f"📁 {sp_data['name']} `({sp_id})`"):
                                     if sp_data['documents']:
                                         for doc in sp_data['documents']:
-                                            st.markdown(f"📄 {doc['name']}")
+                                            doc_col, delete_col = st.columns([5, 1])
+                                            doc_col.markdown(f"📄 {doc['name']}")
+                                            if delete_col.button("🗑️", key=f"delete_{doc['id']}", help="Delete this document"):
+                                                ok, message = delete_document(doc['id'])
+                                                # Shown after the rerun that redraws the tree without the document.
+                                                st.session_state.delete_result = (ok, message)
+                                                st.rerun()
                                     else: 
                                         st.caption("*No documents in this space*")
                         else: 
@@ -171,10 +228,20 @@ with st.sidebar:
                 st.info("You don't have any assets yet.")
     st.divider()
 
+    # Fast-path routing: how many questions skipped the ReAct loop
+    if main_agent.router is not None:
+        with st.expander("📊 Routing metrics", expanded=False):
+            st.json(main_agent.router.routing_metrics())
+
+    # Per-stage latency of this process (seconds; p50 / p99 are histogram bucket bounds)
+    if TRACING_ENABLED:
+        with st.expander("⏱️ Stage latency", expanded=False):
+            st.json(metrics.summary())
+
     # --- UPLOAD WIZARD ---
     if st.session_state.current_user:
         with st.expander("📤 Upload PDF", expanded=False):
-            assets_tree = get_user_assets_tree(st.session_state.current_user)
+            assets_tree = get_user_assets_tree(st.session_state.current_user, get_permission_version())
 
             # BƯỚC 1: Chọn Workspace
             if st.session_state.upload_step == 1:
@@ -265,7 +332,7 @@ with st.sidebar:
                         st.rerun()
                 with col2:
                     if st.button("⚡ Process & Upload"):
-                        with st.spinner("Đang xử lý..."):
+                        with st.spinner("Đang tải lên..."):
                             try:
                                 uploaded_file = st.session_state.uploaded_file
                                 user_id = st.session_state.current_user
@@ -298,26 +365,26 @@ with st.sidebar:
                                     raise ValueError("Không xác định được Space.")
 
                                 # Lưu và xử lý file
-                                save_path = os.path.join(RAW_DATA_PATH, uploaded_file.name)
+                                # Each upload gets its own directory, so a later upload with the same
+                                # name cannot overwrite a file still waiting in the queue.
+                                job_id = new_job_id()
+                                save_dir = os.path.join(UPLOAD_DATA_PATH, job_id)
+                                os.makedirs(save_dir, exist_ok=True)
+                                save_path = os.path.join(save_dir, uploaded_file.name)
                                 with open(save_path, "wb") as f: 
                                     f.write(uploaded_file.getbuffer())
                                 
-                                success, message = process_and_ingest_single_pdf(
+                                # Parsing / embedding run on the ingestion worker; progress is shown under "Upload jobs".
+                                job_queue.enqueue(
                                     file_path=save_path, 
                                     space_id=resolved_final_space_id, 
-                                    owner_id=user_id
+                                    owner_id=user_id,
+                                    job_id=job_id
                                 )
-                                
-                                if success:
-                                    st.success("Upload thành công!")
-                                    # Clear cache để refresh file explorer
-                                    st.cache_data.clear()
-                                    get_user_assets_tree.clear()
-                                    time.sleep(1)
-                                    reset_upload_flow()
-                                    st.rerun()
-                                else: 
-                                    st.error(message)
+                                st.success(f"Đã đưa vào hàng đợi xử lý (job `{job_id}`).")
+                                time.sleep(1)
+                                reset_upload_flow()
+                                st.rerun()
                             except Exception as e:
                                 st.error(f"Lỗi: {e}")
             
@@ -327,6 +394,10 @@ with st.sidebar:
                     reset_upload_flow()
                     st.rerun()
 
+        # Background ingestion progress, refreshed every 2 seconds
+        with st.expander("📥 Upload jobs", expanded=True):
+            show_upload_jobs(st.session_state.current_user)
+
 # --- Chat UI ---
 if not st.session_state.current_user:
     st.warning("Vui lòng chọn một người dùng ở thanh bên để bắt đầu.")
@@ -345,17 +416,35 @@ else:
         
         # Xử lý và hiển thị response
         with st.chat_message("assistant"):
+            status_placeholder = st.empty()
             response_placeholder = st.empty()
-            with st.spinner("AI Agent đang suy nghĩ..."):
-                try:
-                    response = main_agent.run(
-                        user_question=prompt, 
-                        user_id=st.session_state.current_user
-                    )
-                except Exception as e: 
-                    response = f"Đã xảy ra lỗi: {e}"
-            
+            status_placeholder.caption("AI Agent đang suy nghĩ...")
+            response = ""
+            time_to_first_token = None
+            try:
+                # Tool steps and final-answer tokens are shown as the agent produces them.
+                for event in main_agent.stream(
+                    user_question=prompt,
+                    user_id=st.session_state.current_user
+                ):
+                    if event["type"] == "tool_start":
+                        status_placeholder.caption(f"🔧 Đang dùng {event['tool']}...")
+                    elif event["type"] == "tool_end":
+                        status_placeholder.caption(f"✅ {event['tool']} xong.")
+                    elif event["type"] == "token":
+                        response += event["text"]
+                        response_placeholder.markdown(response + "▌")
+                    elif event["type"] == "final":
+                        response = event["output"]
+                        time_to_first_token = event["time_to_first_token"]
+            except Exception as e:
+                response = f"Đã xảy ra lỗi: {e}"
+
             response_placeholder.markdown(response)
+            if time_to_first_token is not None:
+                status_placeholder.caption(f"Time to first token: {time_to_first_token:.2f}s")
+            else:
+                status_placeholder.empty()
         
         # Lưu response vào session state
         st.session_state.messages.append({"role": "assistant", "content": response})
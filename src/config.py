@@ -13,9 +13,129 @@ COHERE_API_KEY = os.getenv('COHERE_API_KEY')
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_PATH = os.path.join(PROJECT_ROOT, "data")
 RAW_DATA_PATH = os.path.join(DATA_PATH, "raw")
+UPLOAD_DATA_PATH = os.path.join(RAW_DATA_PATH, "uploads")  # one <job_id>/ directory per queued upload
 PROCESSED_DATA_PATH = os.path.join(DATA_PATH, "processed")
 
 VECTOR_STORE_PATH = os.path.join(PROCESSED_DATA_PATH, "faiss_index")
 SQL_DATABASE_PATH = os.path.join(PROCESSED_DATA_PATH, "metadata.db")
+EMBEDDING_CACHE_PATH = os.path.join(PROCESSED_DATA_PATH, "embedding_cache.db")
+INGEST_CHECKPOINT_PATH = os.path.join(PROCESSED_DATA_PATH, "ingest_checkpoint.json")
+ROUTER_MODEL_PATH = os.path.join(PROCESSED_DATA_PATH, "router_model.json")
+ROUTER_LOG_PATH = os.path.join(PROCESSED_DATA_PATH, "router_log.jsonl")
+TRACE_LOG_PATH = os.path.join(PROCESSED_DATA_PATH, "traces.jsonl")
+INGEST_JOBS_DB_PATH = os.path.join(PROCESSED_DATA_PATH, "ingest_jobs.db")
+
+# --- SQLite Configs ---
+# Shared connection pool of the metadata database (WAL mode).
+SQLITE_POOL_SIZE = 8
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+SQLITE_CACHE_SIZE_KB = 16 * 1024
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_CACHED_STATEMENTS = 256
+
+# --- Retrieval Configs ---
+RETRIEVAL_TOP_K = 25
+RERANK_TOP_N = 5
+# Fuse BM25 keyword hits with vector hits (reciprocal rank fusion, constant RRF_K).
+HYBRID_SEARCH = True
+RRF_K = 60
+# Keyword-heavy questions (ids, numbers, file names) can skip reranking and use the
+# fused ranking directly.
+SKIP_RERANK_FOR_KEYWORD_QUERIES = True
+
+# --- Rerank Configs ---
+# "cohere", "cross-encoder" (local CPU), "score" (local, no model) or "none".
+RERANK_BACKEND = "cohere"
+# Used when the main backend is slow, failing or over its call budget.
+RERANK_FALLBACK_BACKEND = "score"
+RERANK_TIMEOUT_SECONDS = 3.0
+RERANK_MAX_CALLS_PER_MINUTE = 60
+RERANK_CACHE_SIZE = 1024
+RERANK_CACHE_TTL_SECONDS = 3600
+CROSS_ENCODER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+# --- Answer Cache Configs ---
+# A question whose embedding has at least this cosine similarity to a cached one,
+# asked against the same set of accessible documents, reuses the cached answer.
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_MAX_ENTRIES = 5000
+ANSWER_CACHE_TTL_SECONDS = 24 * 3600
+
+# --- Batch Configs ---
+# Reranking and generation calls in flight at once for a batch of questions.
+BATCH_MAX_CONCURRENCY = 8
+
+# --- Text-to-SQL Configs ---
+# Validated SQL templates kept per question shape (cleared on schema changes).
+SQL_TEMPLATE_CACHE_SIZE = 512
+# Results up to this size are formatted locally instead of by a second LLM call.
+SQL_LOCAL_FORMAT_MAX_ROWS = 10
+SQL_LOCAL_FORMAT_MAX_COLUMNS = 4
+
+# --- Router Configs ---
+# Questions the local classifier assigns to one tool with at least this probability
+# skip the ReAct loop; the rest go to the full agent.
+ROUTER_ENABLED = True
+ROUTER_CONFIDENCE_THRESHOLD = 0.9
+# LLM calls a fast-path answer saves: the agent's tool-choice and final-answer steps.
+ROUTER_AGENT_LLM_CALLS = 2
+
+# --- Tracing Configs ---
+# Per-stage latency histograms, cache hit and LLM token counters (in process).
+TRACING_ENABLED = True
+# Append every finished span to TRACE_LOG_PATH as a JSON line.
+TRACE_FILE_EXPORT = False
+# Serve the metrics in the Prometheus text format on this port (None: not served).
+METRICS_PORT = None
+LATENCY_BUCKETS_SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# --- Vector Store Configs ---
+# Append-only segments per shard are merged once a shard has more than this many.
+COMPACTION_SEGMENT_THRESHOLD = 8
+# ...or once this fraction of a shard's vectors belongs to deleted documents.
+TOMBSTONE_COMPACTION_RATIO = 0.2
+
+# --- ANN Index Configs ---
+# "flat" (exact scan), "ivf", "hnsw" or "ivfpq". ANN indexes are built for segments
+# with at least ANN_MIN_SEGMENT_SIZE vectors, i.e. mostly by compaction.
+VECTOR_INDEX_TYPE = "flat"
+ANN_MIN_SEGMENT_SIZE = 10_000
+ANN_TRAIN_SAMPLE_SIZE = 100_000
+IVF_NLIST = 1024
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+PQ_M = 64  # sub-quantizers, must divide the embedding dimension (3072)
+PQ_NBITS = 8
+
+# --- PDF Parsing Configs ---
+PDF_PARSE_WORKERS = os.cpu_count() or 1
+PDF_PARSE_TIMEOUT_SECONDS = 300  # per file
+
+# --- Ingestion Pipeline Configs ---
+PIPELINE_BATCH_SIZE = 256  # chunks embedded and flushed to the index at a time
+PIPELINE_QUEUE_SIZE = 4  # items buffered between pipeline stages
+
+# --- Ingestion Worker Configs ---
+# Uploads are queued and ingested by `python scripts/ingest_worker.py`.
+INGEST_WORKER_CONCURRENCY = 2  # jobs processed in parallel, one process each
+INGEST_WORKER_POLL_SECONDS = 1.0
+# A running job without a worker heartbeat for this long is re-queued (its worker died).
+INGEST_JOB_STALE_SECONDS = 120
+# A job still running after this long is killed and re-queued (it resumes from its checkpoint).
+INGEST_JOB_TIMEOUT_SECONDS = 3600
+INGEST_JOB_MAX_ATTEMPTS = 3
+
+# --- Embedding Cache Configs ---
+# Least-recently-used vectors are evicted past this many entries (~12KB each at 3072 dims).
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# --- Embedding Throughput Configs ---
+EMBEDDING_BATCH_SIZE = 100  # chunks per embedding request
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_REQUESTS_PER_MINUTE = 150
+EMBEDDING_MAX_RETRIES = 5
 
 os.makedirs(PROCESSED_DATA_PATH, exist_ok=True)
\ No newline at end of file
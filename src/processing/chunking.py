@@ -0,0 +1,31 @@
+import sys
+import os
+from typing import List
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+def format_chunk_content(source: str, text: str) -> str:
+    return f"File name: {source}. Nội dung: {text}"
+
+def strip_chunk_prefix(source: str, content: str) -> str:
+    """Inverse of format_chunk_content, so stores keep only the chunk's own text."""
+    prefix = format_chunk_content(source, "")
+    return content[len(prefix):] if content.startswith(prefix) else content
+
+def split_documents(documents: List[Document], verbose: bool = True) -> List[Document]:
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len
+    )
+    chunks = text_splitter.split_documents(documents)
+    if verbose:
+        print(f"Split successfull {len(chunks)} chunks.")
+    for chunk in chunks:
+        source_file = chunk.metadata.get("source", "unknown_source")
+        chunk.page_content = format_chunk_content(source_file, chunk.page_content)
+    return chunks
@@ -0,0 +1,136 @@
+import sys
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from langchain_core.embeddings import Embeddings
+
+from src.config import *
+from src.tracing import count_cache
+
+def chunk_hash(text: str, model_name: str) -> str:
+    return hashlib.sha256(f"{model_name}\n{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Persistent, content-addressed embedding cache stored in SQLite.
+
+    Vectors are keyed by hash(model name + chunk text) and evicted least-recently-used
+    once the cache holds more than `max_entries` vectors.
+    """
+
+    def __init__(self, db_path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Several worker processes share the cache: WAL lets them read while one writes,
+        # and the busy timeout makes a writer wait for another instead of failing.
+        self._conn = sqlite3.connect(db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS Embedding (
+            key TEXT PRIMARY KEY,
+            vector BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_last_used ON Embedding (last_used)")
+        self._conn.commit()
+        # Entry count kept up to date by put_many, so eviction needs no COUNT(*) scan;
+        # re-read every `_recount_every` inserts to pick up other processes' writes.
+        self._count = self._conn.execute("SELECT COUNT(*) FROM Embedding").fetchone()[0]
+        self._recount_every = max(1, max_entries // 10)
+        self._inserted_since_recount = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit.
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM Embedding WHERE key IN ({','.join('?' for _ in batch)})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE Embedding SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO Embedding (key, vector, last_used) VALUES (?, ?, ?)", rows
+            ).rowcount
+            if inserted < len(rows):
+                # Some keys were already cached (e.g. by another process): refresh them.
+                self._conn.executemany(
+                    "UPDATE Embedding SET vector = ?, last_used = ? WHERE key = ?",
+                    [(vector, last_used, key) for key, vector, last_used in rows]
+                )
+            self._evict(inserted)
+            self._conn.commit()
+
+    def _evict(self, inserted: int):
+        self._count += inserted
+        self._inserted_since_recount += inserted
+        if self._inserted_since_recount >= self._recount_every:
+            self._count = self._conn.execute("SELECT COUNT(*) FROM Embedding").fetchone()[0]
+            self._inserted_since_recount = 0
+        overflow = self._count - self.max_entries
+        if overflow > 0:
+            self._count -= self._conn.execute(
+                "DELETE FROM Embedding WHERE key IN (SELECT key FROM Embedding ORDER BY last_used ASC LIMIT ?)",
+                (overflow,)
+            ).rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM Embedding").fetchone()[0]
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only calls the underlying model for chunks not seen before."""
+
+    def __init__(self, embeddings: Embeddings, model_name: str = EMBEDDING_MODEL_NAME, cache: Optional[EmbeddingCache] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache if cache is not None else EmbeddingCache()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [chunk_hash(text, self.model_name) for text in texts]
+        cached = self.cache.get_many(list(set(keys)))
+        # Repeats of a missing text within the batch are neither: they are embedded once.
+        hits = sum(1 for key in keys if key in cached)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            cached.update(computed)
+        print(f"Embedding cache: {hits} hits, {len(missing)} misses.")
+        count_cache("embedding", hit=True, value=hits)
+        count_cache("embedding", hit=False, value=len(missing))
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries use a different task type than documents, so they bypass the cache.
+        return self.embeddings.embed_query(text)
@@ -1,63 +1,274 @@
 import sys
 import os
-import sqlite3
 
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(project_root)
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from pypdf import PdfReader
+import json
+import fcntl
 import uuid
-from src.utils import get_current_hcm_time_iso
+from typing import Callable, Optional
+from src.utils import get_current_hcm_time_iso, compute_file_hash
+from src.storage.database import get_pool
+from src.storage.metadata_db import bump_permission_version
+from src.storage.vector_store import (
+    add_to_shard, delete_from_shard, discard_pending, get_shard_path, maybe_compact_in_background,
+    pending_segments, publish_pending
+)
+from src.processing.embedding import build_ingestion_embeddings
+from src.processing.chunking import split_documents
+from src.tracing import span
 
 from src.config import *
-def process_and_ingest_single_pdf(file_path: str, space_id: str, owner_id: str):
+def process_and_ingest_single_pdf(
+    file_path: str,
+    space_id: str,
+    owner_id: str,
+    db_path: str = SQL_DATABASE_PATH,
+    base_path: str = VECTOR_STORE_PATH,
+    embeddings=None,
+    progress: Optional[Callable[..., None]] = None,
+):
+    """Parse, embed, index and register one PDF. Returns (success, message).
+
+    Pages are streamed: every PIPELINE_BATCH_SIZE chunks are embedded and staged in
+    the shard, and the page reached is checkpointed, so a failed or interrupted
+    upload of the same file to the same space resumes after the last staged page.
+    The PDF_Document row is inserted, and the staged chunks made searchable, only
+    once the whole document is indexed.
+
+    `progress`, if given, is called with pages_total / pages_parsed / chunks_total /
+    chunks_embedded keyword arguments as the work advances.
+    """
+    # db_path / base_path / embeddings can be overridden (e.g. fakes for offline benchmarks).
+    with span("ingest.file", space_id=space_id) as stage:
+        ok, message = _ingest_single_pdf(file_path, space_id, owner_id, db_path, base_path, embeddings, progress or _no_progress)
+        stage.set("ok", ok)
+    return ok, message
+
+def _no_progress(**progress):
+    pass
+
+def delete_document(doc_id: str, db_path: str = SQL_DATABASE_PATH, base_path: str = VECTOR_STORE_PATH):
+    """Remove a document (PDF_Document.id) from its space. Returns (success, message).
+
+    Its vectors are tombstoned while the metadata write lock is held, and the row is
+    deleted in the same transaction: if tombstoning fails the row stays, and deleting
+    again finishes the job. Whether the shard needs compacting is checked after the
+    commit, not while the lock is held.
+    """
+    with span("ingest.delete"):
+        try:
+            with get_pool(db_path).connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT filename, space_id FROM PDF_Document WHERE id = ?", (doc_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    return False, f"Document '{doc_id}' does not exist."
+                filename, space_id = row
+                removed = delete_from_shard(space_id, doc_id, filename, base_path, compact_in_background=False)
+                cursor.execute("DELETE FROM PDF_Document WHERE id = ?", (doc_id,))
+                bump_permission_version(cursor)
+        except Exception as e:
+            print(f"Error deleting document {doc_id}: {e}")
+            return False, "Failed to delete the document."
+    maybe_compact_in_background(space_id, base_path)
+    print(f"Deleted document {doc_id} ('{filename}') from space {space_id}: {removed} chunks tombstoned.")
+    return True, f"File '{filename}' deleted."
+
+def replace_document(doc_id: str, file_path: str, owner_id: str, db_path: str = SQL_DATABASE_PATH, base_path: str = VECTOR_STORE_PATH, embeddings=None, progress: Optional[Callable[..., None]] = None):
+    """Upload `file_path` into the space of document `doc_id`, then delete the old version.
+
+    The new version is ingested first, so the space never goes without the document.
+    """
+    with get_pool(db_path).connection() as conn:
+        row = conn.execute("SELECT space_id FROM PDF_Document WHERE id = ?", (doc_id,)).fetchone()
+    if row is None:
+        return False, f"Document '{doc_id}' does not exist."
+    ok, message = process_and_ingest_single_pdf(file_path, row[0], owner_id, db_path, base_path, embeddings, progress)
+    if not ok:
+        return False, message
+    deleted, delete_message = delete_document(doc_id, db_path, base_path)
+    if not deleted:
+        return False, f"{message} The previous version could not be removed: {delete_message}"
+    return True, f"File '{os.path.basename(file_path).replace(' ', '_')}' replaced the previous version."
+
+def discard_upload(file_path: str, space_id: str, base_path: str = VECTOR_STORE_PATH):
+    """Drop what an abandoned upload of `file_path` staged in the space: its pending
+    segments, their chunks and its checkpoint. Left alone while another upload of the
+    same file is running."""
+    if not os.path.exists(file_path):
+        return
+    checkpoint = DocumentCheckpoint(get_shard_path(space_id, base_path), compute_file_hash(file_path))
+    if not checkpoint.acquire():
+        return
+    try:
+        if checkpoint.doc_id is not None:
+            discard_pending(space_id, checkpoint.doc_id, base_path)
+        checkpoint.remove()
+    finally:
+        checkpoint.release()
+
+class DocumentCheckpoint:
+    """How far the ingestion of one file into one space got, so a retry can resume.
+
+    Stored in the shard as ingest_<content hash>.json until the document is
+    registered: its doc_id, and the pages / chunks already staged. A lock file next
+    to it keeps two uploads of the same file from ingesting it at the same time.
+    """
+
+    def __init__(self, shard_path: str, content_hash: str):
+        self.path = os.path.join(shard_path, f"ingest_{content_hash}.json")
+        self.doc_id = None
+        self.pages_done = 0
+        self.chunks_done = 0
+        self._lock_file = None
+
+    def acquire(self) -> bool:
+        """Take the lock and load the saved progress. False if another upload holds it."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.doc_id, self.pages_done, self.chunks_done = data["doc_id"], data["pages_done"], data["chunks_done"]
+        return True
+
+    def release(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    def save(self, pages_done: int, chunks_done: int):
+        self.pages_done, self.chunks_done = pages_done, chunks_done
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"doc_id": self.doc_id, "pages_done": pages_done, "chunks_done": chunks_done}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        for path in (self.path, f"{self.path}.lock"):
+            if os.path.exists(path):
+                os.remove(path)
+
+def _find_duplicate(cursor, content_hash: str, space_id: str) -> Optional[str]:
+    cursor.execute(
+        "SELECT filename FROM PDF_Document WHERE content_hash = ? AND space_id = ?",
+        (content_hash, space_id)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _ingest_single_pdf(file_path: str, space_id: str, owner_id: str, db_path: str, base_path: str, embeddings, progress: Callable[..., None]):
     filename = os.path.basename(file_path)
     filename = filename.replace(" ", "_") # for sql
     file_size = os.path.getsize(file_path)
-    now = get_current_hcm_time_iso()
-    doc_id = f"doc_{uuid.uuid4().hex[:8]}"
+    content_hash = compute_file_hash(file_path)
 
-    print(f"Updating SQL database for file: {filename}")
+    # Same bytes already ingested into this space: nothing to parse or embed.
     try:
-        conn = sqlite3.connect(SQL_DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO PDF_Document (id, filename, space_id, owner_id, size_bytes, uploaded_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (doc_id, filename, space_id, owner_id, file_size, now)
-        )
-        conn.commit()
-        conn.close()
-        print("SQL database updated successfully.")
+        with get_pool(db_path).connection() as conn:
+            duplicate = _find_duplicate(conn.cursor(), content_hash, space_id)
     except Exception as e:
-        print(f"Error updating SQL database: {e}")
-        return False, "Failed to update metadata database."
+        print(f"Error reading SQL database: {e}")
+        return False, "Failed to read metadata database."
+    if duplicate:
+        print(f"Skipping duplicate of '{duplicate}' in space {space_id}.")
+        return False, f"This file was already uploaded to this space as '{duplicate}'."
 
-    print(f"Ingesting file into Vector Store: {filename}")
+    checkpoint = DocumentCheckpoint(get_shard_path(space_id, base_path), content_hash)
+    if not checkpoint.acquire():
+        return False, "This file is already being uploaded to this space."
     try:
-        loader = PyPDFLoader(file_path)
-        docs = loader.load()
-        for doc in docs:
-            doc.metadata["source"] = filename
+        print(f"Ingesting file into Vector Store: {filename}")
+        try:
+            _stage_pages(file_path, filename, space_id, base_path, embeddings, checkpoint, progress)
+        except Exception as e:
+            print(f"Error ingesting file into Vector Store: {e}")
+            return False, "Failed to process and ingest the document content."
 
-            doc.metadata["doc_id"] = doc_id
+        print(f"Updating SQL database for file: {filename}")
+        try:
+            with span("ingest.metadata"), get_pool(db_path).connection() as conn:
+                cursor = conn.cursor()
+                # Take the write lock first, so two uploads of the same file cannot both pass the check.
+                cursor.execute("BEGIN IMMEDIATE")
+                duplicate = _find_duplicate(cursor, content_hash, space_id)
+                if duplicate:
+                    print(f"Skipping duplicate of '{duplicate}' in space {space_id}.")
+                    discard_pending(space_id, checkpoint.doc_id, base_path)
+                    checkpoint.remove()
+                    return False, f"This file was already uploaded to this space as '{duplicate}'."
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        chunks = text_splitter.split_documents(docs)
-        for chunk in chunks:
-            source_file = chunk.metadata.get("source", "unknown_source")
-            chunk.page_content = f"File name: {source_file}. Nội dung: {chunk.page_content}"
+                cursor.execute(
+                    "INSERT INTO PDF_Document (id, filename, content_hash, space_id, owner_id, size_bytes, uploaded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (checkpoint.doc_id, filename, content_hash, space_id, owner_id, file_size, get_current_hcm_time_iso())
+                )
+                bump_permission_version(cursor)
+                # The chunks become searchable just before the row commits; if the commit
+                # fails, the retry finds nothing left to stage and inserts the row again.
+                publish_pending(space_id, checkpoint.doc_id, base_path, compact_in_background=False)
+            print("SQL database updated successfully.")
+        except Exception as e:
+            print(f"Error updating SQL database: {e}")
+            return False, "Failed to update metadata database."
+        checkpoint.remove()
+        # Checked only now: it reads every segment's ids, too slow to do under the write lock.
+        maybe_compact_in_background(space_id, base_path)
+        print(f"Vector Store shard '{space_id}' updated and saved successfully.")
+        return True, f"File '{filename}' uploaded and processed successfully!"
+    finally:
+        checkpoint.release()
 
-        embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL_NAME, google_api_key=GOOGLE_API_KEY)
-        vector_store = FAISS.load_local(VECTOR_STORE_PATH, embeddings, allow_dangerous_deserialization=True)
+def _stage_pages(file_path: str, filename: str, space_id: str, base_path: str, embeddings, checkpoint: DocumentCheckpoint, progress: Callable[..., None]):
+    """Parse and split page by page; embed and stage each PIPELINE_BATCH_SIZE chunks as one segment."""
+    reader = PdfReader(file_path)
+    pages_total = len(reader.pages)
+    if checkpoint.doc_id is None:
+        checkpoint.doc_id = f"doc_{uuid.uuid4().hex[:8]}"
+    elif checkpoint.pages_done >= pages_total:
+        return  # fully staged (or even published) by a run that failed to register it
+    elif checkpoint.chunks_done and not pending_segments(space_id, checkpoint.doc_id, base_path):
+        print(f"Staged chunks of {checkpoint.doc_id} are gone (shard cleared?), starting over.")
+        checkpoint.pages_done, checkpoint.chunks_done = 0, 0
+    else:
+        print(f"Resuming {checkpoint.doc_id} after page {checkpoint.pages_done}.")
+    # Chunks past the checkpoint come from a batch that was interrupted before it was recorded.
+    delete_from_shard(space_id, checkpoint.doc_id, base_path=base_path, compact_in_background=False, from_page=checkpoint.pages_done)
 
-        vector_store.add_documents(chunks)
+    # Chunks embedded before (e.g. the same file re-uploaded elsewhere) come from the cache.
+    if embeddings is None:
+        embeddings = build_ingestion_embeddings()
+    progress(pages_total=pages_total, pages_parsed=checkpoint.pages_done, chunks_total=checkpoint.chunks_done, chunks_embedded=checkpoint.chunks_done)
+    batch = []
+    for page_number in range(checkpoint.pages_done, pages_total):
+        # Pages are read one at a time; only the current batch of chunks is held in memory.
+        with span("ingest.parse"):
+            page = Document(
+                page_content=reader.pages[page_number].extract_text(),
+                metadata={"source": filename, "page": page_number, "doc_id": checkpoint.doc_id}
+            )
+        with span("ingest.split"):
+            batch.extend(split_documents([page], verbose=False))
+        progress(pages_parsed=page_number + 1, chunks_total=checkpoint.chunks_done + len(batch))
+        if len(batch) < PIPELINE_BATCH_SIZE and page_number < pages_total - 1:
+            continue
 
-        vector_store.save_local(VECTOR_STORE_PATH)
-        print("Vector Store updated and saved successfully.")
-        return True, f"File '{filename}' uploaded and processed successfully!"
-    except Exception as e:
-        print(f"Error ingesting file into Vector Store: {e}")
-        return False, "Failed to process and ingest the document content."
\ No newline at end of file
+        with span("ingest.embed", chunks=len(batch)):
+            vectors = embeddings.embed_documents([chunk.page_content for chunk in batch])
+        # Only the shard of the target space is touched.
+        with span("ingest.index", chunks=len(batch)):
+            add_to_shard(space_id, batch, embeddings, base_path, vectors=vectors, compact_in_background=False, pending_doc_id=checkpoint.doc_id)
+        checkpoint.save(page_number + 1, checkpoint.chunks_done + len(batch))
+        progress(chunks_embedded=checkpoint.chunks_done)
+        batch = []
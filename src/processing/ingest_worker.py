@@ -0,0 +1,105 @@
+import sys
+import os
+import time
+import uuid
+import shutil
+import multiprocessing
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from src.config import *
+from src.storage.job_queue import JobQueue, FAILED
+from src.processing.ingest_single_file import discard_upload, process_and_ingest_single_pdf
+
+# Background ingestion worker: claims jobs from the JobQueue and runs each
+# process_and_ingest_single_pdf in its own process, at most `concurrency` at a time,
+# so parsing and embedding never run on a Streamlit script thread. Job progress is
+# written to the queue by the job process; the worker loop keeps heartbeats fresh,
+# and kills and re-queues jobs running longer than INGEST_JOB_TIMEOUT_SECONDS. A job
+# that failed for good has its staged chunks and checkpoint dropped with its upload.
+
+def _remove_upload(file_path: str):
+    """Delete the per-job copy the app saved under UPLOAD_DATA_PATH (never other files)."""
+    upload_dir = os.path.dirname(os.path.abspath(file_path))
+    if os.path.dirname(upload_dir) == os.path.abspath(UPLOAD_DATA_PATH):
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+def _abandon_upload(job: dict):
+    """Clean up after a job that will not be retried: what it staged, then its upload."""
+    try:
+        discard_upload(job["file_path"], job["space_id"])
+    except Exception as e:
+        print(f"Could not discard the staged chunks of job {job['id']}: {e}")
+    _remove_upload(job["file_path"])
+
+def run_job(job: dict, jobs_db_path: str = INGEST_JOBS_DB_PATH) -> tuple:
+    """Ingest one claimed job and record its outcome. Runs in a worker child process."""
+    queue = JobQueue(jobs_db_path)
+    try:
+        success, message = process_and_ingest_single_pdf(
+            file_path=job["file_path"],
+            space_id=job["space_id"],
+            owner_id=job["owner_id"],
+            progress=lambda **progress: queue.update_progress(job["id"], **progress),
+        )
+    except Exception as e:
+        success, message = False, f"Unexpected error: {e}"
+    queue.finish(job["id"], success, message)
+    if success:
+        _remove_upload(job["file_path"])
+    else:
+        _abandon_upload(job)
+    return success, message
+
+def run_worker(concurrency: int = INGEST_WORKER_CONCURRENCY, poll_seconds: float = INGEST_WORKER_POLL_SECONDS, jobs_db_path: str = INGEST_JOBS_DB_PATH, job_timeout: float = INGEST_JOB_TIMEOUT_SECONDS):
+    worker_id = f"worker_{os.getpid()}_{uuid.uuid4().hex[:6]}"
+    queue = JobQueue(jobs_db_path)
+    # spawn: children must not inherit the parent's open SQLite connections.
+    # One process per job (not a pool), so a hung job can be killed on its own.
+    context = multiprocessing.get_context("spawn")
+    running = {}  # job id -> (job, process, start time)
+    print(f"Ingestion worker {worker_id} started with concurrency {concurrency}.")
+    try:
+        while True:
+            now = time.time()
+            for job_id, (job, process, started) in list(running.items()):
+                if process.is_alive():
+                    if now - started <= job_timeout:
+                        continue
+                    process.kill()
+                    process.join()
+                    del running[job_id]
+                    # Re-queued jobs resume from their ingestion checkpoint.
+                    status = queue.requeue(job_id, f"Timed out after {job_timeout:.0f}s.")
+                    print(f"Job {job_id} timed out and was killed ({status}).")
+                    if status == FAILED:
+                        _abandon_upload(job)
+                    continue
+                process.join()
+                del running[job_id]
+                if process.exitcode != 0:
+                    # The child process died (e.g. out of memory) before recording an outcome.
+                    queue.finish(job_id, False, f"Worker process failed with exit code {process.exitcode}.")
+                    _abandon_upload(job)
+                print(f"Job {job_id} finished: {queue.get(job_id)['message']}")
+            queue.heartbeat(list(running), now)
+
+            claimed = False
+            while len(running) < concurrency:
+                job = queue.claim(worker_id, time.time())
+                if job is None:
+                    break
+                print(f"Job {job['id']} claimed: {job['filename']} -> space {job['space_id']}")
+                process = context.Process(target=run_job, args=(job, jobs_db_path))
+                process.start()
+                running[job["id"]] = (job, process, time.time())
+                claimed = True
+            if not claimed:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        # Interrupted jobs are re-queued by the next worker once their heartbeat is stale.
+        print("Stopping ingestion worker.")
+    finally:
+        for _, process, _ in running.values():
+            process.join()
@@ -0,0 +1,99 @@
+import sys
+import os
+import signal
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+
+from src.config import *
+
+class ParseTimeoutError(Exception):
+    pass
+
+def _raise_timeout(signum, frame):
+    raise ParseTimeoutError()
+
+def parse_pdf(file_path: str, timeout: Optional[float] = None) -> List[Document]:
+    """Parse one PDF into page documents. Runs inside a pool worker."""
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        # pypdf is pure Python, so the alarm interrupts even a pathological file.
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        docs = PyPDFLoader(file_path).load()
+    except ParseTimeoutError:
+        raise TimeoutError(f"parsing took longer than {timeout}s")
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    source = os.path.basename(file_path).replace(" ", "_")  # for sql
+    for doc in docs:
+        doc.metadata["source"] = source
+    return docs
+
+def iter_parsed_pdfs(
+    file_paths: Iterable[str],
+    max_workers: int = PDF_PARSE_WORKERS,
+    timeout: float = PDF_PARSE_TIMEOUT_SECONDS,
+) -> Iterator[Tuple[str, List[Document], Optional[str]]]:
+    """Parse PDFs on a process pool, yielding (file_path, pages, error) in input order.
+
+    At most 2 * max_workers files are in flight, so memory stays bounded however
+    many files there are. `error` is None on success.
+    """
+    stuck_worker = False
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    paths = iter(file_paths)
+    pending = deque()
+    try:
+        for path in itertools.islice(paths, max_workers * 2):
+            pending.append((path, executor.submit(parse_pdf, path, timeout)))
+        while pending:
+            path, future = pending.popleft()
+            try:
+                # The worker enforces the timeout itself; this is a backstop for
+                # workers stuck in native code.
+                docs, error = future.result(timeout=timeout * 2), None
+            except FutureTimeoutError:
+                docs, error = [], f"parsing took longer than {timeout}s"
+                stuck_worker = True
+            except Exception as e:
+                docs, error = [], str(e) or type(e).__name__
+
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(parse_pdf, next_path, timeout)))
+            yield path, docs, error
+    finally:
+        # Don't block the run on a worker that never returned.
+        executor.shutdown(wait=not stuck_worker, cancel_futures=True)
+
+def parse_pdfs_in_parallel(
+    file_paths: List[str],
+    max_workers: int = PDF_PARSE_WORKERS,
+    timeout: float = PDF_PARSE_TIMEOUT_SECONDS,
+) -> Tuple[List[Document], Dict[str, str]]:
+    """Parse PDFs on a process pool.
+
+    Returns the pages of all files in the order of `file_paths`, plus a dict of
+    {filename: error} for files that failed or exceeded `timeout`.
+    """
+    all_docs = []
+    errors = {}
+    for path, docs, error in iter_parsed_pdfs(file_paths, max_workers=max_workers, timeout=timeout):
+        if error is not None:
+            errors[os.path.basename(path)] = error
+        all_docs.extend(docs)
+
+    for filename, error in errors.items():
+        print(f"Error when read file {filename}: {error}")
+    return all_docs, errors
@@ -0,0 +1,215 @@
+import sys
+import os
+import json
+import queue
+import threading
+import uuid
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.config import *
+from src.processing.pdf_parsing import iter_parsed_pdfs
+from src.processing.chunking import split_documents
+from src.storage.vector_store import add_to_shard, compact_shard, delete_bulk_chunks, truncate_source
+from src.tracing import count, span
+
+# Streaming ingestion: parse -> split -> embed -> index.
+# Each stage is a generator; stages that do slow work run on their own thread behind
+# a bounded queue, so at most a few files / batches are held in memory at any time.
+# Chunks are flushed to the shards every PIPELINE_BATCH_SIZE chunks and progress is
+# checkpointed after every flush, so an interrupted run resumes where it stopped.
+
+# (filename, chunk) flows between stages; chunk is None marks the end of a file.
+Entry = Tuple[str, Optional[Document]]
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+_END = object()
+
+def _in_background(items: Iterator, maxsize: int = PIPELINE_QUEUE_SIZE) -> Iterator:
+    """Run an upstream generator on its own thread, handing items over through a bounded queue."""
+    q = queue.Queue(maxsize=maxsize)
+
+    def _produce():
+        try:
+            for item in items:
+                q.put(item)  # blocks while the downstream stage is behind
+            q.put(_END)
+        except BaseException as e:
+            q.put(_StageError(e))
+
+    threading.Thread(target=_produce, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is _END:
+            return
+        if isinstance(item, _StageError):
+            raise item.error
+        yield item
+
+class IngestionCheckpoint:
+    """Files that are fully indexed, and how many chunks of unfinished files already are."""
+
+    def __init__(self, path: str = INGEST_CHECKPOINT_PATH):
+        self.path = path
+        self.done_files = set()
+        self.flushed_chunks: Dict[str, int] = {}
+        self.exists = os.path.exists(path)
+        if self.exists:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.done_files = set(data["done_files"])
+            self.flushed_chunks = data["flushed_chunks"]
+
+    def mark_flushed(self, filename: str, count: int = 1):
+        self.flushed_chunks[filename] = self.flushed_chunks.get(filename, 0) + count
+
+    def mark_done(self, filename: str):
+        self.done_files.add(filename)
+        self.flushed_chunks.pop(filename, None)
+
+    def save(self):
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"done_files": sorted(self.done_files), "flushed_chunks": self.flushed_chunks}, f)
+        os.replace(tmp_path, self.path)
+        self.exists = True
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.exists = False
+
+def _source_name(file_path: str) -> str:
+    return os.path.basename(file_path).replace(" ", "_")  # for sql
+
+def _parse_stage(file_paths: List[str], errors: Dict[str, str], max_workers: int, timeout: float) -> Iterator[Tuple[str, List[Document]]]:
+    for path, docs, error in iter_parsed_pdfs(file_paths, max_workers=max_workers, timeout=timeout):
+        if error is not None:
+            errors[os.path.basename(path)] = error
+            count("ingest_files_total", status="failed")
+            print(f"Error when read file {os.path.basename(path)}: {error}")
+            continue
+        yield _source_name(path), docs
+
+def _split_stage(parsed: Iterable[Tuple[str, List[Document]]], space_ids_by_filename: Dict[str, List[str]], resume_offsets: Dict[str, int]) -> Iterator[Entry]:
+    for filename, docs in parsed:
+        if filename not in space_ids_by_filename:
+            print(f"Skipping file not registered in any space: {filename}")
+        else:
+            chunks = split_documents(docs, verbose=False)
+            # Chunks flushed before an interruption are not embedded or indexed again.
+            for chunk in chunks[resume_offsets.get(filename, 0):]:
+                yield filename, chunk
+        yield filename, None
+
+def _embed_batch(batch: List[Entry], embeddings: Embeddings) -> Tuple[List[Entry], List[List[float]]]:
+    texts = [chunk.page_content for _, chunk in batch if chunk is not None]
+    with span("ingest.embed_batch", chunks=len(texts)):
+        vectors = embeddings.embed_documents(texts) if texts else []
+    return batch, vectors
+
+def _embed_stage(entries: Iterable[Entry], embeddings: Embeddings, batch_size: int) -> Iterator[Tuple[List[Entry], List[List[float]]]]:
+    batch = []
+    chunk_count = 0
+    for entry in entries:
+        batch.append(entry)
+        if entry[1] is not None:
+            chunk_count += 1
+        if chunk_count >= batch_size:
+            yield _embed_batch(batch, embeddings)
+            batch = []
+            chunk_count = 0
+    if batch:
+        yield _embed_batch(batch, embeddings)
+
+def _index_batch(
+    batch: List[Entry],
+    vectors: List[List[float]],
+    space_ids_by_filename: Dict[str, List[str]],
+    embeddings: Embeddings,
+    base_path: str,
+    checkpoint: IngestionCheckpoint,
+):
+    by_space = {}
+    vector_iter = iter(vectors)
+    for filename, chunk in batch:
+        if chunk is None:
+            checkpoint.mark_done(filename)
+            count("ingest_files_total", status="done")
+            continue
+        vector = next(vector_iter)
+        for space_id in space_ids_by_filename[filename]:
+            space_chunks, space_vectors = by_space.setdefault(space_id, ([], []))
+            space_chunks.append(chunk)
+            space_vectors.append(vector)
+        checkpoint.mark_flushed(filename)
+
+    with span("ingest.index_batch", spaces=len(by_space)):
+        for space_id, (space_chunks, space_vectors) in by_space.items():
+            add_to_shard(space_id, space_chunks, embeddings, base_path, vectors=space_vectors, compact_in_background=False)
+
+def run_ingestion_pipeline(
+    file_paths: List[str],
+    space_ids_by_filename: Dict[str, List[str]],
+    embeddings: Embeddings,
+    base_path: str = VECTOR_STORE_PATH,
+    batch_size: int = PIPELINE_BATCH_SIZE,
+    checkpoint_path: str = INGEST_CHECKPOINT_PATH,
+    max_workers: int = PDF_PARSE_WORKERS,
+    timeout: float = PDF_PARSE_TIMEOUT_SECONDS,
+) -> Dict[str, str]:
+    """Stream PDFs into their space shards. Returns {filename: error} for files that failed to parse.
+
+    A fresh run rebuilds the bulk-ingested part of every registered space's shard;
+    documents uploaded through the app (chunks with a doc_id) are kept, as their files
+    are not in the bulk input. If a checkpoint from an interrupted run exists, finished
+    files are skipped and unfinished ones continue after their last flushed chunk. The
+    checkpoint is removed once every file is done.
+    """
+    space_ids = {space_id for spaces in space_ids_by_filename.values() for space_id in spaces}
+    checkpoint = IngestionCheckpoint(checkpoint_path)
+    if checkpoint.exists:
+        print(f"Resuming ingestion: {len(checkpoint.done_files)} file(s) already done.")
+    else:
+        for space_id in space_ids:
+            delete_bulk_chunks(space_id, base_path)
+        checkpoint.save()
+
+    pending_paths = [path for path in file_paths if _source_name(path) not in checkpoint.done_files]
+    resume_offsets = dict(checkpoint.flushed_chunks)
+    if checkpoint.exists:
+        # A batch indexed after the last checkpoint save is indexed again below: drop
+        # its first copy, i.e. every chunk of an unfinished file past its recorded offset.
+        for filename in {_source_name(path) for path in pending_paths}:
+            for space_id in space_ids_by_filename.get(filename, []):
+                truncate_source(space_id, filename, resume_offsets.get(filename, 0), base_path)
+    errors = {}
+
+    parsed = _in_background(_parse_stage(pending_paths, errors, max_workers, timeout))
+    entries = _split_stage(parsed, space_ids_by_filename, resume_offsets)
+    batches = _in_background(_embed_stage(entries, embeddings, batch_size))
+
+    for batch, vectors in batches:
+        _index_batch(batch, vectors, space_ids_by_filename, embeddings, base_path, checkpoint)
+        checkpoint.save()
+        print(f"Flushed {len(vectors)} chunks; {len(checkpoint.done_files)} file(s) done.")
+
+    # One segment per shard, which also trains the configured ANN index and drops
+    # the vectors of the previous bulk ingestion.
+    for space_id in space_ids:
+        with span("ingest.compact", space_id=space_id):
+            compact_shard(space_id, base_path)
+
+    if errors:
+        print(f"Keeping checkpoint so a re-run only retries the {len(errors)} failed file(s).")
+    else:
+        checkpoint.remove()
+    return errors
@@ -0,0 +1,102 @@
+import sys
+import os
+from typing import Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+import faiss
+import numpy as np
+
+from src.config import *
+
+# Approximate nearest-neighbour structures for large segments, selected by
+# VECTOR_INDEX_TYPE. Row i of a segment's vectors is position i in its index; the
+# segment maps positions back to chunk ids. Segments below ANN_MIN_SEGMENT_SIZE
+# (typically single uploads) are always scanned exactly.
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+def _create_index(index_type: str, dim: int, num_vectors: int) -> faiss.Index:
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        return index
+    if index_type in ("ivf", "ivfpq"):
+        # ~39 training points per centroid is the minimum FAISS recommends.
+        nlist = max(1, min(IVF_NLIST, num_vectors // 39))
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf":
+            return faiss.IndexIVFFlat(quantizer, dim, nlist)
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS)
+    raise ValueError(f"Unknown VECTOR_INDEX_TYPE '{index_type}', expected one of {INDEX_TYPES}.")
+
+def set_search_params(index: faiss.Index, nprobe: int = IVF_NPROBE, ef_search: int = HNSW_EF_SEARCH):
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+        return
+    except RuntimeError:
+        pass
+    hnsw_index = faiss.downcast_index(index)
+    if isinstance(hnsw_index, faiss.IndexHNSW):
+        hnsw_index.hnsw.efSearch = ef_search
+
+def build_index(vectors: np.ndarray, index_type: str = VECTOR_INDEX_TYPE, min_size: int = ANN_MIN_SEGMENT_SIZE) -> Optional[faiss.Index]:
+    """Train and fill an index over `vectors`. Returns None when the segment should be scanned exactly."""
+    num_vectors, dim = vectors.shape
+    if index_type == "flat" or num_vectors < min_size:
+        return None
+
+    index = _create_index(index_type, dim, num_vectors)
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(num_vectors, size=min(num_vectors, ANN_TRAIN_SAMPLE_SIZE), replace=False))
+        index.train(np.ascontiguousarray(vectors[sample], dtype=np.float32))
+    # Add in slices so memory-mapped input is never copied into RAM all at once.
+    for start in range(0, num_vectors, 65536):
+        index.add(np.ascontiguousarray(vectors[start:start + 65536], dtype=np.float32))
+    set_search_params(index)
+    return index
+
+def write_index(index: faiss.Index, path: str):
+    faiss.write_index(index, path)
+
+def read_index(path: str) -> faiss.Index:
+    try:
+        # Memory-mapped where the index type supports it, like the raw vectors.
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        index = faiss.read_index(path)
+    set_search_params(index)
+    return index
+
+def search_index(index: faiss.Index, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (squared L2 distances, row positions), closest first."""
+    distances, positions = search_index_batch(index, query.reshape(1, -1), k)
+    found = positions[0] >= 0
+    return distances[0][found], positions[0][found]
+
+def _filtered_search_params(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """Search parameters restricted to `selector`, keeping the index's nprobe / efSearch."""
+    try:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    except RuntimeError:
+        pass
+    hnsw_index = faiss.downcast_index(index)
+    if isinstance(hnsw_index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw_index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def search_index_batch(index: faiss.Index, queries: np.ndarray, k: int, excluded: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """One search for a matrix of queries. Returns (n, k) distances and positions; -1 marks no result.
+
+    Rows set in the boolean mask `excluded` are skipped by the index itself, so the
+    k results are all allowed ones and k never grows with the number excluded.
+    """
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    if excluded is None or not excluded.any():
+        return index.search(queries, k)
+    allowed = np.packbits(~excluded, bitorder="little")
+    # The selector reads `allowed` in place: keep it referenced until the search returns.
+    selector = faiss.IDSelectorBitmap(len(allowed), faiss.swig_ptr(allowed))
+    return index.search(queries, k, params=_filtered_search_params(index, selector))
@@ -0,0 +1,166 @@
+import sys
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from langchain_core.documents import Document
+
+from src.processing.chunking import format_chunk_content, strip_chunk_prefix
+
+def to_fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query matching any of its words."""
+    words = re.findall(r"\w+", text)
+    return " OR ".join('"' + word.replace('"', '""') + '"' for word in words)
+
+class ChunkStore:
+    """SQLite-backed chunk texts of one shard, addressed by integer vector id.
+
+    Only the chunk's own text is stored; the "File name: ..." prefix is rebuilt from
+    the `source` column on read. Metadata lives in typed columns, not per-chunk dicts.
+    An FTS5 index over text and source, kept in sync by triggers, serves BM25 search.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL lets searches read while an upload appends.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS Chunk (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id TEXT,
+            source TEXT NOT NULL,
+            page INTEGER,
+            text TEXT NOT NULL
+        )
+        ''')
+        # Deleting a document looks up its chunks by doc_id (or by source when it has none).
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_document ON Chunk (doc_id, source)")
+        self.has_fts = self._create_fts_index()
+        self._conn.commit()
+
+    def _create_fts_index(self) -> bool:
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Chunk_fts'"
+        ).fetchone()
+        try:
+            self._conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS Chunk_fts USING fts5(
+                text, source, content='Chunk', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            )
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"SQLite FTS5 is not available, keyword search disabled: {e}")
+            return False
+        self._conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS Chunk_fts_insert AFTER INSERT ON Chunk BEGIN
+            INSERT INTO Chunk_fts (rowid, text, source) VALUES (new.id, new.text, new.source);
+        END
+        ''')
+        self._conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS Chunk_fts_delete AFTER DELETE ON Chunk BEGIN
+            INSERT INTO Chunk_fts (Chunk_fts, rowid, text, source) VALUES ('delete', old.id, old.text, old.source);
+        END
+        ''')
+        if not exists:
+            # Index chunks stored before keyword search existed.
+            self._conn.execute("INSERT INTO Chunk_fts (Chunk_fts) VALUES ('rebuild')")
+        return True
+
+    def add(self, chunks: List[Document]) -> List[int]:
+        """Insert chunks and return their ids, in order."""
+        ids = []
+        with self._lock:
+            cursor = self._conn.cursor()
+            for chunk in chunks:
+                source = chunk.metadata.get("source", "unknown_source")
+                cursor.execute(
+                    "INSERT INTO Chunk (doc_id, source, page, text) VALUES (?, ?, ?, ?)",
+                    (chunk.metadata.get("doc_id"), source, chunk.metadata.get("page"), strip_chunk_prefix(source, chunk.page_content))
+                )
+                ids.append(cursor.lastrowid)
+            self._conn.commit()
+        return ids
+
+    def get(self, ids: List[int]) -> Dict[int, Document]:
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, doc_id, source, page, text FROM Chunk WHERE id IN ({','.join('?' for _ in ids)})",
+                list(ids)
+            ).fetchall()
+        chunks = {}
+        for chunk_id, doc_id, source, page, text in rows:
+            metadata = {"chunk_id": chunk_id, "source": source, "page": page}
+            if doc_id is not None:
+                metadata["doc_id"] = doc_id
+            chunks[chunk_id] = Document(page_content=format_chunk_content(source, text), metadata=metadata)
+        return chunks
+
+    def document_ids(self, doc_id: str, source: Optional[str] = None, from_page: Optional[int] = None) -> List[int]:
+        """Ids of a document's chunks, or only of its pages >= `from_page`.
+
+        Bulk ingestion indexes chunks without a doc_id; if no chunk has this doc_id,
+        those of the same `source` file are returned instead.
+        """
+        with self._lock:
+            if from_page is not None:
+                rows = self._conn.execute(
+                    "SELECT id FROM Chunk WHERE doc_id = ? AND page >= ?", (doc_id, from_page)
+                ).fetchall()
+                return [chunk_id for (chunk_id,) in rows]
+            rows = self._conn.execute("SELECT id FROM Chunk WHERE doc_id = ?", (doc_id,)).fetchall()
+            if not rows and source is not None:
+                rows = self._conn.execute(
+                    "SELECT id FROM Chunk WHERE doc_id IS NULL AND source = ?", (source,)
+                ).fetchall()
+        return [chunk_id for (chunk_id,) in rows]
+
+    def source_ids(self, source: str) -> List[int]:
+        """Ids of the chunks of `source` indexed without a doc_id, in insertion order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM Chunk WHERE doc_id IS NULL AND source = ? ORDER BY id", (source,)
+            ).fetchall()
+        return [chunk_id for (chunk_id,) in rows]
+
+    def bulk_ids(self) -> List[int]:
+        """Ids of every chunk indexed without a doc_id, i.e. by bulk ingestion."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id FROM Chunk WHERE doc_id IS NULL").fetchall()
+        return [chunk_id for (chunk_id,) in rows]
+
+    def delete(self, ids: List[int]):
+        """Remove chunks (and, by trigger, their keyword index entries)."""
+        if not ids:
+            return
+        with self._lock:
+            self._conn.execute(f"DELETE FROM Chunk WHERE id IN ({','.join('?' for _ in ids)})", list(ids))
+            self._conn.commit()
+
+    def search_text(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """BM25 keyword search. Returns (chunk id, bm25 score) pairs, best first (lower is better)."""
+        fts_query = to_fts_query(query)
+        if not self.has_fts or not fts_query:
+            return []
+        with self._lock:
+            return self._conn.execute(
+                "SELECT rowid, bm25(Chunk_fts) AS score FROM Chunk_fts WHERE Chunk_fts MATCH ? ORDER BY score LIMIT ?",
+                (fts_query, k)
+            ).fetchall()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM Chunk")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,89 @@
+import sys
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from src.config import *
+
+# One place that opens connections to the metadata database.
+# Connections are pooled per process and reused across threads, so each keeps its
+# prepared-statement cache (sqlite3 caches compiled statements per connection, keyed
+# by SQL text); callers should pass values as parameters, never format them into SQL.
+# The database runs in WAL mode: readers never block the single writer and vice versa.
+
+class ConnectionPool:
+    """Thread-safe pool of at most `size` connections to one SQLite file.
+
+    `with pool.connection() as conn:` checks a connection out, commits when the block
+    succeeds and rolls back when it raises. A read-only pool opens the file with
+    mode=ro and query_only, so nothing run through it can write.
+    """
+
+    def __init__(self, db_path: str, size: int = SQLITE_POOL_SIZE, read_only: bool = False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self._idle = queue.LifoQueue()  # most recently used first: its page cache is warm
+        self._slots = threading.Semaphore(size)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.read_only:
+            conn = sqlite3.connect(
+                f"file:{self.db_path}?mode=ro", uri=True, timeout=SQLITE_BUSY_TIMEOUT_SECONDS,
+                check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS
+            )
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(
+                self.db_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS,
+                check_same_thread=False, cached_statements=SQLITE_CACHED_STATEMENTS
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            # Durable at every checkpoint; in WAL mode NORMAL cannot corrupt the database.
+            conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pools: Dict[Tuple[str, bool], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path: str = SQL_DATABASE_PATH, read_only: bool = False) -> ConnectionPool:
+    """The process-wide pool for a database file (one writable, one read-only)."""
+    key = (os.path.abspath(db_path), read_only)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path, read_only=read_only)
+        return _pools[key]
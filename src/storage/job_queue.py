@@ -0,0 +1,143 @@
+import sys
+import os
+import uuid
+from typing import List, Optional
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from src.config import *
+from src.storage.database import get_pool
+from src.utils import get_current_hcm_time_iso
+
+# Persistent queue of single-PDF ingestion jobs, in its own SQLite file so job
+# progress writes never contend with the metadata database.
+# queued -> running -> done | failed. A worker claims the oldest queued job under
+# BEGIN IMMEDIATE, so two workers never take the same job; running jobs whose
+# heartbeat is older than INGEST_JOB_STALE_SECONDS (their worker died) are re-queued,
+# up to INGEST_JOB_MAX_ATTEMPTS attempts.
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+JOB_TABLE = """
+CREATE TABLE IF NOT EXISTS Ingestion_Job (
+    id TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    space_id TEXT NOT NULL,
+    owner_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    pages_total INTEGER,
+    pages_parsed INTEGER NOT NULL DEFAULT 0,
+    chunks_total INTEGER,
+    chunks_embedded INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    worker_id TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    heartbeat_at REAL
+)
+"""
+JOB_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_ingestion_job_status ON Ingestion_Job (status, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_ingestion_job_owner ON Ingestion_Job (owner_id, created_at)",
+]
+PROGRESS_FIELDS = ("pages_total", "pages_parsed", "chunks_total", "chunks_embedded")
+
+def new_job_id() -> str:
+    return f"job_{uuid.uuid4().hex[:12]}"
+
+class JobQueue:
+    def __init__(self, db_path: str = INGEST_JOBS_DB_PATH):
+        self.pool = get_pool(db_path)
+        with self.pool.connection() as conn:
+            conn.execute(JOB_TABLE)
+            for statement in JOB_INDEXES:
+                conn.execute(statement)
+
+    def enqueue(self, file_path: str, space_id: str, owner_id: str, job_id: Optional[str] = None) -> str:
+        job_id = job_id or new_job_id()
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT INTO Ingestion_Job (id, file_path, filename, space_id, owner_id, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, file_path, os.path.basename(file_path), space_id, owner_id, QUEUED, get_current_hcm_time_iso())
+            )
+        return job_id
+
+    def claim(self, worker_id: str, now: float) -> Optional[dict]:
+        """Mark the oldest queued job as running for this worker and return it, or None."""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Jobs of a worker that stopped sending heartbeats go back to the queue.
+            conn.execute(
+                "UPDATE Ingestion_Job SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "message = CASE WHEN attempts >= ? THEN 'Worker stopped responding.' ELSE message END "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (INGEST_JOB_MAX_ATTEMPTS, FAILED, QUEUED, INGEST_JOB_MAX_ATTEMPTS, RUNNING, now - INGEST_JOB_STALE_SECONDS)
+            )
+            row = conn.execute(
+                "SELECT id FROM Ingestion_Job WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE Ingestion_Job SET status = ?, worker_id = ?, attempts = attempts + 1, "
+                "started_at = ?, heartbeat_at = ?, pages_parsed = 0, chunks_embedded = 0 WHERE id = ?",
+                (RUNNING, worker_id, get_current_hcm_time_iso(), now, row[0])
+            )
+        return self.get(row[0])
+
+    def heartbeat(self, job_ids: List[str], now: float):
+        if not job_ids:
+            return
+        with self.pool.connection() as conn:
+            conn.execute(
+                f"UPDATE Ingestion_Job SET heartbeat_at = ? WHERE id IN ({','.join('?' for _ in job_ids)}) AND status = ?",
+                (now, *job_ids, RUNNING)
+            )
+
+    def update_progress(self, job_id: str, **progress):
+        """Set any of pages_total / pages_parsed / chunks_total / chunks_embedded."""
+        fields = [field for field in PROGRESS_FIELDS if field in progress]
+        if not fields:
+            return
+        with self.pool.connection() as conn:
+            conn.execute(
+                f"UPDATE Ingestion_Job SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?",
+                (*(progress[field] for field in fields), job_id)
+            )
+
+    def requeue(self, job_id: str, message: str) -> str:
+        """Put a running job back in the queue (failed once out of attempts). Returns its new status."""
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE Ingestion_Job SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, message = ?, heartbeat_at = NULL WHERE id = ?",
+                (INGEST_JOB_MAX_ATTEMPTS, FAILED, QUEUED, message, job_id)
+            )
+            return conn.execute("SELECT status FROM Ingestion_Job WHERE id = ?", (job_id,)).fetchone()[0]
+
+    def finish(self, job_id: str, success: bool, message: str):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "UPDATE Ingestion_Job SET status = ?, message = ?, finished_at = ? WHERE id = ?",
+                (DONE if success else FAILED, message, get_current_hcm_time_iso(), job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.pool.connection() as conn:
+            cursor = conn.execute("SELECT * FROM Ingestion_Job WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            columns = [description[0] for description in cursor.description]
+        return dict(zip(columns, row)) if row else None
+
+    def list_jobs(self, owner_id: str, limit: int = 10) -> List[dict]:
+        """The owner's most recent jobs, newest first."""
+        with self.pool.connection() as conn:
+            cursor = conn.execute(
+                "SELECT * FROM Ingestion_Job WHERE owner_id = ? ORDER BY created_at DESC LIMIT ?", (owner_id, limit)
+            )
+            rows = cursor.fetchall()
+            columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in rows]
@@ -0,0 +1,105 @@
+import sys
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from src.config import *
+from src.storage.database import get_pool
+from src.tracing import count_cache
+
+# Secondary indexes for the access-control joins. User_Space_Membership and
+# User_Workspace_Membership are already looked up by user_id through their
+# (user_id, ...) primary keys; the reverse direction and the child tables need these.
+METADATA_INDEXES = {
+    "PDF_Document": "CREATE INDEX IF NOT EXISTS idx_pdf_document_space ON PDF_Document (space_id, filename)",
+    "Space": "CREATE INDEX IF NOT EXISTS idx_space_workspace ON Space (workspace_id)",
+    "User_Space_Membership": "CREATE INDEX IF NOT EXISTS idx_user_space_membership_space ON User_Space_Membership (space_id)",
+}
+
+# Single-row counter bumped in the same transaction as any change to who can read
+# what: new workspaces, spaces, memberships and documents.
+PERMISSION_VERSION_TABLE = '''
+CREATE TABLE IF NOT EXISTS Permission_Version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL
+)
+'''
+
+def ensure_metadata_indexes(conn: sqlite3.Connection):
+    """Create (or migrate an existing database to) the access-control indexes."""
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, statement in METADATA_INDEXES.items():
+        if table in tables:
+            conn.execute(statement)
+    conn.execute(PERMISSION_VERSION_TABLE)
+    conn.commit()
+
+def bump_permission_version(cursor: sqlite3.Cursor):
+    """Invalidate every cached permission set. Commit together with the change itself."""
+    cursor.execute(PERMISSION_VERSION_TABLE)
+    cursor.execute(
+        "INSERT INTO Permission_Version (id, version) VALUES (0, 1) "
+        "ON CONFLICT (id) DO UPDATE SET version = version + 1"
+    )
+
+def read_permission_version(conn: sqlite3.Connection) -> int:
+    try:
+        row = conn.execute("SELECT version FROM Permission_Version WHERE id = 0").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # database created before permission versions existed
+    return row[0] if row else 0
+
+def get_permission_version(db_path: str = SQL_DATABASE_PATH) -> int:
+    with get_pool(db_path).connection() as conn:
+        return read_permission_version(conn)
+
+ACCESSIBLE_SOURCES_QUERY = """
+SELECT DISTINCT T1.space_id, T1.filename
+FROM PDF_Document AS T1
+JOIN User_Space_Membership AS T2 ON T1.space_id = T2.space_id
+WHERE T2.user_id = ?
+"""
+
+class PermissionCache:
+    """Per-user accessible documents, reused until the permission version changes.
+
+    Each lookup costs one primary-key read of the version row on a pooled
+    connection; the JOIN only runs for users whose cached set is outdated.
+    """
+
+    def __init__(self, db_path: str = SQL_DATABASE_PATH):
+        self.db_path = db_path
+        self.pool = get_pool(db_path)
+        self._lock = threading.Lock()
+        with self.pool.connection() as conn:
+            ensure_metadata_indexes(conn)
+        self._entries: Dict[str, Tuple[int, Dict[str, List[str]]]] = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get_accessible_sources(self, user_id: str) -> Dict[str, List[str]]:
+        """The documents the user can read, grouped by space_id."""
+        with self.pool.connection() as conn:
+            version = read_permission_version(conn)
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] == version:
+                    self.stats["hits"] += 1
+                    count_cache("permissions", hit=True)
+                    return entry[1]
+                self.stats["misses"] += 1
+            count_cache("permissions", hit=False)
+
+            accessible_sources = {}
+            for space_id, filename in conn.execute(ACCESSIBLE_SOURCES_QUERY, (user_id,)).fetchall():
+                accessible_sources.setdefault(space_id, []).append(filename)
+        with self._lock:
+            self._entries[user_id] = (version, accessible_sources)
+        return accessible_sources
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
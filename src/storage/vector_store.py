@@ -0,0 +1,641 @@
+import sys
+import os
+import json
+import shutil
+import uuid
+import fcntl
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.config import *
+from src.storage.chunk_store import ChunkStore
+from src.storage.ann_index import build_index, read_index, search_index_batch, write_index
+
+# The vector store is split into one shard per Space (PDF_Document.space_id),
+# stored under VECTOR_STORE_PATH/<space_id>/. Permission filtering then happens by
+# choosing which shards to search instead of filtering one global index afterwards.
+#
+# Each shard is append-only:
+#   <space_id>/manifest.json      -> {"segments": [...], "generation": n, "deleted": [...]}
+#                                    live segments; generation is bumped by every
+#                                    upload / delete / clear; deleted lists tombstoned
+#                                    chunk ids still present in some segment;
+#                                    "pending": {doc_id: [...]} holds the segments of a
+#                                    document still being ingested, not yet searched
+#   <space_id>/segments/<name>/   -> small, immutable segment
+#   <space_id>/chunks.db          -> chunk texts and metadata (ChunkStore), keyed by vector id
+# An ingest writes a new segment and appends it to the manifest; compaction merges
+# live segments into one and swaps them in the manifest. Readers search all live segments.
+#
+# A segment stores its vectors as raw float32 arrays (vectors.npy, plus their squared
+# norms in norms.npy) and their int64 chunk ids (ids.npy), all memory-mapped read-only:
+# opening a segment costs the same whatever its size, and every process searching it
+# shares the OS page cache. Chunk texts are fetched from chunks.db for the top-k hits only.
+# Large segments (e.g. after compaction) also get an ANN index (index.faiss) of the
+# configured VECTOR_INDEX_TYPE; smaller ones are scanned exactly.
+#
+# Deleting a document never rewrites a segment: its chunk ids are added to the
+# manifest's tombstones and its rows removed from chunks.db. Searches mask tombstoned
+# rows (a per-segment boolean mask built once per manifest version), and compaction
+# drops them for good once they make up TOMBSTONE_COMPACTION_RATIO of the shard.
+
+MANIFEST_FILENAME = "manifest.json"
+SEGMENTS_DIRNAME = "segments"
+VECTORS_FILENAME = "vectors.npy"
+NORMS_FILENAME = "norms.npy"
+IDS_FILENAME = "ids.npy"
+INDEX_FILENAME = "index.faiss"
+CHUNKS_FILENAME = "chunks.db"
+
+def get_shard_path(space_id: str, base_path: str = VECTOR_STORE_PATH) -> str:
+    return os.path.join(base_path, space_id)
+
+def _manifest_path(shard_path: str) -> str:
+    return os.path.join(shard_path, MANIFEST_FILENAME)
+
+def _segment_path(shard_path: str, segment_name: str) -> str:
+    return os.path.join(shard_path, SEGMENTS_DIRNAME, segment_name)
+
+@contextmanager
+def _file_lock(shard_path: str, name: str = ".manifest.lock", blocking: bool = True):
+    """Inter-process lock on a shard. Yields False if non-blocking and already held."""
+    os.makedirs(shard_path, exist_ok=True)
+    with open(os.path.join(shard_path, name), "w") as lock_file:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock_file, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def read_manifest(shard_path: str) -> dict:
+    try:
+        with open(_manifest_path(shard_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"segments": []}
+
+def _write_manifest(shard_path: str, manifest: dict):
+    # Write-then-rename so readers never see a half-written manifest.
+    tmp_path = f"{_manifest_path(shard_path)}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, _manifest_path(shard_path))
+
+def shard_generation(space_id: str, base_path: str = VECTOR_STORE_PATH) -> int:
+    """Bumped whenever the shard's content changes (append, delete or clear), but not by compaction."""
+    return read_manifest(get_shard_path(space_id, base_path)).get("generation", 0)
+
+def open_chunk_store(shard_path: str) -> ChunkStore:
+    os.makedirs(shard_path, exist_ok=True)
+    return ChunkStore(os.path.join(shard_path, CHUNKS_FILENAME))
+
+class Segment:
+    """Read-only view of one segment, with its vectors memory-mapped."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.vectors = np.load(os.path.join(path, VECTORS_FILENAME), mmap_mode="r")
+        self.norms = np.load(os.path.join(path, NORMS_FILENAME), mmap_mode="r")
+        self.ids = np.load(os.path.join(path, IDS_FILENAME), mmap_mode="r")
+        index_path = os.path.join(path, INDEX_FILENAME)
+        self.index = read_index(index_path) if os.path.exists(index_path) else None
+        self._id_order = self._sorted_ids = None  # built on the first `positions` call
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def positions(self, chunk_ids: np.ndarray) -> np.ndarray:
+        """Row of each chunk id in this segment, or -1 where it is not in the segment."""
+        if len(self) == 0:
+            return np.full(len(chunk_ids), -1, dtype=np.int64)
+        if self._sorted_ids is None:
+            order = np.argsort(self.ids)
+            self._id_order, self._sorted_ids = order, self.ids[order]
+        found = np.minimum(np.searchsorted(self._sorted_ids, chunk_ids), len(self) - 1)
+        return np.where(self._sorted_ids[found] == chunk_ids, self._id_order[found], -1)
+
+    def search_batch(self, queries: np.ndarray, k: int, deleted: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Search a matrix of queries at once. Returns (n, k') distances and chunk ids; id -1 marks no result.
+
+        `deleted` is a boolean mask of tombstoned rows, which are never returned.
+        """
+        if len(self) == 0:
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        if self.index is not None:
+            distances, positions = search_index_batch(self.index, queries, k, deleted)
+            return distances, np.where(positions >= 0, self.ids[np.maximum(positions, 0)], -1)
+        k = min(k, len(self))
+        # Bound the (queries x vectors) distance block to ~256 MB of float32.
+        block = max(1, (1 << 26) // len(self))
+        all_distances, all_ids = [], []
+        for start in range(0, len(queries), block):
+            q = queries[start:start + block]
+            # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2, without materialising x - q.
+            distances = self.norms[None, :] - 2.0 * (q @ self.vectors.T) + np.einsum("ij,ij->i", q, q)[:, None]
+            if deleted is not None:
+                distances[:, deleted] = np.inf
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            top_distances = np.take_along_axis(distances, top, axis=1)
+            order = np.argsort(top_distances, axis=1)
+            top = np.take_along_axis(top, order, axis=1)
+            top_distances = np.take_along_axis(top_distances, order, axis=1)
+            all_distances.append(top_distances)
+            all_ids.append(np.where(np.isinf(top_distances), -1, self.ids[top]))
+        return np.concatenate(all_distances), np.concatenate(all_ids)
+
+def load_segments(space_id: str, base_path: str = VECTOR_STORE_PATH) -> List[Segment]:
+    """Open the live segments of a shard (memory-mapped, so this is cheap)."""
+    shard_path = get_shard_path(space_id, base_path)
+    return [Segment(_segment_path(shard_path, name)) for name in read_manifest(shard_path)["segments"]]
+
+def _embed_chunks(chunks: List[Document], embeddings: Embeddings, vectors: Optional[List[List[float]]] = None) -> np.ndarray:
+    if vectors is None:
+        vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    return np.asarray(vectors, dtype=np.float32)
+
+def _write_segment(shard_path: str, ids: np.ndarray, vectors: np.ndarray) -> str:
+    segment_name = f"seg_{uuid.uuid4().hex}"
+    segment_path = _segment_path(shard_path, segment_name)
+    os.makedirs(segment_path)
+    np.save(os.path.join(segment_path, VECTORS_FILENAME), vectors)
+    np.save(os.path.join(segment_path, NORMS_FILENAME), np.einsum("ij,ij->i", vectors, vectors))
+    np.save(os.path.join(segment_path, IDS_FILENAME), np.asarray(ids, dtype=np.int64))
+    index = build_index(vectors)
+    if index is not None:
+        write_index(index, os.path.join(segment_path, INDEX_FILENAME))
+    return segment_name
+
+def _write_merged_segment(shard_path: str, parts: List[Segment], deleted: np.ndarray) -> Optional[str]:
+    """Concatenate segments into a new one, leaving out the `deleted` chunk ids, streaming
+    through memory-mapped output files. Returns None if no vector is left."""
+    keeps = [~np.isin(part.ids, deleted) for part in parts]
+    total = sum(int(keep.sum()) for keep in keeps)
+    if total == 0:
+        return None
+    segment_name = f"seg_{uuid.uuid4().hex}"
+    segment_path = _segment_path(shard_path, segment_name)
+    os.makedirs(segment_path)
+    dim = parts[0].vectors.shape[1]
+    outputs = {
+        VECTORS_FILENAME: np.lib.format.open_memmap(os.path.join(segment_path, VECTORS_FILENAME), mode="w+", dtype=np.float32, shape=(total, dim)),
+        NORMS_FILENAME: np.lib.format.open_memmap(os.path.join(segment_path, NORMS_FILENAME), mode="w+", dtype=np.float32, shape=(total,)),
+        IDS_FILENAME: np.lib.format.open_memmap(os.path.join(segment_path, IDS_FILENAME), mode="w+", dtype=np.int64, shape=(total,)),
+    }
+    offset = 0
+    for part, keep in zip(parts, keeps):
+        end = offset + int(keep.sum())
+        outputs[VECTORS_FILENAME][offset:end] = part.vectors[keep]
+        outputs[NORMS_FILENAME][offset:end] = part.norms[keep]
+        outputs[IDS_FILENAME][offset:end] = part.ids[keep]
+        offset = end
+    for output in outputs.values():
+        output.flush()
+
+    index = build_index(outputs[VECTORS_FILENAME])
+    if index is not None:
+        write_index(index, os.path.join(segment_path, INDEX_FILENAME))
+    return segment_name
+
+def _store_chunks(shard_path: str, chunks: List[Document], vectors: np.ndarray) -> str:
+    chunk_store = open_chunk_store(shard_path)
+    try:
+        ids = chunk_store.add(chunks)
+    finally:
+        chunk_store.close()
+    return _write_segment(shard_path, ids, vectors)
+
+def _remove_segments(shard_path: str, segment_names: List[str]):
+    for segment_name in segment_names:
+        shutil.rmtree(_segment_path(shard_path, segment_name), ignore_errors=True)
+
+def clear_shard(space_id: str, base_path: str = VECTOR_STORE_PATH):
+    """Drop every segment of a shard."""
+    shard_path = get_shard_path(space_id, base_path)
+    # Wait for a running compaction: it would write its merged segment back after the clear.
+    with _file_lock(shard_path, name=".compact.lock"), _file_lock(shard_path):
+        manifest = read_manifest(shard_path)
+        old_segments = manifest["segments"] + [name for names in manifest.get("pending", {}).values() for name in names]
+        _write_manifest(shard_path, {"segments": [], "generation": manifest.get("generation", 0) + 1})
+    _remove_segments(shard_path, old_segments)
+    chunk_store = open_chunk_store(shard_path)
+    chunk_store.clear()
+    chunk_store.close()
+
+def add_to_shard(
+    space_id: str,
+    chunks: List[Document],
+    embeddings: Embeddings,
+    base_path: str = VECTOR_STORE_PATH,
+    vectors: Optional[List[List[float]]] = None,
+    compact_in_background: bool = True,
+    pending_doc_id: Optional[str] = None,
+):
+    """Append chunks to the shard of a single space as a new segment.
+
+    Only the new chunks are embedded (unless `vectors` are given) and written; the
+    manifest update is the only step done under the shard lock, so concurrent
+    uploads cannot lose each other's writes. With `pending_doc_id` the segment is
+    staged for that document and only searched once `publish_pending` is called.
+    """
+    if not chunks:
+        return
+    shard_path = get_shard_path(space_id, base_path)
+    segment_name = _store_chunks(shard_path, chunks, _embed_chunks(chunks, embeddings, vectors))
+    with _file_lock(shard_path):
+        manifest = read_manifest(shard_path)
+        if pending_doc_id is not None:
+            manifest.setdefault("pending", {}).setdefault(pending_doc_id, []).append(segment_name)
+        else:
+            manifest["segments"].append(segment_name)
+            manifest["generation"] = manifest.get("generation", 0) + 1
+        _write_manifest(shard_path, manifest)
+    if compact_in_background and pending_doc_id is None:
+        maybe_compact_in_background(space_id, base_path)
+
+def pending_segments(space_id: str, doc_id: str, base_path: str = VECTOR_STORE_PATH) -> List[str]:
+    """Segments staged for a document that is still being ingested."""
+    return read_manifest(get_shard_path(space_id, base_path)).get("pending", {}).get(doc_id, [])
+
+def publish_pending(space_id: str, doc_id: str, base_path: str = VECTOR_STORE_PATH, compact_in_background: bool = True) -> int:
+    """Make the staged segments of a document searchable, all at once. Returns their number."""
+    shard_path = get_shard_path(space_id, base_path)
+    with _file_lock(shard_path):
+        manifest = read_manifest(shard_path)
+        segment_names = manifest.get("pending", {}).pop(doc_id, [])
+        if segment_names:
+            manifest["segments"].extend(segment_names)
+            manifest["generation"] = manifest.get("generation", 0) + 1
+            _write_manifest(shard_path, manifest)
+    if segment_names and compact_in_background:
+        maybe_compact_in_background(space_id, base_path)
+    return len(segment_names)
+
+def discard_pending(space_id: str, doc_id: str, base_path: str = VECTOR_STORE_PATH):
+    """Drop the staged segments of a document, and their chunks, without ever searching them."""
+    shard_path = get_shard_path(space_id, base_path)
+    with _file_lock(shard_path):
+        manifest = read_manifest(shard_path)
+        segment_names = manifest.get("pending", {}).pop(doc_id, [])
+        if segment_names:
+            _write_manifest(shard_path, manifest)
+    chunk_store = open_chunk_store(shard_path)
+    try:
+        for segment_name in segment_names:
+            chunk_store.delete(np.load(os.path.join(_segment_path(shard_path, segment_name), IDS_FILENAME)).tolist())
+    finally:
+        chunk_store.close()
+    _remove_segments(shard_path, segment_names)
+
+def delete_from_shard(
+    space_id: str,
+    doc_id: str,
+    source: Optional[str] = None,
+    base_path: str = VECTOR_STORE_PATH,
+    compact_in_background: bool = True,
+    from_page: Optional[int] = None,
+) -> int:
+    """Delete one document's chunks (only those of pages >= `from_page`, if given)
+    from a shard without touching its segments.
+
+    The chunk ids go into the manifest's tombstones first and the chunk rows are
+    removed after, so an interrupted delete can simply be run again. Returns the
+    number of chunks deleted.
+    """
+    return _tombstone_chunks(
+        space_id, base_path, lambda chunk_store: chunk_store.document_ids(doc_id, source, from_page), compact_in_background
+    )
+
+def truncate_source(space_id: str, source: str, keep: int, base_path: str = VECTOR_STORE_PATH) -> int:
+    """Delete the chunks of a bulk-ingested file (no doc_id) past the first `keep` it was indexed with."""
+    return _tombstone_chunks(
+        space_id, base_path, lambda chunk_store: chunk_store.source_ids(source)[keep:], compact_in_background=False
+    )
+
+def delete_bulk_chunks(space_id: str, base_path: str = VECTOR_STORE_PATH) -> int:
+    """Delete every bulk-ingested chunk (no doc_id) of a shard, keeping uploaded documents."""
+    return _tombstone_chunks(space_id, base_path, lambda chunk_store: chunk_store.bulk_ids(), compact_in_background=False)
+
+def _tombstone_chunks(space_id: str, base_path: str, select_ids: Callable[[ChunkStore], List[int]], compact_in_background: bool) -> int:
+    """Tombstone the chunk ids chosen (under the manifest lock) by `select_ids`, then drop their rows."""
+    shard_path = get_shard_path(space_id, base_path)
+    chunk_store = open_chunk_store(shard_path)
+    try:
+        with _file_lock(shard_path):
+            chunk_ids = select_ids(chunk_store)
+            if chunk_ids:
+                manifest = read_manifest(shard_path)
+                manifest["deleted"] = sorted(set(manifest.get("deleted", [])) | set(chunk_ids))
+                manifest["generation"] = manifest.get("generation", 0) + 1
+                _write_manifest(shard_path, manifest)
+        chunk_store.delete(chunk_ids)
+    finally:
+        chunk_store.close()
+    if chunk_ids and compact_in_background:
+        maybe_compact_in_background(space_id, base_path)
+    return len(chunk_ids)
+
+def compact_shard(space_id: str, base_path: str = VECTOR_STORE_PATH) -> bool:
+    """Merge all live segments of a shard into one, dropping tombstoned vectors.
+    Returns False if nothing was done."""
+    shard_path = get_shard_path(space_id, base_path)
+    with _file_lock(shard_path, name=".compact.lock", blocking=False) as acquired:
+        if not acquired:
+            return False  # another process is already compacting this shard
+        manifest = read_manifest(shard_path)
+        segments = manifest["segments"]
+        deleted = manifest.get("deleted", [])
+        if len(segments) < 2 and not (segments and deleted):
+            return False
+
+        parts = [Segment(_segment_path(shard_path, name)) for name in segments]
+        deleted = np.asarray(deleted, dtype=np.int64)
+        merged_name = _write_merged_segment(shard_path, parts, deleted)
+        # Only tombstones of merged vectors are done with (an upload still being
+        # written may hold others).
+        purged = set(deleted[np.isin(deleted, np.concatenate([part.ids for part in parts]))].tolist())
+
+        with _file_lock(shard_path):
+            manifest = read_manifest(shard_path)
+            # Keep segments appended, and tombstones added, while we were merging.
+            remaining = [s for s in manifest["segments"] if s not in segments]
+            manifest["segments"] = ([merged_name] if merged_name else []) + remaining
+            manifest["deleted"] = [chunk_id for chunk_id in manifest.get("deleted", []) if chunk_id not in purged]
+            _write_manifest(shard_path, manifest)
+        _remove_segments(shard_path, segments)
+    print(f"Compacted shard '{space_id}': {len(segments)} segments -> {1 if merged_name else 0}, {len(purged)} deleted vectors dropped.")
+    return True
+
+def _tombstone_ratio(shard_path: str, manifest: dict) -> float:
+    deleted = len(manifest.get("deleted", []))
+    if not deleted:
+        return 0.0
+    total = sum(
+        len(np.load(os.path.join(_segment_path(shard_path, name), IDS_FILENAME), mmap_mode="r"))
+        for name in manifest["segments"]
+    )
+    return deleted / total if total else 0.0
+
+def maybe_compact_in_background(space_id: str, base_path: str = VECTOR_STORE_PATH):
+    shard_path = get_shard_path(space_id, base_path)
+    manifest = read_manifest(shard_path)
+    if len(manifest["segments"]) <= COMPACTION_SEGMENT_THRESHOLD and _tombstone_ratio(shard_path, manifest) <= TOMBSTONE_COMPACTION_RATIO:
+        return
+    def _run():
+        try:
+            compact_shard(space_id, base_path)
+        except Exception as e:
+            print(f"Error compacting shard '{space_id}': {e}")
+    threading.Thread(target=_run, daemon=True).start()
+
+def _deleted_mask(segment: Segment, tombstones: np.ndarray) -> Optional[np.ndarray]:
+    if not len(tombstones):
+        return None
+    mask = np.isin(segment.ids, tombstones)
+    return mask if mask.any() else None
+
+class ShardSnapshot(NamedTuple):
+    """What a ShardedVectorStore searches for one shard, as of one manifest version."""
+    stamp: Tuple[int, int]  # (inode, mtime) of manifest.json; replaced on every manifest write
+    generation: int
+    segments: List[Segment]
+    deleted: List[Optional[np.ndarray]]  # per segment: mask of tombstoned rows, or None
+
+    def live(self, chunk_ids: List[int]) -> np.ndarray:
+        """Mask of the chunk ids that are in a searchable segment and not tombstoned.
+
+        Chunk rows are written before their segment is listed in the manifest (and
+        staged documents stay unlisted until published), so chunks.db can hold rows
+        that must not be returned yet, or ever, if their upload died.
+        """
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        live = np.zeros(len(chunk_ids), dtype=bool)
+        for segment, deleted in zip(self.segments, self.deleted):
+            rows = segment.positions(chunk_ids)
+            found = rows >= 0
+            if deleted is not None:
+                found[found] &= ~deleted[rows[found]]
+            live |= found
+        return live
+
+def _manifest_stamp(shard_path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(_manifest_path(shard_path))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+class ShardedVectorStore:
+    """Searches the shards of the requested spaces, picking up new segments as they land.
+
+    Every lookup stats the shard's manifest; when it was rewritten (upload, delete,
+    clear or compaction) only the segments not already open are loaded, and the new snapshot
+    replaces the old one in a single assignment. Queries already running keep the
+    snapshot they started with; while one query loads a delta, others keep using the
+    current snapshot instead of waiting. Chunk texts are read from chunks.db on
+    demand, so new chunks need no loading.
+    """
+
+    def __init__(self, embeddings: Embeddings, base_path: str = VECTOR_STORE_PATH):
+        self.embeddings = embeddings
+        self.base_path = base_path
+        self._shards: Dict[str, ShardSnapshot] = {}
+        self._chunk_stores: Dict[str, ChunkStore] = {}
+        self._refresh_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.stats = {"refreshes": 0, "segments_loaded": 0}
+
+    def _load_snapshot(self, space_id: str, current: Optional[ShardSnapshot]) -> ShardSnapshot:
+        """Snapshot of the shard's current manifest, reusing the segments `current` already has open."""
+        shard_path = get_shard_path(space_id, self.base_path)
+        open_segments = {os.path.basename(segment.path): segment for segment in current.segments} if current else {}
+        last_error = None
+        for _ in range(2):
+            stamp = _manifest_stamp(shard_path)
+            manifest = read_manifest(shard_path)
+            try:
+                segments = [
+                    open_segments.get(name) or Segment(_segment_path(shard_path, name))
+                    for name in manifest["segments"]
+                ]
+            except Exception as e:
+                # A compaction may have removed a segment between reading the manifest
+                # and loading it; the fresh manifest points to the merged segment.
+                last_error = e
+                continue
+            tombstones = np.asarray(manifest.get("deleted", []), dtype=np.int64)
+            deleted = [_deleted_mask(segment, tombstones) for segment in segments]
+            loaded = sum(1 for name in manifest["segments"] if name not in open_segments)
+            self.stats["segments_loaded"] += loaded
+            if current is not None:
+                self.stats["refreshes"] += 1
+                print(f"Refreshed shard '{space_id}' to generation {manifest.get('generation', 0)}: {loaded} new segment(s) loaded.")
+            return ShardSnapshot(stamp, manifest.get("generation", 0), segments, deleted)
+        raise RuntimeError(f"Could not load segments of shard '{space_id}': {last_error}")
+
+    def _get_snapshot(self, space_id: str) -> Optional[ShardSnapshot]:
+        shard_path = get_shard_path(space_id, self.base_path)
+        stamp = _manifest_stamp(shard_path)
+        current = self._shards.get(space_id)
+        if stamp is None:
+            return None
+        if current is not None and current.stamp == stamp:
+            return current
+
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(space_id, threading.Lock())
+        if current is not None and not refresh_lock.acquire(blocking=False):
+            return current  # another query is loading the delta
+        if current is None:
+            refresh_lock.acquire()  # first load: nothing to serve meanwhile
+        try:
+            current = self._shards.get(space_id)
+            if current is not None and current.stamp == _manifest_stamp(shard_path):
+                return current
+            snapshot = self._load_snapshot(space_id, current)
+            with self._lock:
+                if space_id not in self._chunk_stores:
+                    self._chunk_stores[space_id] = open_chunk_store(shard_path)
+                self._shards[space_id] = snapshot
+            return snapshot
+        finally:
+            refresh_lock.release()
+
+    def generation(self, space_id: str) -> int:
+        """Generation of the shard as currently searched (refreshing it if the manifest changed)."""
+        snapshot = self._get_snapshot(space_id)
+        return snapshot.generation if snapshot is not None else 0
+
+    def _vector_hits(self, query_vector: np.ndarray, space_ids: List[str], k: int) -> List[Tuple[float, str, int]]:
+        """(L2 distance, space_id, chunk_id) of the k nearest chunks over the given shards."""
+        return self._vector_hits_batch(query_vector.reshape(1, -1), [space_ids], k)[0]
+
+    def _vector_hits_batch(self, query_vectors: np.ndarray, space_ids_per_query: List[List[str]], k: int) -> List[List[Tuple[float, str, int]]]:
+        """`_vector_hits` for many queries: each shard segment is searched once with all queries that may read it."""
+        queries_by_space = {}
+        for row, space_ids in enumerate(space_ids_per_query):
+            for space_id in space_ids:
+                queries_by_space.setdefault(space_id, []).append(row)
+
+        hits = [[] for _ in space_ids_per_query]
+        for space_id, rows in queries_by_space.items():
+            snapshot = self._get_snapshot(space_id)
+            if snapshot is None:
+                continue
+            queries = query_vectors[rows]
+            for segment, deleted in zip(snapshot.segments, snapshot.deleted):
+                distances, chunk_ids = segment.search_batch(queries, k, deleted)
+                for row, row_distances, row_ids in zip(rows, distances.tolist(), chunk_ids.tolist()):
+                    hits[row].extend(
+                        (distance, space_id, chunk_id)
+                        for distance, chunk_id in zip(row_distances, row_ids)
+                        if chunk_id >= 0
+                    )
+        for row_hits in hits:
+            row_hits.sort(key=lambda hit: hit[0])
+            del row_hits[k:]
+        return hits
+
+    def _keyword_hits(self, query: str, space_ids: List[str], k: int) -> List[Tuple[float, str, int]]:
+        """(bm25 score, space_id, chunk_id) of the k best keyword matches over the given shards."""
+        hits = []
+        for space_id in space_ids:
+            snapshot = self._get_snapshot(space_id)
+            if snapshot is None or not snapshot.segments:
+                continue
+            matches = self._chunk_stores[space_id].search_text(query, k)
+            live = snapshot.live([chunk_id for chunk_id, _ in matches])
+            hits.extend((score, space_id, chunk_id) for (chunk_id, score), is_live in zip(matches, live) if is_live)
+        hits.sort(key=lambda hit: hit[0])
+        return hits[:k]
+
+    def _fetch_chunks(self, keys: List[Tuple[str, int]]) -> Dict[Tuple[str, int], Document]:
+        """Read only the given (space_id, chunk_id) chunks from their shard's chunk store."""
+        ids_by_space = {}
+        for space_id, chunk_id in keys:
+            ids_by_space.setdefault(space_id, []).append(chunk_id)
+        chunks = {}
+        for space_id, chunk_ids in ids_by_space.items():
+            for chunk_id, chunk in self._chunk_stores[space_id].get(chunk_ids).items():
+                chunk.metadata["space_id"] = space_id
+                chunks[(space_id, chunk_id)] = chunk
+        return chunks
+
+    def _query_vector(self, query: str, query_vector: Optional[List[float]]) -> np.ndarray:
+        if query_vector is None:
+            query_vector = self.embeddings.embed_query(query)
+        return np.asarray(query_vector, dtype=np.float32)
+
+    def similarity_search_with_score(self, query: str, space_ids: List[str], k: int = 4, query_vector: Optional[List[float]] = None) -> List[Tuple[Document, float]]:
+        """Search only the shards of the given spaces and merge their top-k by L2 distance."""
+        query_vector = self._query_vector(query, query_vector)
+        hits = self._vector_hits(query_vector, space_ids, k)
+        chunks = self._fetch_chunks([(space_id, chunk_id) for _, space_id, chunk_id in hits])
+        return [
+            (chunks[(space_id, chunk_id)], distance)
+            for distance, space_id, chunk_id in hits
+            if (space_id, chunk_id) in chunks
+        ]
+
+    def similarity_search(self, query: str, space_ids: List[str], k: int = 4, query_vector: Optional[List[float]] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, space_ids, k, query_vector)]
+
+    def hybrid_search(self, query: str, space_ids: List[str], k: int = 4, rrf_k: int = RRF_K, query_vector: Optional[List[float]] = None) -> List[Document]:
+        """Fuse vector and BM25 keyword candidates of the given shards with reciprocal rank fusion."""
+        query_vector = self._query_vector(query, query_vector)
+        vector_hits = self._vector_hits(query_vector, space_ids, k)
+        keyword_hits = self._keyword_hits(query, space_ids, k)
+        fused = reciprocal_rank_fusion(
+            [[(space_id, chunk_id) for _, space_id, chunk_id in hits] for hits in (vector_hits, keyword_hits)],
+            rrf_k
+        )[:k]
+        chunks = self._fetch_chunks(fused)
+        return [chunks[key] for key in fused if key in chunks]
+
+    def search_batch(
+        self,
+        queries: List[str],
+        query_vectors: List[List[float]],
+        space_ids_per_query: List[List[str]],
+        k: int = 4,
+        hybrid: bool = HYBRID_SEARCH,
+        rrf_k: int = RRF_K,
+    ) -> List[List[Document]]:
+        """Top-k chunks for many queries at once, each restricted to its own spaces.
+
+        Vector search is one matrix query per segment and all chunk texts are read
+        with one lookup per shard; with `hybrid`, BM25 hits are fused per query as in
+        `hybrid_search`.
+        """
+        vector_hits = self._vector_hits_batch(np.asarray(query_vectors, dtype=np.float32), space_ids_per_query, k)
+        rankings = []
+        for query, space_ids, hits in zip(queries, space_ids_per_query, vector_hits):
+            ranking = [(space_id, chunk_id) for _, space_id, chunk_id in hits]
+            if hybrid:
+                keyword_ranking = [(space_id, chunk_id) for _, space_id, chunk_id in self._keyword_hits(query, space_ids, k)]
+                ranking = reciprocal_rank_fusion([ranking, keyword_ranking], rrf_k)[:k]
+            rankings.append(ranking)
+        chunks = self._fetch_chunks(list({key for ranking in rankings for key in ranking}))
+        return [[chunks[key] for key in ranking if key in chunks] for ranking in rankings]
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[str, int]]], rrf_k: int = RRF_K) -> List[Tuple[str, int]]:
+    """Merge ranked lists by sum of 1 / (rrf_k + rank); items ranked well in several lists win."""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda key: scores[key], reverse=True)
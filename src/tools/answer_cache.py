@@ -0,0 +1,110 @@
+import sys
+import os
+import time
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+import numpy as np
+
+from src.config import *
+from src.tracing import count_cache
+
+# Semantic answer cache in front of RAGTool.answer.
+# Entries are grouped by a permission scope, the hash of the exact set of documents the
+# asking user can read, so an answer is only ever served to users who could have
+# produced it themselves. Each entry also remembers the generation of every space
+# shard it was answered from; once ingestion bumps one of them the entry is dropped.
+
+def permission_scope(accessible_sources: Dict[str, List[str]]) -> str:
+    """Hash of a user's accessible document set, independent of ordering."""
+    pairs = sorted((space_id, filename) for space_id, filenames in accessible_sources.items() for filename in set(filenames))
+    return hashlib.sha256(repr(pairs).encode("utf-8")).hexdigest()
+
+class _CacheEntry:
+    def __init__(self, vector: np.ndarray, answer: str, generations: Dict[str, int]):
+        self.vector = vector
+        self.answer = answer
+        self.generations = generations
+        self.stored_at = time.monotonic()
+
+class SemanticAnswerCache:
+    """Thread-safe answer cache looked up by query-embedding cosine similarity."""
+
+    def __init__(
+        self,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._by_scope: Dict[str, "OrderedDict[int, _CacheEntry]"] = {}
+        self._order: "OrderedDict[int, str]" = OrderedDict()  # entry id -> scope, oldest first
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else vector
+
+    def _remove(self, scope: str, entry_id: int):
+        entries = self._by_scope[scope]
+        del entries[entry_id]
+        if not entries:
+            del self._by_scope[scope]
+        del self._order[entry_id]
+
+    def lookup(self, scope: str, query_vector: List[float], generations: Dict[str, int]) -> Optional[str]:
+        """Cached answer for a similar question in the same scope, or None.
+
+        `generations` are the current shard generations of the scope's spaces; entries
+        answered from an older generation of any of them are evicted here.
+        """
+        query = self._normalize(query_vector)
+        with self._lock:
+            entries = self._by_scope.get(scope, {})
+            now = time.monotonic()
+            stale = [
+                entry_id for entry_id, entry in entries.items()
+                if now - entry.stored_at > self.ttl_seconds
+                or any(generations.get(space_id, 0) != generation for space_id, generation in entry.generations.items())
+            ]
+            for entry_id in stale:
+                self._remove(scope, entry_id)
+            self.stats["invalidations"] += len(stale)
+
+            entries = self._by_scope.get(scope)
+            if entries:
+                entry_ids = list(entries)
+                similarities = np.stack([entries[entry_id].vector for entry_id in entry_ids]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    self.stats["hits"] += 1
+                    count_cache("answer", hit=True)
+                    return entries[entry_ids[best]].answer
+            self.stats["misses"] += 1
+        count_cache("answer", hit=False)
+        return None
+
+    def store(self, scope: str, query_vector: List[float], answer: str, generations: Dict[str, int]):
+        with self._lock:
+            entry_id = next(self._ids)
+            self._by_scope.setdefault(scope, OrderedDict())[entry_id] = _CacheEntry(self._normalize(query_vector), answer, dict(generations))
+            self._order[entry_id] = scope
+            while len(self._order) > self.max_entries:
+                oldest_id, oldest_scope = next(iter(self._order.items()))
+                self._remove(oldest_scope, oldest_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._order)
@@ -4,30 +4,69 @@ project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(_
 sys.path.append(project_root)
 
 from langchain.prompts import PromptTemplate
-from langchain_community.vectorstores import FAISS
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
-from langchain.retrievers import ContextualCompressionRetriever
-from langchain_cohere import CohereRerank
-import sqlite3
+import re
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
 from src.config import *
+from src.storage.metadata_db import PermissionCache
+from src.storage.vector_store import ShardedVectorStore
+from src.tools.answer_cache import SemanticAnswerCache, permission_scope
+from src.tools.reranking import Reranker, doc_key
+from src.tracing import span, traced
+
+# Ids, invoice numbers and file names: lexical matching already ranks these well.
+KEYWORD_QUERY_PATTERN = re.compile(r"\d{3,}|\w+\.pdf\b", re.IGNORECASE)
+
+NO_ACCESS_MESSAGE = "You do not have access to any documents, or no relevant documents were found."
+
+def is_keyword_query(question: str) -> bool:
+    return bool(KEYWORD_QUERY_PATTERN.search(question))
+
+class StageTimer:
+    """Per-stage item counts and wall time of one batch run."""
+
+    def __init__(self):
+        self.stats = {}
+
+    def record(self, stage: str, items: int, start: float):
+        seconds = time.perf_counter() - start
+        self.stats[stage] = {
+            "items": items,
+            "seconds": round(seconds, 4),
+            "per_second": round(items / seconds, 1) if seconds > 0 else None,
+        }
+
+    def report(self):
+        for stage, stats in self.stats.items():
+            print(f"  {stage:<12} {stats['items']:>6} items  {stats['seconds']:>8.3f}s  {stats['per_second']}/s")
 
 class RAGTool:
-    def __init__(self, vector_store_path=VECTOR_STORE_PATH):
-        if not GOOGLE_API_KEY:
+    def __init__(self, vector_store_path=VECTOR_STORE_PATH, db_path=SQL_DATABASE_PATH, embeddings=None, llm=None, reranker=None):
+        # embeddings / llm / reranker can be injected (e.g. fakes for offline benchmarks).
+        if (embeddings is None or llm is None) and not GOOGLE_API_KEY:
             raise ValueError("GOOGLE_API_KEY not found in environment variables.")
-        if not COHERE_API_KEY:
+        if reranker is None and RERANK_BACKEND == "cohere" and not COHERE_API_KEY:
             raise ValueError("COHERE_API_KEY not found in environment variables.")
         
-        self.reranker = CohereRerank(cohere_api_key=COHERE_API_KEY, top_n=5, model="rerank-v3.5")
+        # Cached; falls back to a local backend when Cohere is slow or over budget.
+        self.reranker = reranker if reranker is not None else Reranker()
 
-        self.embeddings = GoogleGenerativeAIEmbeddings(
+        self.embeddings = embeddings if embeddings is not None else GoogleGenerativeAIEmbeddings(
             model=EMBEDDING_MODEL_NAME,
             google_api_key=GOOGLE_API_KEY
         )
+        self.vector_store_path = vector_store_path
         self.vector_store = self._load_vector_store(vector_store_path)
-        self.llm = ChatGoogleGenerativeAI(
+        # Re-queried only after a workspace, space, membership or document change.
+        self.permissions = PermissionCache(db_path)
+        # Scoped by the user's accessible documents; entries expire when their spaces are re-ingested.
+        self.answer_cache = SemanticAnswerCache() if ANSWER_CACHE_ENABLED else None
+        self.llm = llm if llm is not None else ChatGoogleGenerativeAI(
             model=MODEL_NAME,
             google_api_key=GOOGLE_API_KEY,
             temperature=0,
@@ -44,11 +83,13 @@ class RAGTool:
         # )
 
         self.chain = self._build_chain()
+        self.last_batch_stats = {}
         print("Initialize RAG Tool successful!")
 
     def _load_vector_store(self, path: str):
         try:
-            return FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+            # Shards are loaded lazily, per space, on first search.
+            return ShardedVectorStore(self.embeddings, base_path=path)
         except Exception as e:
             print(f"Error when load vector store: {e}")
             raise
@@ -76,80 +117,268 @@ class RAGTool:
 
         return prompt_chain
 
-    def _get_accessible_doc_sources(self, user_id: str) -> list[str]:
-        conn = sqlite3.connect(SQL_DATABASE_PATH)
-        cursor = conn.cursor()
-
-        query = """
-        SELECT DISTINCT T1.filename
-        FROM PDF_Document AS T1
-        JOIN User_Space_Membership AS T2 ON T1.space_id = T2.space_id
-        WHERE T2.user_id = ?     
-        """
-
-        cursor.execute(query, (user_id,))
-        results = cursor.fetchall()
-        conn.close()
-
-        accessible_sources = [row[0] for row in results]
+    def _get_accessible_doc_sources(self, user_id: str) -> dict[str, list[str]]:
+        """Return the documents the user can read, grouped by space_id (one vector shard per space)."""
+        accessible_sources = self.permissions.get_accessible_sources(user_id)
         print(f"User {user_id} has permission to access into documents: {accessible_sources}")
         return accessible_sources
     
+    def _retrieve(self, question: str, space_ids: list[str], query_vector=None):
+        # Only the shards of the user's spaces are searched, so every candidate is accessible.
+        if HYBRID_SEARCH:
+            return self.vector_store.hybrid_search(question, space_ids, k=RETRIEVAL_TOP_K, query_vector=query_vector)
+        return self.vector_store.similarity_search(question, space_ids, k=RETRIEVAL_TOP_K, query_vector=query_vector)
+
+    def _rerank(self, question: str, candidates):
+        if not candidates:
+            return []
+        if HYBRID_SEARCH and SKIP_RERANK_FOR_KEYWORD_QUERIES and is_keyword_query(question):
+            # The fused ranking is used as is: no network round trip.
+            return candidates[:RERANK_TOP_N]
+        return self.reranker.rerank(question, candidates)
+
     def _format_docs(self, docs):
         return "\n\n".join(doc.page_content for doc in docs)
     
-    def answer(self, user_question_and_id: str) -> str:
+    def _parse_input(self, user_question_and_id: str):
         try:
             user_id, question = user_question_and_id.split("|", 1)
         except ValueError:
-            return "Error: Input for RAGTool must be in the format 'user_id|question'"
-        
-        print(f"Getting accessible sources for user {user_id}...")
-        accessible_sources = self._get_accessible_doc_sources(user_id)
+            return None
+        return user_id, question
 
-        if not accessible_sources:
-            return "You do not have access to any documents, or no relevant documents were found."
-        
-        # retriever = self.vector_store.as_retriever(
-        #     search_kwargs={
-        #         "k": 10,
-        #         "filter": {"source": accessible_sources}
-        #     }
-        # )
+    def _prepare(self, question: str, accessible_sources: dict[str, list[str]], query_vector):
+        """Everything between permission lookup and generation.
 
-        # print(retriever)
-        base_retriever = self.vector_store.as_retriever(
-            search_kwargs={"k": 25, "filter": {"source": accessible_sources}}
-        )
+        Returns (answer, context, cache_key): `answer` is set when no generation is
+        needed (cache hit, nothing relevant found), otherwise `context` is the
+        re-ranked context and `cache_key` is where the generated answer is stored.
+        """
+        space_ids = list(accessible_sources.keys())
+        scope = permission_scope(accessible_sources)
+        # Read before retrieval, so an upload landing mid-answer leaves the entry stale.
+        with span("rag.answer_cache") as stage:
+            # Also picks up segments uploaded since the last query (delta load).
+            generations = {space_id: self.vector_store.generation(space_id) for space_id in space_ids}
+            cached_answer = None
+            if self.answer_cache is not None:
+                cached_answer = self.answer_cache.lookup(scope, query_vector, generations)
+            stage.set("hit", cached_answer is not None)
+        if cached_answer is not None:
+            print(f"Answer cache hit ({self.answer_cache.stats['hits']} hits / {self.answer_cache.stats['misses']} misses).")
+            return cached_answer, None, None
 
-        # 3. Gói retriever cơ bản với re-ranker
-        compression_retriever = ContextualCompressionRetriever(
-            base_compressor=self.reranker, 
-            base_retriever=base_retriever
-        )
+        with span("rag.retrieve", spaces=len(space_ids)) as stage:
+            candidates = self._retrieve(question, space_ids, query_vector)
+            stage.set("candidates", len(candidates))
 
-        relevant_chunks = compression_retriever.invoke(question)
+        # Re-rank the merged candidates
+        with span("rag.rerank", candidates=len(candidates)):
+            relevant_chunks = self._rerank(question, candidates)
         print(f"Found {len(relevant_chunks)} highly relevant chunks after re-ranking.")
 
         if not relevant_chunks:
             # ... (xử lý lỗi không tìm thấy chunk liên quan)
-            return "I could not find relevant information..."
+            return "I could not find relevant information...", None, None
 
-        context = self._format_docs(relevant_chunks)
-        
-        rag_chain = {
+        return None, self._format_docs(relevant_chunks), (scope, query_vector, generations)
+
+    def _rag_chain(self, context: str):
+        print("Generating final answer with re-ranked context...")
+        return {
             "context": lambda x: context,       # Cung cấp context đã được re-rank
             "question": RunnablePassthrough()   # Truyền câu hỏi gốc vào
         } | self.chain                # Pipe vào chain LLM đã tạo sẵn
+
+    def _embed_queries(self, questions: list[str]) -> list[list[float]]:
+        if isinstance(self.embeddings, GoogleGenerativeAIEmbeddings):
+            # One batched request, embedded as queries (embed_documents defaults to documents).
+            return self.embeddings.embed_documents(questions, task_type="RETRIEVAL_QUERY")
+        return self.embeddings.embed_documents(questions)
+
+    def _store_answer(self, cache_key, response: str):
+        if self.answer_cache is not None:
+            scope, query_vector, generations = cache_key
+            self.answer_cache.store(scope, query_vector, response, generations)
+
+    def answer(self, user_question_and_id: str) -> str:
+        with span("rag.answer"):
+            return self._answer(user_question_and_id)
+
+    def _answer(self, user_question_and_id: str) -> str:
+        question, answer, context, cache_key = self._prepare_input(user_question_and_id)
+        if answer is not None:
+            return answer
+
+        with span("rag.generate"):
+            response = self._rag_chain(context).invoke(question)
+        self._store_answer(cache_key, response)
+        return response
+
+    def _prepare_input(self, user_question_and_id: str):
+        """Parse the input, look up permissions and embed the question, then `_prepare`.
+
+        Returns (question, answer, context, cache_key), like `_prepare`.
+        """
+        parsed = self._parse_input(user_question_and_id)
+        if parsed is None:
+            return None, "Error: Input for RAGTool must be in the format 'user_id|question'", None, None
+        user_id, question = parsed
         
-        print("Generating final answer with re-ranked context...")
+        print(f"Getting accessible sources for user {user_id}...")
+        with span("rag.permissions"):
+            accessible_sources = self._get_accessible_doc_sources(user_id)
 
-        # rag_chain = (
-        #     {"context": retriever | self._format_docs, "question": RunnablePassthrough()}
-        #     | self.chain
-        # )
+        if not accessible_sources:
+            return question, NO_ACCESS_MESSAGE, None, None
+        
+        # Embedded once, for both the cache lookup and retrieval.
+        with span("rag.embed_query"):
+            query_vector = self.embeddings.embed_query(question)
+        return (question, *self._prepare(question, accessible_sources, query_vector))
+
+    def answer_stream(self, user_question_and_id: str) -> Iterator[str]:
+        """`answer`, yielding the generated answer piece by piece as the LLM writes it.
+
+        Answers that need no generation (cache hit, no access, nothing relevant) come
+        as a single piece.
+        """
+        with span("rag.answer", streamed=True):
+            question, answer, context, cache_key = self._prepare_input(user_question_and_id)
+            if answer is not None:
+                yield answer
+                return
+
+            pieces = []
+            with span("rag.generate"):
+                for piece in self._rag_chain(context).stream(question):
+                    pieces.append(piece)
+                    yield piece
+        self._store_answer(cache_key, "".join(pieces))
+
+    def answer_batch(self, requests: list[tuple[str, str]], max_concurrency: int = BATCH_MAX_CONCURRENCY) -> list[str]:
+        """Answer many (question, user_id) pairs; answers come back in request order.
+
+        Each stage runs once for the whole batch: permissions per distinct user, one
+        embedding call for the distinct questions, one vector search per shard segment,
+        reranking and generation deduplicated and fanned out `max_concurrency` at a time.
+        Per-stage throughput is kept in `last_batch_stats`.
+        """
+        with span("rag.answer_batch", requests=len(requests)):
+            return self._answer_batch(requests, max_concurrency)
+
+    def _answer_batch(self, requests: list[tuple[str, str]], max_concurrency: int) -> list[str]:
+        timer = StageTimer()
+        answers: list = [None] * len(requests)
+
+        start = time.perf_counter()
+        user_ids = list(dict.fromkeys(user_id for _, user_id in requests))
+        sources_by_user = {user_id: self.permissions.get_accessible_sources(user_id) for user_id in user_ids}
+        timer.record("permissions", len(user_ids), start)
+
+        pending = []  # indexes of requests that need retrieval
+        for i, (_, user_id) in enumerate(requests):
+            if sources_by_user[user_id]:
+                pending.append(i)
+            else:
+                answers[i] = NO_ACCESS_MESSAGE
+
+        start = time.perf_counter()
+        questions = list(dict.fromkeys(requests[i][0] for i in pending))
+        vectors = dict(zip(questions, self._embed_queries(questions))) if questions else {}
+        timer.record("embedding", len(questions), start)
+
+        start = time.perf_counter()
+        space_ids = {space_id for user_id in user_ids for space_id in sources_by_user[user_id]}
+        # Read before retrieval, so an upload landing mid-batch leaves the entries stale.
+        generations = {space_id: self.vector_store.generation(space_id) for space_id in space_ids}
+        scopes = {user_id: permission_scope(sources) for user_id, sources in sources_by_user.items() if sources}
+        cache_keys = {}
+        for i in list(pending):
+            question, user_id = requests[i]
+            user_generations = {space_id: generations[space_id] for space_id in sources_by_user[user_id]}
+            cache_keys[i] = (scopes[user_id], vectors[question], user_generations)
+            if self.answer_cache is not None:
+                cached_answer = self.answer_cache.lookup(*cache_keys[i])
+                if cached_answer is not None:
+                    answers[i] = cached_answer
+                    pending.remove(i)
+        timer.record("cache", len(cache_keys), start)
+
+        start = time.perf_counter()
+        candidates = self.vector_store.search_batch(
+            [requests[i][0] for i in pending],
+            [vectors[requests[i][0]] for i in pending],
+            [list(sources_by_user[requests[i][1]].keys()) for i in pending],
+            k=RETRIEVAL_TOP_K,
+            hybrid=HYBRID_SEARCH,
+        )
+        timer.record("retrieval", len(pending), start)
+
+        start = time.perf_counter()
+        # Users with overlapping spaces often get the same candidates for the same question.
+        rerank_groups = {}
+        for i, docs in zip(pending, candidates):
+            rerank_groups.setdefault((requests[i][0], tuple(doc_key(doc) for doc in docs)), (requests[i][0], docs))
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            ranked = dict(zip(rerank_groups, executor.map(lambda group: self._rerank(*group), rerank_groups.values())))
+        contexts = {}
+        for i, docs in zip(pending, candidates):
+            relevant_chunks = ranked[(requests[i][0], tuple(doc_key(doc) for doc in docs))]
+            if relevant_chunks:
+                contexts[i] = self._format_docs(relevant_chunks)
+            else:
+                answers[i] = "I could not find relevant information..."
+        timer.record("rerank", len(rerank_groups), start)
+
+        start = time.perf_counter()
+        prompts = list(dict.fromkeys((requests[i][0], context) for i, context in contexts.items()))
+        responses = self.chain.batch(
+            [{"question": question, "context": context} for question, context in prompts],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True,
+        )
+        generated = dict(zip(prompts, responses))
+        for i, context in contexts.items():
+            response = generated[(requests[i][0], context)]
+            if isinstance(response, Exception):
+                answers[i] = f"Error generating answer: {response}"
+            else:
+                answers[i] = response
+                self._store_answer(cache_keys[i], response)
+        timer.record("generation", len(prompts), start)
+
+        self.last_batch_stats = timer.stats
+        print(f"Answered a batch of {len(requests)} questions:")
+        timer.report()
+        return answers
+
+    async def aanswer(self, user_question_and_id: str) -> str:
+        """Async `answer`: network calls are awaited, SQLite / numpy / rerank work runs on the default executor."""
+        with span("rag.answer"):
+            return await self._aanswer(user_question_and_id)
+
+    async def _aanswer(self, user_question_and_id: str) -> str:
+        parsed = self._parse_input(user_question_and_id)
+        if parsed is None:
+            return "Error: Input for RAGTool must be in the format 'user_id|question'"
+        user_id, question = parsed
+
+        # The permission lookup and the query embedding are independent.
+        accessible_sources, query_vector = await asyncio.gather(
+            traced("rag.permissions", asyncio.to_thread(self._get_accessible_doc_sources, user_id)),
+            traced("rag.embed_query", self.embeddings.aembed_query(question)),
+        )
+        if not accessible_sources:
+            return NO_ACCESS_MESSAGE
+
+        answer, context, cache_key = await asyncio.to_thread(self._prepare, question, accessible_sources, query_vector)
+        if answer is not None:
+            return answer
 
-        response = rag_chain.invoke(question)
+        with span("rag.generate"):
+            response = await self._rag_chain(context).ainvoke(question)
+        self._store_answer(cache_key, response)
         return response
     
 if __name__ == '__main__':
@@ -0,0 +1,166 @@
+import sys
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Hashable, List, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from langchain_core.documents import Document
+
+from src.config import *
+from src.tracing import count, count_cache
+from src.utils import TokenBucket
+
+# Rerank backends share one method: rerank(query, docs, top_n) -> best docs first.
+#   cohere        -> remote Cohere rerank-v3.5
+#   cross-encoder -> local CPU cross-encoder (needs sentence-transformers)
+#   score         -> cheap local term-overlap score, no model at all
+# Reranker puts a (query, candidate set) cache in front of the configured backend and
+# falls back to a local backend when the remote call is slow, failing or over budget.
+
+def doc_key(doc: Document) -> Hashable:
+    if "chunk_id" in doc.metadata:
+        return (doc.metadata.get("space_id"), doc.metadata["chunk_id"])
+    return hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+
+class CohereReranker:
+    def __init__(self):
+        from langchain_cohere import CohereRerank
+        if not COHERE_API_KEY:
+            raise ValueError("COHERE_API_KEY not found in environment variables.")
+        self.model = CohereRerank(cohere_api_key=COHERE_API_KEY, top_n=RERANK_TOP_N, model="rerank-v3.5")
+
+    def rerank(self, query: str, docs: List[Document], top_n: int) -> List[Document]:
+        return list(self.model.compress_documents(docs, query))[:top_n]
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL_NAME):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("The cross-encoder reranker needs `pip install sentence-transformers`.") from e
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def rerank(self, query: str, docs: List[Document], top_n: int) -> List[Document]:
+        scores = self.model.predict([(query, doc.page_content) for doc in docs])
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:top_n]
+        return [docs[i] for i in order]
+
+class ScoreReranker:
+    def rerank(self, query: str, docs: List[Document], top_n: int) -> List[Document]:
+        terms = {word.lower() for word in re.findall(r"\w+", query)}
+
+        def score(position: int, doc: Document) -> float:
+            words = {word.lower() for word in re.findall(r"\w+", doc.page_content)}
+            coverage = len(terms & words) / len(terms) if terms else 0.0
+            # Retrieval order breaks ties.
+            return coverage + 1.0 / (RRF_K + position + 1)
+
+        order = sorted(range(len(docs)), key=lambda i: score(i, docs[i]), reverse=True)[:top_n]
+        return [docs[i] for i in order]
+
+RERANK_BACKENDS = {
+    "cohere": CohereReranker,
+    "cross-encoder": CrossEncoderReranker,
+    "score": ScoreReranker,
+}
+
+def create_rerank_backend(name: str):
+    if name == "none":
+        return None
+    if name not in RERANK_BACKENDS:
+        raise ValueError(f"Unknown rerank backend '{name}', expected one of {sorted(RERANK_BACKENDS) + ['none']}.")
+    return RERANK_BACKENDS[name]()
+
+class RerankCache:
+    """Thread-safe LRU of rerank results with a TTL, keyed by (query hash, candidate id set)."""
+
+    def __init__(self, max_size: int = RERANK_CACHE_SIZE, ttl_seconds: float = RERANK_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple, Tuple[float, List[Hashable]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query: str, docs: List[Document]) -> Tuple:
+        query_hash = hashlib.sha256(query.strip().lower().encode("utf-8")).hexdigest()
+        return query_hash, frozenset(doc_key(doc) for doc in docs)
+
+    def get(self, key: Tuple) -> Optional[List[Hashable]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, ranked_keys = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return ranked_keys
+
+    def put(self, key: Tuple, ranked_keys: List[Hashable]):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), ranked_keys)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+class Reranker:
+    def __init__(
+        self,
+        backend: str = RERANK_BACKEND,
+        fallback_backend: str = RERANK_FALLBACK_BACKEND,
+        top_n: int = RERANK_TOP_N,
+        timeout_seconds: float = RERANK_TIMEOUT_SECONDS,
+        max_calls_per_minute: float = RERANK_MAX_CALLS_PER_MINUTE,
+    ):
+        self.top_n = top_n
+        self.timeout_seconds = timeout_seconds
+        self.backend = create_rerank_backend(backend)
+        self.fallback = create_rerank_backend(fallback_backend) if fallback_backend != backend else None
+        # Only the remote backend is metered.
+        self.budget = TokenBucket(rate=max_calls_per_minute / 60.0, capacity=max_calls_per_minute) if backend == "cohere" else None
+        self.cache = RerankCache()
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "fallbacks": 0}
+
+    def _fall_back(self, query: str, docs: List[Document], reason: str) -> List[Document]:
+        self.stats["fallbacks"] += 1
+        count("rerank_fallbacks_total", reason=reason.split(":")[0])  # exception type, not message
+        print(f"Rerank falling back to local backend ({reason}).")
+        if self.fallback is None:
+            return docs[:self.top_n]
+        return self.fallback.rerank(query, docs, self.top_n)
+
+    def rerank(self, query: str, docs: List[Document]) -> List[Document]:
+        if not docs:
+            return []
+        if self.backend is None:
+            return docs[:self.top_n]
+
+        key = RerankCache.make_key(query, docs)
+        ranked_keys = self.cache.get(key)
+        if ranked_keys is not None:
+            self.stats["cache_hits"] += 1
+            count_cache("rerank", hit=True)
+            docs_by_key = {doc_key(doc): doc for doc in docs}
+            return [docs_by_key[k] for k in ranked_keys if k in docs_by_key]
+        self.stats["cache_misses"] += 1
+        count_cache("rerank", hit=False)
+
+        if self.budget is not None and not self.budget.try_acquire():
+            return self._fall_back(query, docs, "over budget")
+        future = self._executor.submit(self.backend.rerank, query, docs, self.top_n)
+        try:
+            ranked = future.result(timeout=self.timeout_seconds)
+        except Exception as e:
+            return self._fall_back(query, docs, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+
+        self.cache.put(key, [doc_key(doc) for doc in ranked])
+        return ranked
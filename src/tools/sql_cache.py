@@ -0,0 +1,114 @@
+import sys
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+from src.config import *
+from src.tracing import count_cache
+
+# Generated-SQL template cache for TextToSQLTool.
+# Questions are reduced to a shape: lower-cased words, with quoted strings and numbers
+# replaced by a placeholder. A generated query becomes a template by turning the
+# user_id and every question literal it contains into named parameters, so "How many
+# documents are in 'Invoices'?" from Alice and from Bob share one template. Literals
+# the SQL does not contain verbatim stay fixed and must match on lookup.
+
+# Quotes must not touch a word character, so "what's" is not the start of a literal.
+LITERAL_PATTERN = re.compile(r"(?<!\w)'([^']+)'(?!\w)|(?<!\w)\"([^\"]+)\"(?!\w)|(?<![\w.])(\d+(?:\.\d+)?)(?![\w.])")
+PLACEHOLDER = "__value__"
+
+def question_shape(question: str) -> Tuple[str, List[str]]:
+    """(shape, literals) of a question. Literals are in order of appearance."""
+    literals = []
+
+    def _extract(match):
+        literals.append(next(group for group in match.groups() if group is not None))
+        return f" {PLACEHOLDER} "
+
+    shape = LITERAL_PATTERN.sub(_extract, question)
+    return " ".join(re.findall(r"\w+", shape.lower())), literals
+
+def _literal_pattern(value: str) -> re.Pattern:
+    quoted = r"(['\"])" + re.escape(value) + r"\1"
+    if re.fullmatch(r"\d+(?:\.\d+)?", value):
+        return re.compile(quoted + r"|(?<![\w.'\"])" + re.escape(value) + r"(?![\w.'\"])")
+    return re.compile(quoted)
+
+def make_template(sql: str, user_id: str, literals: List[str]) -> Optional[Tuple[str, List[Optional[str]]]]:
+    """(template, fixed literals) for a generated query, or None if it must not be cached.
+
+    Only read queries filtered by the user's id are cached; the id becomes :user_id.
+    fixed[i] is None when literal i became parameter :p<i>, else its required value.
+    """
+    if not re.match(r"\s*(select|with)\b", sql, re.IGNORECASE):
+        return None
+    user_pattern = _literal_pattern(user_id)
+    if not user_pattern.search(sql):
+        return None
+    template = user_pattern.sub(":user_id", sql)
+    if user_id in template:
+        return None  # the id is also part of another literal (e.g. LIKE '%alice_01%')
+    fixed = []
+    for i, value in enumerate(literals):
+        pattern = _literal_pattern(value)
+        if pattern.search(template):
+            template = pattern.sub(f":p{i}", template)
+            fixed.append(None)
+        else:
+            fixed.append(value)
+    return template, fixed
+
+def _bind_value(literal: str):
+    """Numbers are bound as numbers: SQLite never finds COUNT(*) > '5' true."""
+    if re.fullmatch(r"\d+", literal):
+        return int(literal)
+    if re.fullmatch(r"\d+\.\d+", literal):
+        return float(literal)
+    return literal
+
+def bind_parameters(fixed: List[Optional[str]], literals: List[str], user_id: str) -> Dict[str, object]:
+    """Named parameters of a template for this question's literals."""
+    parameters = {"user_id": user_id}
+    parameters.update({f"p{i}": _bind_value(literal) for i, (value, literal) in enumerate(zip(fixed, literals)) if value is None})
+    return parameters
+
+class SQLTemplateCache:
+    """Thread-safe LRU of SQL templates by question shape. Cleared when the schema changes."""
+
+    def __init__(self, max_size: int = SQL_TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._templates: "OrderedDict[str, Tuple[str, List[Optional[str]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, shape: str, literals: List[str], user_id: str) -> Optional[Tuple[str, Dict[str, object]]]:
+        """(template, parameters) for this question, or None."""
+        with self._lock:
+            entry = self._templates.get(shape)
+            if entry is None or len(entry[1]) != len(literals) or any(
+                value is not None and value != literal for value, literal in zip(entry[1], literals)
+            ):
+                self.stats["misses"] += 1
+                count_cache("sql_template", hit=False)
+                return None
+            self._templates.move_to_end(shape)
+            self.stats["hits"] += 1
+        count_cache("sql_template", hit=True)
+        template, fixed = entry
+        return template, bind_parameters(fixed, literals, user_id)
+
+    def put(self, shape: str, template: str, fixed: List[Optional[str]]):
+        with self._lock:
+            self._templates[shape] = (template, fixed)
+            self._templates.move_to_end(shape)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
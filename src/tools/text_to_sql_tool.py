@@ -1,66 +1,143 @@
 import sys
 import os
+import sqlite3
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(project_root)
 
+import asyncio
 from langchain_community.utilities import SQLDatabase
 from langchain.chains import create_sql_query_chain
-from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
-from operator import itemgetter
+from langchain_core.runnables import RunnableLambda
 
 from src.config import *
+from src.storage.database import get_pool
+from src.tools.sql_cache import SQLTemplateCache, bind_parameters, question_shape, make_template
+from src.tracing import span, traced
 from langchain_google_genai import ChatGoogleGenerativeAI
 
+class SchemaCachedSQLDatabase(SQLDatabase):
+    """SQLDatabase whose table info (schema + sample rows) is built once per table set.
+
+    create_sql_query_chain asks for it on every question; TextToSQLTool replaces the
+    whole object when the SQLite schema version changes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._table_info_cache = {}
+
+    def get_table_info(self, table_names=None, get_col_comments=False) -> str:
+        key = (tuple(table_names) if table_names else None, get_col_comments)
+        if key not in self._table_info_cache:
+            self._table_info_cache[key] = super().get_table_info(table_names, get_col_comments=get_col_comments)
+        return self._table_info_cache[key]
+
+def format_small_result(columns: list, rows: list):
+    """Markdown for empty, scalar and small tabular results; None when the LLM should phrase it."""
+    if not rows:
+        return "I couldn't find any matching information."
+    if len(rows) > SQL_LOCAL_FORMAT_MAX_ROWS or len(columns) > SQL_LOCAL_FORMAT_MAX_COLUMNS:
+        return None
+    if len(rows) == 1 and len(columns) == 1:
+        return f"{columns[0]}: {rows[0][0]}"
+    if len(columns) == 1:
+        return "\n".join(f"- {row[0]}" for row in rows)
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    lines.extend("| " + " | ".join(str(value) for value in row) + " |" for row in rows)
+    return "\n".join(lines)
+
 class TextToSQLTool:
-    def __init__(self, db_path=SQL_DATABASE_PATH):
+    def __init__(self, db_path=SQL_DATABASE_PATH, llm=None):
         print("Đang khởi tạo TextToSQL Tool...")
         if not os.path.exists(db_path):
             raise FileNotFoundError(f"Database file not found at {db_path}. Please run ingest_data.py first.")
             
-        self.db = SQLDatabase.from_uri(f"sqlite:///{db_path}")
-        self.llm = ChatGoogleGenerativeAI(
+        self.db_path = db_path
+        # Generated SQL only ever runs on read-only connections.
+        self.read_pool = get_pool(db_path, read_only=True)
+        self.llm = llm if llm is not None else ChatGoogleGenerativeAI(
             model=MODEL_NAME,
             google_api_key=GOOGLE_API_KEY,
             temperature=0,
             convert_system_message_to_human=True
         )
-        self.chain = self._build_chain()
+        # Repeated question shapes reuse a validated query instead of generating one.
+        self.template_cache = SQLTemplateCache()
+        self.schema_version = None
+        self._refresh_schema()
         print("Initialize Text-to-SQL Tool successful.")
 
+    def _refresh_schema(self):
+        """Rebuild the schema prompt and drop cached templates if the schema changed (DDL)."""
+        with self.read_pool.connection() as conn:
+            schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        if schema_version == self.schema_version:
+            return
+        if self.schema_version is not None:
+            print("Database schema changed, rebuilding the schema prompt.")
+        self.db = SchemaCachedSQLDatabase.from_uri(f"sqlite:///{self.db_path}")
+        self.chain = self._build_chain()
+        self.template_cache.clear()
+        self.schema_version = schema_version
+
     def get_schema(self, _):
         return self.db.get_table_info()
 
     def _build_chain(self):        
         generate_query_chain = create_sql_query_chain(self.llm, self.db)
-        
-        execute_query_tool = QuerySQLDataBaseTool(db=self.db)
 
-        def clean_sql(query_dict):
-            q = query_dict["query"]
+        def clean_sql(q):
             if q.strip().lower().startswith("sqlquery:"):
                 q = q.split(":", 1)[1].strip()
-            return {"query": q}
-
-        sql_chain = (
-            generate_query_chain
-            | RunnableLambda(lambda q: {"query": q})
-            | RunnableLambda(clean_sql)
-            | RunnablePassthrough.assign(
-                result=itemgetter("query") | execute_query_tool
-            )
-        )
-        return sql_chain
-        
-    def execute(self, user_question_and_id) -> str:
+            return q
+
+        return generate_query_chain | RunnableLambda(clean_sql)
+
+    def _run_sql(self, query: str, parameters=None):
+        """(columns, rows, error) of a query; error is None on success."""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.execute(query, parameters or {})
+                rows = cursor.fetchall()
+                columns = [description[0] for description in cursor.description or []]
+            return columns, rows, None
+        except sqlite3.Error as e:
+            return [], [], f"Error: {e}"
+
+    def _remember_template(self, shape: str, literals: list, user_id: str, query: str, rows: list):
+        # An empty result cannot tell a correct template from one whose parameters never match.
+        if not rows:
+            return
+        template = make_template(query, user_id, literals)
+        if template is None:
+            return
+        template_sql, fixed = template
+        # Validated: the template must reproduce the generated query's result.
+        _, template_rows, error = self._run_sql(template_sql, bind_parameters(fixed, literals, user_id))
+        if error is None and template_rows == rows:
+            self.template_cache.put(shape, template_sql, fixed)
+
+    def _cached_query(self, shape: str, literals: list, user_id: str):
+        """(query, parameters, columns, rows) from a cached template, or None."""
+        cached = self.template_cache.get(shape, literals, user_id)
+        if cached is None:
+            return None
+        query, parameters = cached
+        columns, rows, error = self._run_sql(query, parameters)
+        if error is not None:
+            return None
+        print("-> SQL template cache hit.")
+        return query, parameters, columns, rows
+
+    def _parse_input(self, user_question_and_id: str):
         try:
             user_id, question = user_question_and_id.split('|', 1)
         except ValueError:
-            return "Error: Input for TextToSQLTool must be in the format 'user_id|question'."
-            
-        print(f"Đang xử lý câu hỏi từ user '{user_id}' bằng TextToSQL Tool: '{question}'")
-        
-        contextual_question = f"""
+            return None
+        return user_id, question
+
+    def _contextual_question(self, user_id: str, question: str) -> str:
+        return f"""
         The current user is identified by user_id '{user_id}'. 
         All queries MUST be filtered based on this user's permissions.
         To check for permissions, you MUST use the 'User_Workspace_Membership' and 'User_Space_Membership' tables to join with other tables.
@@ -68,25 +145,101 @@ class TextToSQLTool:
         
         User's original question: '{question}'
         """
-        
-        result = self.chain.invoke({"question": contextual_question})
-        
+
+    def _answer_prompt(self, question: str, result: dict) -> str:
         print(f"-> SQL Query: {result['query']}")
         print(f"-> SQL Result: {result['result']}")
         
-        answer_prompt = f"""
+        return f"""
         Based on the user's question: '{question}'
         And the result from the database: '{result['result']}'
         
         Provide a concise, natural language answer.
         If the result is empty or an error, state that you couldn't find the information.
         """
+
+    def _local_answer(self, query: str, columns: list, rows: list, error):
+        if error is not None:
+            return None
+        final_answer = format_small_result(columns, rows)
+        if final_answer is not None:
+            print(f"-> SQL Query: {query}")
+            print(f"-> Formatted {len(rows)} row(s) locally.")
+        return final_answer
+
+    def execute(self, user_question_and_id) -> str:
+        with span("sql.answer"):
+            return self._execute(user_question_and_id)
+
+    def _execute(self, user_question_and_id) -> str:
+        parsed = self._parse_input(user_question_and_id)
+        if parsed is None:
+            return "Error: Input for TextToSQLTool must be in the format 'user_id|question'."
+        user_id, question = parsed
+            
+        print(f"Đang xử lý câu hỏi từ user '{user_id}' bằng TextToSQL Tool: '{question}'")
         
-        final_answer = self.llm.invoke(answer_prompt).content
+        with span("sql.schema_refresh"):
+            self._refresh_schema()
+        shape, literals = question_shape(question)
+        with span("sql.template_lookup") as stage:
+            cached = self._cached_query(shape, literals, user_id)
+            stage.set("hit", cached is not None)
+        if cached is not None:
+            query, _, columns, rows = cached
+            error = None
+        else:
+            with span("sql.generate"):
+                query = self.chain.invoke({"question": self._contextual_question(user_id, question)})
+            with span("sql.execute") as stage:
+                columns, rows, error = self._run_sql(query)
+                stage.set("rows", len(rows))
+            if error is None:
+                with span("sql.validate_template"):
+                    self._remember_template(shape, literals, user_id, query, rows)
+
+        final_answer = self._local_answer(query, columns, rows, error)
+        if final_answer is None:
+            result = {"query": query, "result": error or str(rows)}
+            with span("sql.format_answer"):
+                final_answer = self.llm.invoke(self._answer_prompt(question, result)).content
         print(f"-> Final Answer: {final_answer}")
         
         return final_answer
 
+    async def aexecute(self, user_question_and_id) -> str:
+        """Async `execute`: LLM calls are awaited; SQLite work runs on the default executor."""
+        with span("sql.answer"):
+            return await self._aexecute(user_question_and_id)
+
+    async def _aexecute(self, user_question_and_id) -> str:
+        parsed = self._parse_input(user_question_and_id)
+        if parsed is None:
+            return "Error: Input for TextToSQLTool must be in the format 'user_id|question'."
+        user_id, question = parsed
+
+        print(f"Đang xử lý câu hỏi từ user '{user_id}' bằng TextToSQL Tool: '{question}'")
+
+        await traced("sql.schema_refresh", asyncio.to_thread(self._refresh_schema))
+        shape, literals = question_shape(question)
+        cached = await traced("sql.template_lookup", asyncio.to_thread(self._cached_query, shape, literals, user_id))
+        if cached is not None:
+            query, _, columns, rows = cached
+            error = None
+        else:
+            query = await traced("sql.generate", self.chain.ainvoke({"question": self._contextual_question(user_id, question)}))
+            columns, rows, error = await traced("sql.execute", asyncio.to_thread(self._run_sql, query))
+            if error is None:
+                await traced("sql.validate_template", asyncio.to_thread(self._remember_template, shape, literals, user_id, query, rows))
+
+        final_answer = self._local_answer(query, columns, rows, error)
+        if final_answer is None:
+            result = {"query": query, "result": error or str(rows)}
+            final_answer = (await traced("sql.format_answer", self.llm.ainvoke(self._answer_prompt(question, result)))).content
+        print(f"-> Final Answer: {final_answer}")
+
+        return final_answer
+
 # if __name__ == '__main__':
 #     sql_tool = TextToSQLTool()
 
@@ -0,0 +1,259 @@
+import sys
+import os
+import json
+import time
+import random
+import bisect
+import threading
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+from src.config import *
+
+# Lightweight tracing for the question and ingestion pipelines.
+# `with span("rag.retrieve"):` times a stage: the duration feeds an in-process latency
+# histogram per stage and, with TRACE_FILE_EXPORT, one JSON line per span is appended
+# to TRACE_LOG_PATH (nested spans share a trace_id and point to their parent).
+# `count(...)` increments counters (cache hits, LLM tokens). Metrics are rendered in
+# the Prometheus text format by `render_metrics`, served on METRICS_PORT if set.
+# With tracing disabled, `span` returns a shared no-op object and `count` returns at once.
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    """Cumulative-bucket latency histogram, Prometheus style."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_SECONDS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.total = 0.0
+        self.observations = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.observations += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (None when empty)."""
+        if not self.observations:
+            return None
+        rank = q * self.observations
+        seen = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Metrics:
+    """Thread-safe registry of counters and histograms, keyed by name and labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelSet, float]] = {}
+        self.histograms: Dict[str, Dict[LabelSet, Histogram]] = {}
+
+    def inc(self, name: str, value: float, labels: LabelSet):
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name: str, value: float, labels: LabelSet):
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            if labels not in series:
+                series[labels] = Histogram()
+            series[labels].observe(value)
+
+    def summary(self) -> Dict[str, dict]:
+        """{stage: {"count", "avg", "p50", "p99"}} of the stage latency histogram, in seconds."""
+        with self._lock:
+            series = dict(self.histograms.get("pipeline_stage_seconds", {}))
+            return {
+                dict(labels)["stage"]: {
+                    "count": histogram.observations,
+                    "avg": histogram.total / histogram.observations,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                }
+                for labels, histogram in sorted(series.items())
+            }
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += bucket_count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.observations}")
+        return "\n".join(lines) + "\n"
+
+def _format_labels(labels: LabelSet) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+metrics = Metrics()
+_enabled = TRACING_ENABLED
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_export_lock = threading.Lock()
+
+def _new_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "_start", "_wall_start", "_token")
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.trace_id = parent.trace_id if parent is not None else _new_id()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = _new_id()
+        self._token = _current_span.set(self)
+        self._wall_start = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        metrics.observe("pipeline_stage_seconds", seconds, (("stage", self.name),))
+        if TRACE_FILE_EXPORT:
+            _export(self, seconds)
+        return False
+
+class _NoopSpan:
+    def set(self, key: str, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def _export(finished: Span, seconds: float):
+    record = {
+        "trace_id": finished.trace_id,
+        "span_id": finished.span_id,
+        "parent_id": finished.parent_id,
+        "name": finished.name,
+        "start": finished._wall_start,
+        "duration_ms": round(seconds * 1000, 3),
+        "attributes": finished.attributes,
+    }
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    try:
+        with _export_lock, open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"Could not write trace log: {e}")
+
+def span(name: str, **attributes):
+    """Context manager timing one pipeline stage; nests under the enclosing span."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+async def traced(name: str, awaitable, **attributes):
+    """Await `awaitable` inside a span (for stages run concurrently with asyncio.gather)."""
+    with span(name, **attributes):
+        return await awaitable
+
+def observe(stage: str, seconds: float):
+    """Feed a latency measured outside a span (e.g. time to first token) into the stage histogram."""
+    if _enabled:
+        metrics.observe("pipeline_stage_seconds", seconds, (("stage", stage),))
+
+def count(name: str, value: float = 1, **labels):
+    if _enabled:
+        metrics.inc(name, value, tuple(sorted(labels.items())))
+
+def count_cache(cache: str, hit: bool, value: float = 1):
+    count("cache_requests_total", value, cache=cache, result="hit" if hit else "miss")
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = enabled
+
+def render_metrics() -> str:
+    """All counters and histograms in the Prometheus text exposition format."""
+    return metrics.render()
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """Counts LLM calls and input / output tokens of every LangChain chat model call."""
+
+    def on_llm_end(self, response, **kwargs):
+        if not _enabled:
+            return
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                model = (getattr(message, "response_metadata", None) or {}).get("model_name", "unknown")
+                count("llm_calls_total", model=model)
+                if usage:
+                    count("llm_tokens_total", usage.get("input_tokens", 0), model=model, kind="input")
+                    count("llm_tokens_total", usage.get("output_tokens", 0), model=model, kind="output")
+
+# Attached to every LangChain run in the process, including LLMs built outside this module.
+_token_usage_handler: ContextVar[Optional[TokenUsageHandler]] = ContextVar("token_usage_handler", default=TokenUsageHandler())
+register_configure_hook(_token_usage_handler, inheritable=True)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server_lock = threading.Lock()
+_servers: Dict[int, ThreadingHTTPServer] = {}
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve /metrics on a daemon thread (once per port per process)."""
+    with _server_lock:
+        if port not in _servers:
+            server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _servers[port] = server
+            print(f"Serving metrics on http://{host}:{port}/metrics")
+        return _servers[port]
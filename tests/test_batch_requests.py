@@ -0,0 +1,58 @@
+import sys
+import os
+import sqlite3
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from src.agent import main_agent
+from src.agent.router import RAG_ROUTE
+from src.storage.vector_store import add_to_shard
+from src.tools.rag_tool import NO_ACCESS_MESSAGE, RAGTool
+from src.tools.reranking import Reranker
+
+# Batch requests are (question, user_id) pairs. Only "alice" can read the shard, so a
+# swapped pair checks permissions for the question text and gets no answer.
+QUESTION = "What is the invoice total?"
+
+@pytest.fixture
+def rag_tool(tmp_path):
+    db_path = str(tmp_path / "metadata.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE PDF_Document (id TEXT PRIMARY KEY, filename TEXT NOT NULL, space_id TEXT NOT NULL)")
+    conn.execute("CREATE TABLE User_Space_Membership (user_id TEXT NOT NULL, space_id TEXT NOT NULL, PRIMARY KEY (user_id, space_id))")
+    conn.execute("INSERT INTO PDF_Document VALUES ('doc_1', 'invoice.pdf', 'sp_test')")
+    conn.execute("INSERT INTO User_Space_Membership VALUES ('alice', 'sp_test')")
+    conn.commit()
+    conn.close()
+
+    embeddings = DeterministicFakeEmbedding(size=16)
+    vector_store_path = str(tmp_path / "faiss_index")
+    chunks = [
+        Document(page_content=f"File name: invoice.pdf. Nội dung: invoice total {i * 10}", metadata={"source": "invoice.pdf", "page": 0})
+        for i in range(5)
+    ]
+    add_to_shard("sp_test", chunks, embeddings, vector_store_path, compact_in_background=False)
+    return RAGTool(
+        vector_store_path=vector_store_path,
+        db_path=db_path,
+        embeddings=embeddings,
+        llm=FakeListChatModel(responses=["fake answer"]),
+        reranker=Reranker(backend="score", fallback_backend="score"),
+    )
+
+def test_answer_batch_takes_question_then_user_id(rag_tool):
+    answers = rag_tool.answer_batch([(QUESTION, "alice"), (QUESTION, "bob")])
+    assert answers == ["fake answer", NO_ACCESS_MESSAGE]
+
+def test_run_batch_passes_question_then_user_id(rag_tool, monkeypatch):
+    agent = object.__new__(main_agent.MainAgent)
+    agent.router = None
+    monkeypatch.setattr(agent, "_choose_route", lambda user_question: (RAG_ROUTE, 1.0))
+    monkeypatch.setattr(main_agent, "rag_tool_instance", rag_tool)
+    assert agent.run_batch([(QUESTION, "alice"), (QUESTION, "bob")]) == ["fake answer", NO_ACCESS_MESSAGE]